@@ -0,0 +1,184 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+import numpy as np
+
+# Default time, in seconds, for which cached entries are valid
+DEFAULT_TTL = 300
+
+# Default maximum number of cached entries
+DEFAULT_MAX_ENTRIES = 256
+
+# Default interval, in seconds, between checks of the calibration version of a station in the database
+DEFAULT_VERSION_CHECK_INTERVAL = 5
+
+
+class CalibrationCache(object):
+    """ Process-wide read-through cache for calibration database lookups.
+
+    Entries are stored per station and expire after a TTL, with least recently used entries evicted when the cache
+    is full. Every write to the calibration database bumps a per-station version counter, and entries cached for
+    an older version are discarded. Writes in this process invalidate the station immediately, writes by other
+    processes are detected when the database version is checked, at most once per version check interval.
+
+    The backend performs the actual lookups and must provide get_station_information, get_antenna_positions,
+    get_latest_calibration_solution, get_calibration_solution and get_calibration_version, with the same
+    signatures as in aavs_calibration.common. Tests can use an in-memory fake backend. """
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 version_check_interval=DEFAULT_VERSION_CHECK_INTERVAL):
+        """ Class constructor
+        :param backend: Lookup backend, defaults to aavs_calibration.common
+        :param ttl: Time, in seconds, for which entries are valid
+        :param max_entries: Maximum number of cached entries
+        :param version_check_interval: Interval, in seconds, between database version checks for a station """
+
+        if backend is None:
+            from aavs_calibration import common as backend
+
+        self._backend = backend
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._version_check_interval = version_check_interval
+
+        # Cached entries, in least to most recently used order. Map (station, lookup, arguments) keys
+        # to (version, time, value) tuples
+        self._entries = OrderedDict()
+
+        # Map station to (version, last version check time) tuples
+        self._versions = {}
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_station_information(self, station):
+        """ Get station information
+        :param station: Station identifier """
+        return self._lookup(station, 'get_station_information')
+
+    def get_antenna_positions(self, station):
+        """ Get antenna positions for a given station id
+        :param station: Station identifier """
+        return self._lookup(station, 'get_antenna_positions')
+
+    def get_latest_calibration_solution(self, station, include_delays=False):
+        """ Get the latest calibration solution
+        :param station: Station identifier
+        :param include_delays: Include phase delays in return """
+        return self._lookup(station, 'get_latest_calibration_solution', include_delays)
+
+    def get_calibration_solution(self, station, timestamp):
+        """ Get the calibration coefficients closest to the provided timestamp
+        :param station: The station identifier
+        :param timestamp: Timestamp closest to which coefficients are required """
+        return self._lookup(station, 'get_calibration_solution', timestamp)
+
+    def invalidate(self, station=None):
+        """ Discard cached entries
+        :param station: Station for which entries are discarded, all stations if None """
+        with self._lock:
+            if station is None:
+                self._entries.clear()
+                self._versions.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == station]:
+                    del self._entries[key]
+                self._versions.pop(station, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, station, lookup, *arguments):
+        """ Get a value from the cache, or from the backend if not cached or not valid
+        :param station: Station identifier
+        :param lookup: Name of backend lookup function
+        :param arguments: Additional lookup arguments
+        :return: Copy of the looked up value """
+
+        key = (station, lookup) + arguments
+        version = self._station_version(station)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and time.time() - entry[1] < self._ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy_value(entry[2])
+            self.misses += 1
+
+        value = getattr(self._backend, lookup)(station, *arguments)
+
+        # Do not cache failed lookups
+        if value is None:
+            return value
+
+        with self._lock:
+            self._entries[key] = (version, time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return _copy_value(value)
+
+    def _station_version(self, station):
+        """ Get the calibration version of a station, checking the backend if the last check is too old
+        :param station: Station identifier """
+
+        now = time.time()
+        with self._lock:
+            version = self._versions.get(station)
+            if version is not None and now - version[1] < self._version_check_interval:
+                return version[0]
+
+        try:
+            current = self._backend.get_calibration_version(station)
+        except Exception as e:
+            logging.warning("Could not get calibration version for station {} ({})".format(station, e))
+            current = None
+
+        with self._lock:
+            self._versions[station] = (current, now)
+        return current
+
+
+def _copy_value(value):
+    """ Copy mutable containers in a cached value, so that callers can modify returned values """
+    if isinstance(value, tuple):
+        return tuple(_copy_value(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+# Process-wide cache, created on first use
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ Get the process-wide calibration cache """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CalibrationCache()
+        return _cache
+
+
+def set_cache(cache):
+    """ Replace the process-wide calibration cache, for example with one using a fake backend
+    :param cache: CalibrationCache instance, or None to create a default cache on next use """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def invalidate(station=None):
+    """ Discard entries of the process-wide calibration cache, if it was created
+    :param station: Station for which entries are discarded, all stations if None """
+    if _cache is not None:
+        _cache.invalidate(station)
@@ -1,16 +1,20 @@
 from builtins import next
 import logging
 
-from aavs_calibration import database
+from aavs_calibration import cache, database
 from aavs_calibration.definitions import *
 from aavs_calibration.models import CalibrationSolution, Station, CalibrationCoefficient
 
+from bson.binary import Binary
 import numpy as np
 import pymongo
 
 # Connect to database (once for thread safety)
 db = database.connect()
 
+# Documents for which indexes have been created in this process
+_indexed_documents = set()
+
 
 def change_antenna_status(station_id, base_id, polarisation, status):
     """ Change the status of an antenna """
@@ -84,9 +88,64 @@ def get_station_information(station):
     return station.first()
 
 
+def get_calibration_version(station):
+    """ Get the calibration version of a station, which is incremented on every calibration write
+    :param station: Station identifier
+    :return: Version number, 0 if the station was never written to """
+    entry = db.calibration_version.find_one({'station': station}, {'version': 1, '_id': 0})
+    return 0 if entry is None else entry['version']
+
+
+def _calibration_updated(station):
+    """ Increment the calibration version of a station and invalidate cached entries for the station
+    :param station: Station identifier """
+    db.calibration_version.update_one({'station': station}, {'$inc': {'version': 1}}, upsert=True)
+    cache.invalidate(station)
+
+
+def encode_array(values, dtype):
+    """ Encode an array as raw bytes for compact storage
+    :param values: Array values
+    :param dtype: numpy type with which values are stored
+    :return: BSON binary with array bytes """
+    return Binary(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+
+def decode_array(data, dtype):
+    """ Decode an array stored with encode_array
+    :param data: Array bytes
+    :param dtype: numpy type string with which values were stored
+    :return: Array of type dtype """
+    return np.frombuffer(data, dtype=np.dtype(dtype))
+
+
+def calibration_solution_arrays(entry):
+    """ Get amplitude and phase arrays from a calibration solution entry stored as lists or with compact encoding
+    :param entry: Calibration solution document as dictionary
+    :return: amplitude and phase arrays """
+    if entry.get('amplitude_data') is not None:
+        return (decode_array(entry['amplitude_data'], entry['data_type']),
+                decode_array(entry['phase_data'], entry['data_type']))
+    return np.array(entry['amplitude'], dtype=float), np.array(entry['phase'], dtype=float)
+
+
+def calibration_coefficient_array(entry):
+    """ Get complex coefficients from a calibration coefficient entry stored as lists or with compact encoding
+    :param entry: Calibration coefficient document as dictionary
+    :return: complex coefficient array """
+    if entry.get('calibration_coefficients_data') is not None:
+        return decode_array(entry['calibration_coefficients_data'], entry['data_type'])
+    return np.array(entry['calibration_coefficients_real']) + np.array(entry['calibration_coefficients_imag']) * 1j
+
+
+def _optional_float(value):
+    """ Convert value to float for storage, keeping None """
+    return None if value is None else float(value)
+
+
 def add_new_calibration_solution(station, acquisition_time, solution, comment="",
-                                 delay_x=None, phase_x=None, delay_y=None, phase_y=None):
-    """ Add a new calibration fit to the database.
+                                 delay_x=None, phase_x=None, delay_y=None, phase_y=None, compact=False):
+    """ Add a new calibration fit to the database. Solutions for all antennas are written with a single bulk insert.
     :param station: Station identifier
     :param acquisition_time: The time at which the data was acquired
     :param solution: A 4D array containing the computed solutions. The array should be
@@ -96,159 +155,206 @@ def add_new_calibration_solution(station, acquisition_time, solution, comment=""
     :param delay_x: Computed solution gradient for X pol, all antennas
     :param phase_x: Computed solution intercept for X pol, all antennas
     :param delay_y: Computed solution gradient for Y pol, all antennas
-    :param phase_y: Computed solution intercept for Y pol, all antennas"""
+    :param phase_y: Computed solution intercept for Y pol, all antennas
+    :param compact: Store amplitude and phase as float32 binary arrays rather than lists"""
 
     # Convert timestamps
     acquisition_time = convert_timestamp_to_datetime(acquisition_time)
     fit_time = datetime.utcnow()
 
     # Grab all antenna for station and sort in order in which fits are provided
-    station = Station.objects(name=station)
+    antennas = _get_station_antennas(station)
 
-    if len(station) == 0:
+    if antennas is None:
         logging.warning("Station {} not found in calibration database, not adding new calibration solutions")
-
-    station_info = station.first()
-    antennas = db.antenna.find({'station_id': station_info.id}).sort("antenna_station_id", pymongo.ASCENDING)
+        return
 
     # Sanity checks on delay and phase values
-    if delay_x is not None and len(delay_x) != antennas.count():
+    if delay_x is not None and len(delay_x) != len(antennas):
         logging.warning("Number of delay and phase values does not match number of antennas. Ignoring")
-        delay_x = delay_y = phase_x = phase_y = [None] * antennas.count()
+        delay_x = delay_y = phase_x = phase_y = [None] * len(antennas)
     elif delay_y is None:
-        delay_x = delay_y = phase_x = phase_y = [None] * antennas.count()
+        delay_x = delay_y = phase_x = phase_y = [None] * len(antennas)
 
-    # Loop over all antennas and save solutions to database
+    # Create X and Y fit solutions for all antennas
+    data_type = np.dtype(np.float32).str
+    documents = []
     for antenna in antennas:
         # Use base index to select correct antenna coefficients
         base_index = antenna['base_id'] - 1
 
-        # Create X and Y fit solutions
-        CalibrationSolution(acquisition_time=acquisition_time,
-                            fit_time=fit_time,
-                            pol=0,
-                            antenna_id=antenna['_id'],
-                            fit_comment=comment,
-                            flags='',
-                            amplitude=solution[base_index, 0, :, 0],
-                            phase=solution[base_index, 0, :, 1],
-                            phase_0=phase_x[base_index],
-                            delay=delay_x[base_index]).save()
-
-        CalibrationSolution(acquisition_time=acquisition_time,
-                            fit_time=fit_time,
-                            pol=1,
-                            antenna_id=antenna['_id'],
-                            fit_comment=comment,
-                            flags='',
-                            amplitude=solution[base_index, 1, :, 0],
-                            phase=solution[base_index, 1, :, 1],
-                            phase_0=phase_y[base_index],
-                            delay=delay_y[base_index]).save()
-
-
-def add_coefficient_download(station, download_time, coefficients):
-    """ Add a new calibration download entry to the database.
+        for pol, phase_0, delay in [(0, phase_x, delay_x), (1, phase_y, delay_y)]:
+            document = {'acquisition_time': acquisition_time,
+                        'fit_time': fit_time,
+                        'pol': pol,
+                        'antenna_id': antenna['_id'],
+                        'fit_comment': comment,
+                        'flags': '',
+                        'phase_0': _optional_float(phase_0[base_index]),
+                        'delay': _optional_float(delay[base_index])}
+
+            if compact:
+                document['amplitude_data'] = encode_array(solution[base_index, pol, :, 0], data_type)
+                document['phase_data'] = encode_array(solution[base_index, pol, :, 1], data_type)
+                document['data_type'] = data_type
+            else:
+                document['amplitude'] = np.asarray(solution[base_index, pol, :, 0], dtype=float).tolist()
+                document['phase'] = np.asarray(solution[base_index, pol, :, 1], dtype=float).tolist()
+
+            documents.append(document)
+
+    # Save solutions to database
+    _ensure_indexes(CalibrationSolution)
+    if len(documents) > 0:
+        db.calibration_solution.insert_many(documents, ordered=False)
+        _calibration_updated(station)
+
+
+def add_coefficient_download(station, download_time, coefficients, compact=False):
+    """ Add a new calibration download entry to the database. Coefficients for all antennas are written with a
+    single bulk insert.
     :param station: Station identifier
     :param download_time: Time at which coefficients were downloaded to the station
     :param coefficients: A 3D array containing the complex coefficients downloaded to the station.
-                         The array should be in antenna/pol/frequency order."""
+                         The array should be in antenna/pol/frequency order.
+    :param compact: Store coefficients as a complex64 binary array rather than lists"""
 
     # Convert timestamps
     download_time = convert_timestamp_to_datetime(download_time)
 
     # Grab all antenna for station and sort in order in which fits are provided
-    station = Station.objects(name=station)
+    antennas = _get_station_antennas(station)
 
-    if len(station) == 0:
+    if antennas is None:
         logging.warning("Station {} not found in calibration database, not adding new downloaded coefficients")
+        return
 
-    station_info = station.first()
-    antennas = db.antenna.find({'station_id': station_info.id}).sort("antenna_station_id", pymongo.ASCENDING)
-
+    data_type = np.dtype(np.complex64).str
+    documents = []
     for a, antenna in enumerate(antennas):
-        CalibrationCoefficient(antenna_id=antenna['_id'],
-                               pol=0,
-                               calibration_coefficients_real=coefficients[a, 0, :].real,
-                               calibration_coefficients_imag=coefficients[a, 0, :].imag,
-                               download_time=download_time).save()
-
-        CalibrationCoefficient(antenna_id=antenna['_id'],
-                               pol=1,
-                               calibration_coefficients_real=coefficients[a, 1, :].real,
-                               calibration_coefficients_imag=coefficients[a, 1, :].imag,
-                               download_time=download_time).save()
-
-
-def get_latest_calibration_solution(station, include_delays=False):
-    """ Get the latest calibration solution
+        for pol in range(2):
+            document = {'antenna_id': antenna['_id'],
+                        'pol': pol,
+                        'download_time': download_time}
+
+            if compact:
+                document['calibration_coefficients_data'] = encode_array(coefficients[a, pol, :], data_type)
+                document['data_type'] = data_type
+            else:
+                document['calibration_coefficients_real'] = np.asarray(coefficients[a, pol, :].real,
+                                                                       dtype=float).tolist()
+                document['calibration_coefficients_imag'] = np.asarray(coefficients[a, pol, :].imag,
+                                                                       dtype=float).tolist()
+
+            documents.append(document)
+
+    # Save coefficients to database
+    _ensure_indexes(CalibrationCoefficient)
+    if len(documents) > 0:
+        db.calibration_coefficient.insert_many(documents, ordered=False)
+        _calibration_updated(station)
+
+
+def _get_station_antennas(station):
+    """ Get the antennas of a station, sorted by antenna station id
     :param station: Station identifier
-    :param include_delays: Include phase delays in return"""
+    :return: List of antenna documents, or None if station is not found """
 
-    # Grab all antenna for station and sort in order in which fits are provided
     station = Station.objects(name=station)
-
     if len(station) == 0:
-        logging.warning("Station {} not found in calibration database, not grabbing calibration solutions")
+        return None
 
     station_info = station.first()
-    antennas = db.antenna.find({'station_id': station_info.id}).sort("antenna_station_id", pymongo.ASCENDING)
-
-    # Generate arrays to store amp and phase
-    amplitudes = np.zeros((antennas.count(), 2, 512))
-    phases = np.zeros((antennas.count(), 2, 512))
-
-    phase0, delays = None, None
-    if include_delays:
-        phase0 = np.zeros((antennas.count(), 2))
-        delays = np.zeros((antennas.count(), 2))
-
-    # Loop over all antennas
-    for antenna in antennas:
+    return list(db.antenna.find({'station_id': station_info.id},
+                                {'_id': 1, 'antenna_station_id': 1, 'base_id': 1}).sort("antenna_station_id",
+                                                                                        pymongo.ASCENDING))
+
+
+def _ensure_indexes(document):
+    """ Create the indexes of a document, if not already created, before running raw queries and writes
+    which rely on them (mongoengine only creates indexes when documents are accessed through the model)
+    :param document: mongoengine Document class """
+    if document not in _indexed_documents:
+        document.ensure_indexes()
+        _indexed_documents.add(document)
+
+
+def _solutions_to_arrays(antennas, entries, include_delays=False):
+    """ Arrange calibration solution entries into antenna/pol/frequency arrays
+    :param antennas: Station antennas, as returned by _get_station_antennas
+    :param entries: Iterable of solution entries with antenna_id, pol, amplitude and phase (as lists or with
+                    compact encoding), delay and phase_0 fields
+    :param include_delays: Include phase delays in return
+    :return: amplitudes and phases arrays, and phase0 and delays arrays if include_delays is set """
+
+    antenna_index = {antenna['_id']: antenna['antenna_station_id'] for antenna in antennas}
+
+    # Collect entries and assign all of them to the output arrays at once
+    indices, pols, amplitude_values, phase_values, phase0_values, delay_values = [], [], [], [], [], []
+    for entry in entries:
+        if entry['antenna_id'] not in antenna_index:
+            continue
+        amplitude, phase = calibration_solution_arrays(entry)
+        indices.append(antenna_index[entry['antenna_id']])
+        pols.append(entry['pol'])
+        amplitude_values.append(amplitude)
+        phase_values.append(phase)
+        if include_delays:
+            phase0_values.append(entry.get('phase_0'))
+            delay_values.append(entry.get('delay'))
+
+    # Generate arrays to store amp and phase. If there are no entries for an antenna/pol, set to 0
+    amplitudes = np.zeros((len(antennas), 2, 512))
+    phases = np.zeros((len(antennas), 2, 512))
+    if len(indices) > 0:
+        amplitudes[indices, pols, :] = amplitude_values
+        phases[indices, pols, :] = phase_values
+
+    if not include_delays:
+        return amplitudes, phases
 
-        # Grab values for polarisation X
-        results = db.calibration_solution.aggregate([
-            {'$sort': {'acquisition_time': -1, 'fit_time': -1}},
-            {'$match': {'antenna_id': antenna['_id'], 'pol': 0}},
-            {'$limit': 1}])
+    phase0 = np.zeros((len(antennas), 2))
+    delays = np.zeros((len(antennas), 2))
+    if len(indices) > 0:
+        # Missing delay and phase values are stored as None, set to 0
+        phase0[indices, pols] = np.nan_to_num(np.array(phase0_values, dtype=float))
+        delays[indices, pols] = np.nan_to_num(np.array(delay_values, dtype=float))
 
-        # If there are no entries for this antenna/pol, set to 0
-        try:
-            entry = next(results)
+    return amplitudes, phases, phase0, delays
 
-            amplitudes[antenna['antenna_station_id'], 0, :] = entry['amplitude']
-            phases[antenna['antenna_station_id'], 0, :] = entry['phase']
 
-            if include_delays:
-                delays[antenna['antenna_station_id'], 0] = entry['delay']
-                phase0[antenna['antenna_station_id'], 0] = entry['phase_0']
+def get_latest_calibration_solution(station, include_delays=False):
+    """ Get the latest calibration solution for every antenna and polarisation of a station. The latest
+    solution of each antenna/pol is selected with a single $match/$sort/$group pipeline, which is
+    served by the (antenna_id, pol, acquisition_time, fit_time) index of the calibration_solution collection
+    :param station: Station identifier
+    :param include_delays: Include phase delays in return"""
 
-        except StopIteration:
-            pass
+    # Grab all antenna for station and sort in order in which fits are provided
+    antennas = _get_station_antennas(station)
 
-        # Grab values for polarisation Y
-        results = db.calibration_solution.aggregate([
-            {'$sort': {'acquisition_time': -1, 'fit_time': -1}},
-            {'$match': {'antenna_id': antenna['_id'], 'pol': 1}},
-            {'$limit': 1}])
+    if antennas is None:
+        logging.warning("Station {} not found in calibration database, not grabbing calibration solutions")
+        return
 
-        # If there are not entries for this antenna/pol, set to 0
-        try:
-            entry = next(results)
+    _ensure_indexes(CalibrationSolution)
 
-            amplitudes[antenna['antenna_station_id'], 1, :] = entry['amplitude']
-            phases[antenna['antenna_station_id'], 1, :] = entry['phase']
+    # Select the newest solution for each antenna/pol
+    fields = ['amplitude', 'phase', 'amplitude_data', 'phase_data', 'data_type']
+    if include_delays:
+        fields += ['delay', 'phase_0']
+    group = {'_id': {'antenna_id': '$antenna_id', 'pol': '$pol'}}
+    group.update({field: {'$first': '$' + field} for field in fields})
 
-            if include_delays:
-                delays[antenna['antenna_station_id'], 1] = entry['delay']
-                phase0[antenna['antenna_station_id'], 1] = entry['phase_0']
-        except StopIteration:
-            pass
+    results = db.calibration_solution.aggregate([
+        {'$match': {'antenna_id': {'$in': [antenna['_id'] for antenna in antennas]}}},
+        {'$sort': {'antenna_id': 1, 'pol': 1, 'acquisition_time': -1, 'fit_time': -1}},
+        {'$group': group},
+        {'$project': dict({'_id': 0, 'antenna_id': '$_id.antenna_id', 'pol': '$_id.pol'},
+                          **{field: 1 for field in fields})}],
+        allowDiskUse=True)
 
-    if include_delays:
-        return amplitudes, phases, phase0, delays
-    else:
-        return amplitudes, phases
+    return _solutions_to_arrays(antennas, results, include_delays)
 
 
 def get_calibration_solution(station, timestamp):
@@ -257,19 +363,12 @@ def get_calibration_solution(station, timestamp):
     :param timestamp: Timestamp closest to which coefficients are required"""
 
     # Grab all antenna for station and sort in order in which firs are provided
-    station = Station.objects(name=station)
+    antennas = _get_station_antennas(station)
 
-    if len(station) == 0:
+    if antennas is None:
         logging.warning("Station {} not found in calibration database, not grabbing calibration solutions")
         return
 
-    station_info = station.first()
-    antennas = db.antenna.find({'station_id': station_info.id}).sort("antenna_station_id", pymongo.ASCENDING)
-
-    # Generate arrays to store amp and phase
-    amplitudes = np.zeros((antennas.count(), 2, 512))
-    phases = np.zeros((antennas.count(), 2, 512))
-
     # Create datetime object from timestamp
     if type(timestamp) is float:
         timestamp = datetime.utcfromtimestamp(timestamp)
@@ -277,18 +376,22 @@ def get_calibration_solution(station, timestamp):
         logging.warning("Invalid timestamp type, not grabbing calibration solutions")
         return
 
-    # Get the acquisition time closest to the provided timestamp and
+    _ensure_indexes(CalibrationSolution)
+    antenna_ids = [antenna['_id'] for antenna in antennas]
+
+    # Get the acquisition time of the station closest to the provided timestamp and
     # latest fit time for that acquisition
     result = db.calibration_solution.aggregate([
+        {'$match': {'antenna_id': {'$in': antenna_ids}}},
         {
             '$project': {
                 'acquisition_time': 1,
                 'fit_time': 1,
                 'difference': {'$abs': {'$subtract': [timestamp, "$acquisition_time"]}} }
         },
-        {'$sort': {'difference': 1}},
+        {'$sort': {'difference': 1, 'fit_time': -1}},
         {'$limit': 1}
-    ])
+    ], allowDiskUse=True)
 
     try:
         entry = next(result)
@@ -299,77 +402,48 @@ def get_calibration_solution(station, timestamp):
         logging.error("No solutions found in database")
         return None, None
 
-    # Loop over antennas
-    for antenna in antennas:
-
-        # Grab solution for current antenna for pol X
-        solution = CalibrationSolution.objects(acquisition_time=acquisition_time,
-                                               fit_time=fit_time,
-                                               antenna_id=antenna['_id'],
-                                               pol=0)
-
-        if len(solution) != 1:
-            continue
-
-        entry = solution.first()
-        amplitudes[antenna['antenna_station_id'], 0, :] = entry.amplitude
-        phases[antenna['antenna_station_id'], 0, :] = entry.phase
-
-        # Grab solution for current antenna for pol Y
-        solution = CalibrationSolution.objects(acquisition_time=acquisition_time,
-                                               fit_time=fit_time,
-                                               antenna_id=antenna['_id'],
-                                               pol=1)
-
-        if len(solution) != 1:
-            continue
-
-        entry = solution.first()
-        amplitudes[antenna['antenna_station_id'], 1, :] = entry.amplitude
-        phases[antenna['antenna_station_id'], 1, :] = entry.phase
+    # Grab solutions for all antennas and pols in a single query
+    results = db.calibration_solution.find({'antenna_id': {'$in': antenna_ids},
+                                            'acquisition_time': acquisition_time,
+                                            'fit_time': fit_time},
+                                           {'_id': 0, 'antenna_id': 1, 'pol': 1, 'amplitude': 1, 'phase': 1,
+                                            'amplitude_data': 1, 'phase_data': 1, 'data_type': 1})
 
-    return amplitudes, phases
+    return _solutions_to_arrays(antennas, results)
 
 
 def get_latest_coefficient_download(station):
-    """ Get the latest downloaded calibration coefficients to the station
+    """ Get the latest downloaded calibration coefficients to the station. The latest coefficients of each
+    antenna/pol are selected with a single $match/$sort/$group pipeline
     :param station: The station identifier  """
 
     # Grab all antenna for station and sort in order in which fits are provided
-    station = Station.objects(name=station)
-
-    if len(station) == 0:
-        logging.warning("Station {} not found in calibration database, not adding new calibration solutions")
+    antennas = _get_station_antennas(station)
 
-    station_info = station.first()
-    antennas = db.antenna.find({'station_id': station_info.id}).sort("antenna_station_id", pymongo.ASCENDING)
-
-    # Generate arrays to store amp and phase
-    coefficients = np.empty((antennas.count(), 2, 512), dtype=np.complex64)
+    if antennas is None:
+        logging.warning("Station {} not found in calibration database, not grabbing downloaded coefficients")
+        return
 
-    # Loop over all antennas
-    for antenna in antennas:
-        # Grab values for polarisation X
-        results = db.calibration_coefficient.aggregate([
-            {'$sort': {'download_time': -1}},
-            {'$match': {'antenna_id': antenna['_id'], 'pol': 0}},
-            {'$limit': 1}])
-        entry = next(results)
-
-        values = np.array(entry['calibration_coefficients_real']) + np.array(
-            entry['calibration_coefficients_real']) * 1j
-        coefficients[antenna['antenna_station_id'], 0, :] = values
-
-        # Grab values for polarisation Y
-        results = db.calibration_coefficient.aggregate([
-            {'$sort': {'download_time': -1}},
-            {'$match': {'antenna_id': antenna['_id'], 'pol': 1}},
-            {'$limit': 1}])
-        entry = next(results)
-
-        values = np.array(entry['calibration_coefficients_real']) + np.array(
-            entry['calibration_coefficients_real']) * 1j
-        coefficients[antenna['antenna_station_id'], 0, :] = values
+    _ensure_indexes(CalibrationCoefficient)
+    antenna_index = {antenna['_id']: antenna['antenna_station_id'] for antenna in antennas}
+
+    # Select the newest coefficients for each antenna/pol
+    fields = ['calibration_coefficients_real', 'calibration_coefficients_imag',
+              'calibration_coefficients_data', 'data_type']
+    group = {'_id': {'antenna_id': '$antenna_id', 'pol': '$pol'}}
+    group.update({field: {'$first': '$' + field} for field in fields})
+
+    results = db.calibration_coefficient.aggregate([
+        {'$match': {'antenna_id': {'$in': list(antenna_index.keys())}}},
+        {'$sort': {'antenna_id': 1, 'pol': 1, 'download_time': -1}},
+        {'$group': group}],
+        allowDiskUse=True)
+
+    # Generate arrays to store coefficients
+    coefficients = np.zeros((len(antennas), 2, 512), dtype=np.complex64)
+    for entry in results:
+        coefficients[antenna_index[entry['_id']['antenna_id']], entry['_id']['pol'], :] = \
+            calibration_coefficient_array(entry)
 
     return coefficients
 
@@ -1,5 +1,6 @@
 from builtins import str
-from mongoengine import Document, IntField, FloatField, StringField, ObjectIdField, ListField, DateTimeField
+from mongoengine import Document, IntField, FloatField, StringField, ObjectIdField, ListField, DateTimeField, \
+    BinaryField
 from aavs_calibration.definitions import *
 
 
@@ -81,10 +82,16 @@ class CalibrationSolution(Document):
     fit_time = DateTimeField(required=True)
 
     # Amplitude for each frequency channel
-    amplitude = ListField(required=True)
+    amplitude = ListField()
 
     # Phase for each frequency channel
-    phase = ListField(required=True)
+    phase = ListField()
+
+    # Compact encoding of amplitude and phase, stored instead of the lists as raw array bytes of type data_type
+    # (numpy dtype string). Use calibration_solution_arrays in common to decode either encoding
+    amplitude_data = BinaryField()
+    phase_data = BinaryField()
+    data_type = StringField()
 
     # Compute phase_0 and delay for entire frequency range for given antenna/polarisation
     phase_0 = FloatField()
@@ -94,8 +101,10 @@ class CalibrationSolution(Document):
     fit_comment = StringField()
     flags = StringField()
 
-    # Create an index on fit_time and acquisition_time, in descending order (later one first)
-    meta = {'indexes': [{'fields': ['-fit_time', '-acquisition_time']}]}
+    # Create an index on fit_time and acquisition_time, in descending order (later one first), and a
+    # compound index to select the latest solution for each antenna and polarisation
+    meta = {'indexes': [{'fields': ['-fit_time', '-acquisition_time']},
+                        {'fields': ['antenna_id', 'pol', '-acquisition_time', '-fit_time']}]}
 
     def get_acquisition_time(self):
         """ Returns datetime of the timestamp including time zone info """
@@ -129,12 +138,20 @@ class CalibrationCoefficient(Document):
     pol = IntField(required=True)
 
     # List of complex coefficients, use set_calibrations to store and get_calibrations to retrieve
-    calibration_coefficients_real = ListField(required=True)
-    calibration_coefficients_imag = ListField(required=True)
+    calibration_coefficients_real = ListField()
+    calibration_coefficients_imag = ListField()
+
+    # Compact encoding of coefficients, stored instead of the lists as raw array bytes of type data_type
+    # (numpy dtype string). Use calibration_coefficient_array in common to decode either encoding
+    calibration_coefficients_data = BinaryField()
+    data_type = StringField()
 
     # UNIX timestamp, use function to get_download_time to get datetime with timezone info
     download_time = DateTimeField(required=True)
 
+    # Create an index to select the latest coefficients for each antenna and polarisation
+    meta = {'indexes': [{'fields': ['antenna_id', 'pol', '-download_time']}]}
+
     def get_download_time(self):
         """ Returns datetime of the timestamp including time zone info """
         return convert_timestamp_to_datetime(self.download_time)
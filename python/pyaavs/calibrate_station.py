@@ -167,20 +167,15 @@ def download_coefficients(config, coefficients):
     aavs_station = station.Station(station.configuration)
     aavs_station.connect()
 
-    # Download coefficients
-    t0 = time.time()
-    for i, tile in enumerate(aavs_station.tiles):
-        # Get coefficients range for current tile
-        for antenna in range(nof_antennas_per_tile):
-            tile.load_calibration_coefficients(antenna,
-                                               coefficients[i * nof_antennas_per_tile + antenna, :, :].tolist())
-    t1 = time.time()
-
-    logging.info("Downloaded coefficients to tiles in {0:.2}s".format(t1 - t0))
-
-    # Done downloading coefficient, switch calibration bank
-    aavs_station.switch_calibration_banks(2048)  # About 0.5 seconds
-    logging.info("Switched calibration banks")
+    # Download coefficients to all tiles in parallel
+    aavs_station.download_calibration_coefficients(coefficients)
+
+    # Done downloading coefficient, switch calibration bank. False is returned if no switch frame far enough ahead
+    # could be found, in which case no tile is switched
+    if aavs_station.switch_calibration_banks(2048):  # About 0.5 seconds
+        logging.info("Switched calibration banks")
+    else:
+        logging.error("Calibration banks not switched")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the SKA Low MCCS project
+#
+#
+#
+# Distributed under the terms of the GPL license.
+# See LICENSE.txt for more info.
+"""
+Background polling of TPM health monitoring points.
+
+Monitoring points are tagged with a rate attribute in the monitoring point
+lookup (see tpm_1_X_monitoring_point_lookup and set_monitoring_point_attr).
+HealthMonitoringScheduler polls all monitoring points of each rate on all
+tiles at the period configured for that rate, and stores the results in a
+HealthStatusStore from which clients read the latest values without
+accessing the hardware.
+"""
+
+from multiprocessing.pool import ThreadPool
+import threading
+import logging
+import time
+
+# Default polling period, in seconds, of each rate
+DEFAULT_RATE_PERIODS = {'fast': 1.0, 'slow': 10.0}
+
+
+class HealthStatusStore():
+    """
+    Latest value store for monitoring points of a set of tiles.
+
+    Each tile has a dictionary mapping monitoring points to (value, timestamp)
+    tuples. Writers never modify a published dictionary, they publish an updated
+    copy, so readers do not need any locking and always see a complete update.
+    Writes for the same tile must be serialised by the caller.
+    """
+
+    def __init__(self):
+        """
+        Constructor for an empty store.
+        """
+        self._values = {}
+
+    def update(self, tile_id, values, timestamp):
+        """
+        Publish new monitoring point values for a tile.
+
+        :param tile_id: Tile identifier
+        :param values: monitoring point values
+        :type values: dict
+        :param timestamp: time at which the values were read
+        :type timestamp: float
+        """
+        tile_values = dict(self._values.get(tile_id, {}))
+        for monitoring_point, value in values.items():
+            tile_values[monitoring_point] = (value, timestamp)
+        self._values[tile_id] = tile_values
+
+    def tiles(self):
+        """
+        :return: identifiers of tiles with values in the store
+        :rtype: list
+        """
+        return list(self._values.keys())
+
+    def get_value(self, tile_id, monitoring_point):
+        """
+        Get the latest value of a monitoring point.
+
+        :param tile_id: Tile identifier
+        :param monitoring_point: Monitoring point, for example 'voltages.VIN'
+        :type monitoring_point: str
+
+        :return: (value, timestamp) tuple, or None if the monitoring point was not read yet
+        :rtype: tuple
+        """
+        return self._values.get(tile_id, {}).get(monitoring_point)
+
+    def get_values(self, tile_id):
+        """
+        Get the latest value of all monitoring points of a tile.
+
+        :param tile_id: Tile identifier
+
+        :return: monitoring point to (value, timestamp) dictionary
+        :rtype: dict
+        """
+        return self._values.get(tile_id, {})
+
+    def get_health_status(self, tile_id):
+        """
+        Get the latest value of all monitoring points of a tile as a nested
+        dictionary, in the same format as TileHealthMonitor.get_health_status.
+
+        :param tile_id: Tile identifier
+
+        :return: health status
+        :rtype: dict
+        """
+        health_status = {}
+        for monitoring_point, (value, _) in self.get_values(tile_id).items():
+            current_dict = health_status
+            keys = monitoring_point.split('.')
+            for key in keys[:-1]:
+                current_dict = current_dict.setdefault(key, {})
+            current_dict[keys[-1]] = value
+        return health_status
+
+
+class HealthMonitoringScheduler():
+    """
+    Polls the monitoring points of a set of tiles in the background, one thread
+    per rate. Each poll reads the monitoring points of a rate on all tiles
+    concurrently. Polls of different rates on the same tile are serialised.
+    """
+
+    def __init__(self, tiles, rate_periods=None, store=None, logger=None):
+        """
+        Constructor for the scheduler.
+
+        :param tiles: List of tiles to monitor
+        :param rate_periods: Polling period, in seconds, of each rate. Defaults to
+        DEFAULT_RATE_PERIODS. Numeric rates without a configured period are
+        polled every rate seconds, other rates without a configured period are not polled.
+        :type rate_periods: dict
+        :param store: Store for polled values, a new HealthStatusStore is created if None
+        :param logger: Logger, defaults to the module logger
+        """
+        self._tiles = tiles
+        self._rate_periods = dict(DEFAULT_RATE_PERIODS if rate_periods is None else rate_periods)
+        self.store = HealthStatusStore() if store is None else store
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+
+        self._tile_locks = [threading.Lock() for _ in tiles]
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._statistics = {}
+
+    def tile_id(self, tile_number):
+        """
+        Identifier used for a tile in the store, the tile IP address.
+
+        :param tile_number: Index of tile in the tile list
+        :type tile_number: int
+        """
+        return self._tiles[tile_number].get_ip()
+
+    def start(self):
+        """
+        Enable health monitoring on all tiles and start one polling thread per rate.
+        """
+        if self._threads:
+            self.logger.warning("Health monitoring scheduler already running")
+            return
+
+        rates = set()
+        for tile in self._tiles:
+            try:
+                tile.enable_health_monitoring()
+            except Exception as e:
+                self.logger.error(f"Could not enable health monitoring on tile {tile.get_ip()}: {e}")
+            rates.update(tile.all_monitoring_rates())
+
+        self._stop_event.clear()
+        for rate in sorted(rates, key=str):
+            period = self._rate_period(rate)
+            if period is None:
+                self.logger.warning(f"No polling period configured for rate {rate}, not polling")
+                continue
+            self._statistics[rate] = {'period': period, 'polls': 0, 'overruns': 0, 'errors': 0,
+                                      'last_lag': 0, 'max_lag': 0, 'last_duration': 0, 'max_duration': 0,
+                                      'last_poll': None}
+            thread = threading.Thread(target=self._poll_rate, args=(rate, period),
+                                      name=f"health_monitoring_{rate}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop all polling threads and wait for them to finish.
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def is_running(self):
+        """
+        :return: True if the scheduler is polling
+        :rtype: bool
+        """
+        return len(self._threads) != 0
+
+    def get_statistics(self):
+        """
+        Get the polling statistics of each rate:
+        period: polling period in seconds
+        polls: number of polls performed
+        overruns: number of polling periods missed because a poll took too long
+        errors: number of tile polls which failed
+        last_lag, max_lag: delay, in seconds, between scheduled and actual poll start
+        last_duration, max_duration: time, in seconds, taken to poll all tiles
+        last_poll: time at which the last poll started
+
+        :return: statistics per rate
+        :rtype: dict
+        """
+        return {rate: dict(statistics) for rate, statistics in self._statistics.items()}
+
+    def _rate_period(self, rate):
+        """
+        Get the polling period of a rate.
+
+        :param rate: Rate attribute value
+
+        :return: period in seconds, or None if rate is not polled
+        :rtype: float
+        """
+        if rate in self._rate_periods:
+            return self._rate_periods[rate]
+        if isinstance(rate, (int, float)) and not isinstance(rate, bool) and rate > 0:
+            return float(rate)
+        return None
+
+    def _poll_rate(self, rate, period):
+        """
+        Polling loop for a rate, run in its own thread.
+
+        :param rate: Rate attribute value
+        :param period: Polling period in seconds
+        :type period: float
+        """
+        statistics = self._statistics[rate]
+        pool = ThreadPool(len(self._tiles))
+        next_poll = time.time()
+        try:
+            while not self._stop_event.wait(max(0, next_poll - time.time())):
+                start = time.time()
+                lag = start - next_poll
+                statistics['last_poll'] = start
+                statistics['last_lag'] = lag
+                statistics['max_lag'] = max(statistics['max_lag'], lag)
+
+                results = pool.map(lambda tile_number: self._poll_tile(tile_number, rate),
+                                   range(len(self._tiles)))
+
+                duration = time.time() - start
+                statistics['polls'] += 1
+                statistics['errors'] += results.count(False)
+                statistics['last_duration'] = duration
+                statistics['max_duration'] = max(statistics['max_duration'], duration)
+
+                # Skip polling periods which have already passed
+                next_poll += period
+                if time.time() > next_poll:
+                    missed = int((time.time() - next_poll) // period) + 1
+                    statistics['overruns'] += missed
+                    next_poll += missed * period
+                    self.logger.warning(f"Health monitoring poll for rate {rate} took {duration:.3f} s, "
+                                        f"skipping {missed} polling periods")
+        finally:
+            pool.close()
+            pool.join()
+
+    def _poll_tile(self, tile_number, rate):
+        """
+        Read the monitoring points of a rate on one tile and publish them in the store.
+
+        :param tile_number: Index of tile in the tile list
+        :type tile_number: int
+        :param rate: Rate attribute value
+
+        :return: True if the tile was polled successfully
+        :rtype: bool
+        """
+        tile = self._tiles[tile_number]
+        with self._tile_locks[tile_number]:
+            try:
+                timestamp = time.time()
+                values = tile.get_health_values(rate=rate)
+            except Exception as e:
+                self.logger.error(f"Health monitoring poll for rate {rate} failed on tile {tile.get_ip()}: {e}")
+                return False
+
+            # get_health_values returns None if communication with the TPM fails
+            if values is None:
+                return False
+            self.store.update(self.tile_id(tile_number), values, timestamp)
+        return True
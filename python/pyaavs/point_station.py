@@ -20,7 +20,7 @@ from pyaavs import station
 import pyaavs.logger
 
 try:
-    import aavs_calibration.common as calib_utils
+    import aavs_calibration.cache as calib_cache
 except ImportError:
     logging.debug("Could not load calibration database. Pointing cannot be performed")
 
@@ -30,13 +30,17 @@ __author__ = 'Alessio Magro'
 
 antennas_per_tile = 16
 
+# Key used for the sun in the ephemeris cache
+sun_ephemeris_key = 'sun'
+
 class Pointing(object):
     """ Helper class for generating beamforming coefficients """
 
-    def __init__(self, station_identifier, station_config=None):
+    def __init__(self, station_identifier, station_config=None, warm_up=True):
         """ Pointing class, generates delay and delay rates to be downloaded to TPMs
         :param station_identifier: Calibration database station identifier
         :param station_config: Path to station configuration file
+        :param warm_up: Load IERS and solar system ephemeris data at construction rather than on first pointing
         """
 
         # Store arguments
@@ -44,13 +48,14 @@ class Pointing(object):
         self._station_config = station_config
 
         # Get station location
-        info = calib_utils.get_station_information(self._station_id)
+        calibration = calib_cache.get_cache()
+        info = calibration.get_station_information(self._station_id)
         self._longitude = info.longitude
         self._latitude = info.latitude
         self._nof_antennas = info.nof_antennas
 
         # Grab antenna locations and create displacement vectors
-        _, x, y = calib_utils.get_antenna_positions(self._station_id)
+        _, x, y = calibration.get_antenna_positions(self._station_id)
 
         self._displacements = np.full([self._nof_antennas, 3], np.nan)
         for i in range(self._nof_antennas):
@@ -64,6 +69,13 @@ class Pointing(object):
         self._delays = None
         self._delay_rate = None
 
+        # Tracking ephemeris cache. Maps a source key to a (times, directions) tuple, where times are UNIX
+        # timestamps and directions are (east, north, up) unit vectors with shape [time, 3]
+        self._ephemeris_cache = {}
+
+        if warm_up:
+            self._warm_up_transforms()
+
     # -------------------------------- POINTING FUNCTIONS -------------------------------------
     def point_to_sun(self, pointing_time=None):
         """ Generate delays to point towards the sun for the given time
@@ -75,10 +87,15 @@ class Pointing(object):
         else:
             pointing_time = Time(pointing_time, scale='utc')
 
-        # Get sun position in RA, DEC and convert to Alz, Az in telescope reference frame
-        sun_position = get_sun(pointing_time)
-        alt, az = self._ra_dec_to_alt_az(sun_position.ra, sun_position.dec,
-                                         pointing_time, self._reference_antenna_loc)
+        # Use the cached sun ephemeris if available, otherwise get sun position in RA, DEC and
+        # convert to Alz, Az in telescope reference frame
+        cached = self._cached_alt_az([sun_ephemeris_key], pointing_time)
+        if cached is not None:
+            alt, az = Angle(cached[0][0], unit=u.rad), Angle(cached[1][0], unit=u.rad)
+        else:
+            sun_position = get_sun(pointing_time)
+            alt, az = self._ra_dec_to_alt_az(sun_position.ra, sun_position.dec,
+                                             pointing_time, self._reference_antenna_loc)
 
         # Compute delays
         self.point_array_static(alt, az)
@@ -114,41 +131,65 @@ class Pointing(object):
         :return: The (delay,delay rate) tuple for each antenna
         """
 
+        delays, delay_rates, above_horizon = self.point_array_batch([right_ascension], [declination],
+                                                                    pointing_time, delta_time)
+
+        self._delays = delays[0]
+        self._delay_rate = delay_rates[0]
+        self._below_horizon = not above_horizon[0]
+
+    def point_array_batch(self, right_ascensions, declinations, pointing_times=None, delta_time=1.0):
+        """ Calculate delays and delay rates for multiple beams with a single alt/az transformation. Positions at
+        pointing time and at pointing time + delta time are transformed together to compute the delay rates
+        :param right_ascensions: Right ascension of each beam (astropy angles, or values that can be converted to
+                                 angles)
+        :param declinations: Declination of each beam (astropy angles, or values that can be converted to angles)
+        :param pointing_times: Time of observation, either one time for all beams or one time per beam
+        :param delta_time: Delta timing, in seconds, for calculating delay rates
+        :return: (delays, delay rates, above horizon) tuple. Delays (in seconds) and delay rates (in seconds per
+                 second) have shape [beam, antenna] and are set to 0 for beams below the horizon. Above horizon is
+                 a boolean array with one entry per beam
+        """
+
         # If no time is specified, get current time
-        if pointing_time is None:
-            pointing_time = Time(datetime.utcnow(), scale='utc')
+        if pointing_times is None:
+            pointing_times = Time(datetime.utcnow(), scale='utc')
         else:
-            pointing_time = Time(pointing_time, scale='utc')
+            pointing_times = Time(pointing_times, scale='utc')
 
         # Type conversions if required
-        right_ascension = self.convert_to_astropy_angle(right_ascension)
-        declination = self.convert_to_astropy_angle(declination)
-
-        # Calculate required delay
-        alt, az = self._ra_dec_to_alt_az(right_ascension, declination,
-                                         Time(pointing_time), self._reference_antenna_loc)
-
-        # If required source is not above horizon, generate zeros
-        if alt < 0.0:
-            self._delays = np.zeros(self._nof_antennas)
-            self._delay_rate = np.zeros(self._nof_antennas)
-            self._below_horizon = True
-            return
-
-        # Generate delays from calculated altitude and azimuth
-        self.point_array_static(altitude=alt, azimuth=az)
+        right_ascensions = Angle(right_ascensions, unit=u.deg)
+        declinations = Angle(declinations, unit=u.deg)
+
+        # Compute positions at pointing time and, for the delay rate, after delta time in one transformation.
+        # Time offsets are placed along the first axis, broadcasting against the beams
+        offsets = [0.0] if delta_time == 0 else [0.0, delta_time]
+        observation_times = pointing_times + TimeDelta(np.array(offsets)[:, np.newaxis], format='sec')
+
+        # Use cached ephemerides if all beams are cached for the required times
+        keys = [self._ephemeris_key(ra, dec) for ra, dec in zip(right_ascensions.ravel(), declinations.ravel())]
+        cached = self._cached_alt_az(keys, observation_times)
+        if cached is not None:
+            altitudes, azimuths = cached
+        else:
+            altitudes, azimuths = self._ra_dec_to_alt_az(right_ascensions, declinations,
+                                                         observation_times, self._reference_antenna_loc)
+            altitudes, azimuths = altitudes.rad, azimuths.rad
 
-        # Calculate required delay rate
+        # Generate delays for all times and beams, with shape [time, beam, antenna]
+        delays = self._delays_from_altitude_azimuth(altitudes, azimuths)
         if delta_time == 0:
-            self._delay_rate = self._delays * 0
+            delay_rates = np.zeros_like(delays[0])
         else:
-            pointing_time = pointing_time + TimeDelta(delta_time, format='sec')
-            alt, az = self._ra_dec_to_alt_az(right_ascension, declination,
-                                             Time(pointing_time), self._reference_antenna_loc)
-            self._delay_rate = self.point_array_static(alt, az) - self._delays
+            delay_rates = (delays[1] - delays[0]) / delta_time
+        delays = delays[0]
 
-        # Set above horizon flag
-        self._below_horizon = False
+        # If a source is not above horizon, generate zeros
+        above_horizon = altitudes[0] >= 0.0
+        delays[~above_horizon] = 0
+        delay_rates[~above_horizon] = 0
+
+        return delays, delay_rates, above_horizon
 
     def get_pointing_coefficients(self, start_channel, nof_channels):
         """ Get complex pointing coefficients from generated delays
@@ -161,21 +202,136 @@ class Pointing(object):
 
         # If below horizon flat is set, return 0s
         if self._below_horizon:
-            return np.zeros((self._nof_antennas, nof_channels), dtype=np.complex)
+            return np.zeros((self._nof_antennas, nof_channels), dtype=np.complex128)
+
+        return self.get_pointing_coefficients_batch(self._delays[np.newaxis, :], start_channel, nof_channels)[0]
+
+    @staticmethod
+    def get_pointing_coefficients_batch(delays, start_channel, nof_channels, above_horizon=None):
+        """ Get complex pointing coefficients for multiple beams, computed as a single outer product of delays
+        and channel frequencies
+        :param delays: Delays, in seconds, with shape [beam, antenna]
+        :param start_channel: Start channel index
+        :param nof_channels: Number of channels starting with start_channel
+        :param above_horizon: Optional boolean array, coefficients for beams below the horizon are set to 0
+        :return: Coefficients with shape [beam, antenna, channel]
+        """
 
         # Compute frequency range
         channel_bandwidth = 400e6 / 512.0
-        frequencies = np.array([start_channel * channel_bandwidth + i * channel_bandwidth for i in range(nof_channels)])
+        frequencies = (start_channel + np.arange(nof_channels)) * channel_bandwidth
 
         # Generate coefficients
-        coefficients = np.zeros((self._nof_antennas, nof_channels), dtype=np.complex)
-        for i in range(nof_channels):
-            delays = 2.0 * np.pi * frequencies[i] * self._delays
-            coefficients[:, i] = np.cos(delays) + 1j * np.sin(delays)
+        coefficients = np.exp(2j * np.pi * np.multiply.outer(np.asarray(delays), frequencies))
+
+        if above_horizon is not None:
+            coefficients[~np.asarray(above_horizon)] = 0
 
         # All done, return coefficients
         return coefficients
 
+    # -------------------------------- EPHEMERIS CACHE ----------------------------------------
+    def cache_source_ephemeris(self, right_ascension, declination, start_time=None, duration=86400.0,
+                               resolution=60.0):
+        """ Precompute the position of a source over a time grid with a single alt/az transformation. Pointing
+        to the source within the cached time range then interpolates the cached positions
+        :param right_ascension: Right ascension of source (astropy angle, or value that can be converted to angle)
+        :param declination: Declination of source (astropy angle, or value that can be converted to angle)
+        :param start_time: Start of the time grid, defaults to the current time
+        :param duration: Duration of the time grid in seconds
+        :param resolution: Time grid step in seconds
+        """
+        right_ascension = Angle(right_ascension, unit=u.deg)
+        declination = Angle(declination, unit=u.deg)
+
+        times = self._ephemeris_times(start_time, duration, resolution)
+        sky_coordinates = SkyCoord(ra=right_ascension, dec=declination, unit="deg")
+        self._cache_ephemeris(self._ephemeris_key(right_ascension, declination), sky_coordinates, times)
+
+    def cache_sun_ephemeris(self, start_time=None, duration=86400.0, resolution=60.0):
+        """ Precompute the position of the sun over a time grid with a single alt/az transformation. Pointing
+        to the sun within the cached time range then interpolates the cached positions
+        :param start_time: Start of the time grid, defaults to the current time
+        :param duration: Duration of the time grid in seconds
+        :param resolution: Time grid step in seconds
+        """
+        times = self._ephemeris_times(start_time, duration, resolution)
+        self._cache_ephemeris(sun_ephemeris_key, get_sun(times), times)
+
+    def clear_ephemeris_cache(self):
+        """ Remove all cached ephemerides """
+        self._ephemeris_cache = {}
+
+    def _cache_ephemeris(self, key, sky_coordinates, times):
+        """ Transform sky coordinates to alt/az over a time grid and store the resulting directions
+        :param key: Ephemeris cache key
+        :param sky_coordinates: Source position, either fixed or one per time (e.g. sun)
+        :param times: Time grid as astropy Time array """
+
+        altaz = sky_coordinates.transform_to(AltAz(obstime=times, location=self._reference_antenna_loc))
+        self._ephemeris_cache[key] = (times.unix, self._directions_from_altitude_azimuth(altaz.alt.rad,
+                                                                                          altaz.az.rad))
+        logging.debug("Cached ephemeris for {} with {} entries".format(key, len(times)))
+
+    def _cached_alt_az(self, keys, times):
+        """ Interpolate cached ephemerides
+        :param keys: Ephemeris cache key of each source
+        :param times: Times as astropy Time, broadcast against sources
+        :return: Altitude and azimuth, in radians, with the shape of times with the last dimension broadcast
+                 to the number of sources, or None if any source or time is not cached """
+
+        if not all(key in self._ephemeris_cache for key in keys):
+            return None
+
+        unix_times = np.atleast_1d(times.unix)
+        unix_times = np.broadcast_to(unix_times, unix_times.shape[:-1] + (len(keys),))
+
+        directions = np.empty(unix_times.shape + (3,))
+        for i, key in enumerate(keys):
+            cached_times, cached_directions = self._ephemeris_cache[key]
+            beam_times = unix_times[..., i]
+            if np.any(beam_times < cached_times[0]) or np.any(beam_times > cached_times[-1]):
+                return None
+            for axis in range(3):
+                directions[..., i, axis] = np.interp(beam_times, cached_times, cached_directions[:, axis])
+
+        # Linear interpolation shortens the direction vectors slightly, normalise before conversion
+        directions /= np.linalg.norm(directions, axis=-1)[..., np.newaxis]
+        return np.arcsin(directions[..., 2]), np.arctan2(directions[..., 0], directions[..., 1])
+
+    @staticmethod
+    def _ephemeris_times(start_time, duration, resolution):
+        """ Generate an ephemeris time grid covering start_time to start_time + duration
+        :param start_time: Start time, defaults to the current time
+        :param duration: Duration in seconds
+        :param resolution: Step in seconds
+        :return: astropy Time array """
+        if start_time is None:
+            start_time = Time(datetime.utcnow(), scale='utc')
+        else:
+            start_time = Time(start_time, scale='utc')
+
+        nof_steps = int(np.ceil(duration / resolution)) + 1
+        return start_time + TimeDelta(np.arange(nof_steps) * resolution, format='sec')
+
+    @staticmethod
+    def _ephemeris_key(right_ascension, declination):
+        """ Ephemeris cache key for a source
+        :param right_ascension: Right ascension as astropy angle
+        :param declination: Declination as astropy angle """
+        return round(float(right_ascension.deg), 9), round(float(declination.deg), 9)
+
+    def _warm_up_transforms(self):
+        """ Perform a sun alt/az transformation so that IERS tables and solar system ephemeris are loaded
+        before the first pointing request """
+        try:
+            t0 = time.time()
+            now = Time(datetime.utcnow(), scale='utc')
+            get_sun(now).transform_to(AltAz(obstime=now, location=self._reference_antenna_loc))
+            logging.debug("Loaded astropy transformation data in {0:.2}s".format(time.time() - t0))
+        except Exception as e:
+            logging.warning("Could not load astropy transformation data ({})".format(e))
+
     def download_delays(self):
         """ Download generated delays to station """
         if self._delays is None:
@@ -213,28 +369,33 @@ class Pointing(object):
     def _delays_from_altitude_azimuth(self, altitude, azimuth):
         """
         Calculate the delay using a target altitude Azimuth
-        :param altitude: The altitude of the target astropy angle
-        :param azimuth: The azimuth of the target astropy angle
-        :return: The delay in seconds for each antenna
+        :param altitude: The altitude of the target in radians, scalar or array
+        :param azimuth: The azimuth of the target in radians, with the same shape as altitude
+        :return: The delay in seconds for each antenna, with shape [..., antenna] for array inputs
         """
 
-        # Calculate transformation
-        scale = np.array([np.cos(altitude) * np.sin(azimuth),
-                          np.cos(altitude) * np.cos(azimuth),
-                          np.sin(altitude)])
+        # Calculate transformation, with the direction vector along the last axis
+        scale = self._directions_from_altitude_azimuth(altitude, azimuth)
 
         # Apply to antenna displacements
-        path_length = np.dot(scale, self._displacements.T)
+        path_length = np.matmul(scale, self._displacements.T)
 
         # Return frequency-independent geometric delays
         return np.multiply(1.0 / constants.c.value, path_length)
 
+    @staticmethod
+    def _directions_from_altitude_azimuth(altitude, azimuth):
+        """ Convert altitude and azimuth, in radians, to (east, north, up) unit vectors along the last axis """
+        return np.stack([np.cos(altitude) * np.sin(azimuth),
+                         np.cos(altitude) * np.cos(azimuth),
+                         np.sin(altitude)], axis=-1)
+
     @staticmethod
     def _ra_dec_to_alt_az(right_ascension, declination, time, location):
         """ Calculate the altitude and azimuth coordinates of a sky object from right ascension and declination and time
         :param right_ascension: Right ascension of source (in astropy Angle on string which can be converted to Angle)
         :param declination: Declination of source (in astropy Angle on string which can be converted to Angle)
-        :param time: Time of observation (as astropy Time")
+        :param time: Time of observation (as astropy Time"), arrays of times broadcast against source arrays
         :param location: astropy EarthLocation
         :return: Array containing altitude and azimuth of source as astropy angle
         """
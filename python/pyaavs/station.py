@@ -1,10 +1,13 @@
 #! /usr/bin/env python
+from pyaavs.health_monitoring_scheduler import HealthMonitoringScheduler
 from pyaavs.slack import get_slack_instance
 from pyaavs.tile_wrapper import Tile
 from pyfabil import Device
 
 from future.utils import iteritems
+from contextlib import contextmanager
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from threading import Thread
 from builtins import input
 import threading
@@ -61,6 +64,9 @@ configuration = {'tiles': None,
                     }
                  }
 
+# Duration, in seconds, of a beamformer frame (256 ADC frames)
+beamformer_frame_time = 256 * 1.08e-6
+
 
 def create_tile_instance(config, tile_number):
     """ Add a new tile to the station
@@ -242,6 +248,12 @@ class Station(object):
         # Set if the station is properly configured
         self.properly_formed_station = None
 
+        # Duration of each phase of the last call to connect, as a list of (phase, seconds) tuples
+        self.startup_timings = []
+
+        # Background health monitoring, created by start_health_monitoring
+        self.health_monitoring = None
+
         # Cache plugin directory
         # __import__("pyaavs.tpm_test_firmware", fromlist=[None])
 
@@ -266,10 +278,15 @@ class Station(object):
                                dst_port))
 
     def connect(self):
-        """ Initialise all tiles """
+        """ Initialise all tiles. Each start-up phase, including connecting to the tiles, is applied to all tiles
+        concurrently, and a phase only starts once the previous one has completed on all tiles. Station-wide
+        synchronisation (PPS sampling, UTC time and acquisition start) is performed after all tiles are configured.
+        The duration of each phase is stored in startup_timings and reported at the end """
 
         # Start with the assumption that the station will be properly formed
         self.properly_formed_station = True
+        self.startup_timings = []
+        t_start = time.time()
 
         # Create a pool of nof_tiles processes
         pool = None
@@ -285,7 +302,8 @@ class Station(object):
         if self.configuration['station']['program_cpld']:
             logging.info("Programming CPLD")
             self._slack.info("CPLD is being updated for tiles: {}".format(self.tiles))
-            res = pool.map(program_cpld, params)
+            with self._startup_phase("Program CPLD"):
+                res = pool.map(program_cpld, params)
 
             if not all(res):
                 logging.error("Could not program TPM CPLD!")
@@ -295,7 +313,8 @@ class Station(object):
         if self.configuration['station']['program'] and self.properly_formed_station:
             logging.info("Programming tiles")
             self._slack.info("Station is being programmed")
-            res = pool.map(program_fpgas, params)
+            with self._startup_phase("Program FPGAs"):
+                res = pool.map(program_fpgas, params)
 
             if not all(res):
                 logging.error("Could not program tiles!")
@@ -305,7 +324,8 @@ class Station(object):
         if self.configuration['station']['initialise'] and self.properly_formed_station:
             logging.info("Initialising tiles")
             self._slack.info("Station is being initialised")
-            res = pool.map(initialise_tile, params)
+            with self._startup_phase("Initialise tiles"):
+                res = pool.map(initialise_tile, params)
 
             if not all(res):
                 logging.error("Could not initialise tiles!")
@@ -315,9 +335,10 @@ class Station(object):
         if pool is not None:
             pool.terminate()
 
-        # Connect all tiles
-        for tile in self.tiles:
-            tile.connect()
+        # Connect all tiles. Each tile connects through its own TPM object, while adding and loading firmware plugins,
+        # which goes through pyfabil module level state, is serialised by the tile's plugin loading lock
+        with self._startup_phase("Connect tiles"):
+            self._map_tiles(lambda tile: tile.connect())
 
         # Initialise if required
         if self.configuration['station']['initialise'] and self.properly_formed_station:
@@ -335,43 +356,28 @@ class Station(object):
             # configure beamformer
             if self.tiles[0].tpm.tpm_test_firmware[0].tile_beamformer_implemented and \
                     self.tiles[0].tpm.tpm_test_firmware[0].station_beamformer_implemented:
-                for i, tile in enumerate(self.tiles):
-                    # Initialise beamformer
-                    tile.initialise_beamformer(start_channel, nof_channels)
-
-                    # Define SPEAD header
-                    # TODO: Insert proper values here
-                    if i == len(self.tiles) - 1:
-                        tile.define_spead_header(station_id=self._station_id,
-                                                 subarray_id=0,
-                                                 nof_antennas=self.configuration['station']['number_of_antennas'],
-                                                 ref_epoch=-1,
-                                                 start_time=0)
-
-                    # Start beamformer
-                    if self.configuration['station']['start_beamformer']:
-                        logging.info("Starting station beamformer")
-                        tile.start_beamformer(start_time=0, duration=-1)
-
-                        # Set beamformer scaling
-                        for tile in self.tiles:
-                            for station_beamf in tile.tpm.station_beamf:
-                                station_beamf.set_csp_rounding(
-                                    self.configuration['station']['beamformer_scaling']
-                                )
+                with self._startup_phase("Initialise beamformer"):
+                    self._map_tiles(lambda tile: tile.initialise_beamformer(start_channel, nof_channels))
+
+                # Define SPEAD header on the last tile in the beamformer chain
+                # TODO: Insert proper values here
+                with self._startup_phase("Define SPEAD header"):
+                    self.tiles[-1].define_spead_header(station_id=self._station_id,
+                                                       subarray_id=0,
+                                                       nof_antennas=self.configuration['station']['number_of_antennas'],
+                                                       ref_epoch=-1,
+                                                       start_time=0)
+
+                # Start beamformer and set beamformer scaling
+                if self.configuration['station']['start_beamformer']:
+                    logging.info("Starting station beamformer")
+                    with self._startup_phase("Start beamformer"):
+                        self._map_tiles(self._start_tile_beamformer)
 
             # If in testing mode, override tile-specific test generators
             if self.configuration['station']['enable_test']:
-                for tile in self.tiles:
-                    for gen in tile.tpm.test_generator:
-                        gen.channel_select(0x0000)
-                        gen.disable_prdg()
-
-                for tile in self.tiles:
-                    for gen in tile.tpm.test_generator:
-                        gen.set_tone(0, 100 * 400e6 / 512, 1)
-                        gen.set_tone(1, 100 * 400e6 / 512, 0)
-                        gen.channel_select(0xFFFF)
+                with self._startup_phase("Configure test generators"):
+                    self._map_tiles(self._configure_tile_test_generators)
 
             # if self['fpga1.regfile.feature.xg_eth_implemented'] == 1:
             #     for tile in self.tiles:
@@ -380,11 +386,15 @@ class Station(object):
             #     for tile in self.tiles:
             #         tile.check_arp_table()
 
-            # If initialising, synchronise all tiles in station
+            # If initialising, synchronise all tiles in station. These phases are barriers, each of them requires
+            # all tiles to have completed the previous phase
             logging.info("Synchronising station")
-            self._check_pps_sampling_synchronisation()
-            self._check_time_synchronisation()
-            self._start_acquisition()
+            with self._startup_phase("PPS sampling synchronisation"):
+                self._check_pps_sampling_synchronisation()
+            with self._startup_phase("Time synchronisation"):
+                self._check_time_synchronisation()
+            with self._startup_phase("Start acquisition"):
+                self._start_acquisition()
 
             # Setting PREADU values
             att_value = self.configuration['station']['default_preadu_attenuation']
@@ -392,8 +402,8 @@ class Station(object):
                 # Set default preadu attenuation
                 time.sleep(1)
                 logging.info("Setting default PREADU attenuation to {}".format(att_value))
-                for tile in self.tiles:
-                    tile.set_preadu_attenuation(att_value)
+                with self._startup_phase("Set PREADU attenuation"):
+                    self._map_tiles(lambda tile: tile.set_preadu_attenuation(att_value))
 
                 # If equalization is required, do it
                 if self.configuration['station']['equalize_preadu'] != 0:
@@ -403,15 +413,74 @@ class Station(object):
                     self._slack.info("Station gains are being equalized to ADU RMS {}".format(
                         self.configuration['station']['equalize_preadu'])
                     )
-                    for tile in self.tiles:
-                        tile.equalize_preadu_gain(self.configuration['station']['equalize_preadu'])
+                    with self._startup_phase("Equalise PREADU"):
+                        self._map_tiles(lambda tile: tile.equalize_preadu_gain(
+                            self.configuration['station']['equalize_preadu']))
 
         elif not self.properly_formed_station:
             logging.warning("Some tiles were not initialised or programmed. Not forming station")
 
         # If not initialising, check that station is formed properly
         else:
-            self.check_station_status()
+            with self._startup_phase("Check station status"):
+                self.check_station_status()
+
+        # Report where start-up time was spent
+        logging.info("Station start-up phase timing:")
+        for phase, duration in self.startup_timings:
+            logging.info("    {:<30} {:>8.2f}s".format(phase, duration))
+        logging.info("    {:<30} {:>8.2f}s".format("Total", time.time() - t_start))
+
+    def _start_tile_beamformer(self, tile):
+        """ Start the beamformer on a tile and set its CSP rounding
+        :param tile: Tile to start beamformer on """
+        tile.start_beamformer(start_time=0, duration=-1)
+        for station_beamf in tile.tpm.station_beamf:
+            station_beamf.set_csp_rounding(self.configuration['station']['beamformer_scaling'])
+
+    @staticmethod
+    def _configure_tile_test_generators(tile):
+        """ Override tile-specific test generators with a tone in channel 100
+        :param tile: Tile to configure test generators on """
+        for gen in tile.tpm.test_generator:
+            gen.channel_select(0x0000)
+            gen.disable_prdg()
+
+        for gen in tile.tpm.test_generator:
+            gen.set_tone(0, 100 * 400e6 / 512, 1)
+            gen.set_tone(1, 100 * 400e6 / 512, 0)
+            gen.channel_select(0xFFFF)
+
+    def _map_tiles(self, function, *arguments):
+        """ Call a function for all tiles concurrently, using one thread per tile, and wait for all calls to complete.
+        Each thread is named after its tile IP so that log messages can be traced back to a tile
+        :param function: Function to call, with the tile as first argument
+        :param arguments: Optional lists with one additional argument per tile
+        :return: List with the value returned for each tile """
+
+        def call(tile_number):
+            threading.current_thread().name = self.tiles[tile_number].get_ip()
+            return function(self.tiles[tile_number], *[argument[tile_number] for argument in arguments])
+
+        if len(self.tiles) == 0:
+            return []
+
+        pool = ThreadPool(len(self.tiles))
+        try:
+            return pool.map(call, range(len(self.tiles)))
+        finally:
+            pool.close()
+            pool.join()
+
+    @contextmanager
+    def _startup_phase(self, name):
+        """ Time a start-up phase and add it to the start-up timing report
+        :param name: Phase name """
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.startup_timings.append((name, time.time() - t0))
 
     def check_station_status(self):
         """ Check that the station is still valid """
@@ -448,33 +517,29 @@ class Station(object):
             curr_time = self.tiles[0].get_fpga_time(Device.FPGA_1)
 
             times = set()
-            for tile in self.tiles:
-                times.add(tile.get_fpga_time(Device.FPGA_1))
-                times.add(tile.get_fpga_time(Device.FPGA_2))
+            for tile_times in self._map_tiles(lambda tile: (tile.get_fpga_time(Device.FPGA_1),
+                                                            tile.get_fpga_time(Device.FPGA_2))):
+                times.update(tile_times)
 
             if len(times) == 1:
                 logging.info("Tiles in station synchronised, time is %d" % curr_time)
                 break
             else:
                 logging.info("Re-Synchronising tiles in station with time %d" % curr_time)
-                for tile in self.tiles:
-                    tile.set_fpga_time(Device.FPGA_1, curr_time)
-                    tile.set_fpga_time(Device.FPGA_2, curr_time)
+                self._map_tiles(lambda tile: (tile.set_fpga_time(Device.FPGA_1, curr_time),
+                                              tile.set_fpga_time(Device.FPGA_2, curr_time)))
             if n == max_attempts - 1:
                 logging.error("Not possible to synchronise station UTC time across tiles")
 
     def _start_acquisition(self):
 
         # Check if ARP table is populated before starting
-        for tile in self.tiles:
-            tile.reset_eth_errors()
-            tile.check_arp_table()
+        self._map_tiles(lambda tile: (tile.reset_eth_errors(), tile.check_arp_table()))
 
         # Start data acquisition on all boards
         delay = 2
         t0 = self.tiles[0].get_fpga_time(Device.FPGA_1)
-        for tile in self.tiles:
-            tile.start_acquisition(start_time=t0, delay=delay)
+        self._map_tiles(lambda tile: tile.start_acquisition(start_time=t0, delay=delay))
 
         t1 = self.tiles[0].get_fpga_time(Device.FPGA_1)
         if t0 + delay <= t1:
@@ -508,7 +573,7 @@ class Station(object):
             sync_loop += 1
 
             # get the PPS delay from tile
-            measured_delay = [tile.get_pps_delay() for tile in self.tiles]
+            measured_delay = self._map_tiles(lambda tile: tile.get_pps_delay())
 
             # check if there is too much skew
             synced = True
@@ -528,8 +593,7 @@ class Station(object):
             else:
                 # if skew is too much, repeat the synchronisation using the first tile as reference
                 logging.warning("Resynchronizing station ({})".format(measured_delay))
-                for n in range(len(self.tiles)):
-                    self.tiles[n].set_pps_sampling(measured_delay[0], 4)
+                self._map_tiles(lambda tile: tile.set_pps_sampling(measured_delay[0], 4))
 
         logging.error("Station PPS sampling synchronisation check failed!")
 
@@ -566,6 +630,25 @@ class Station(object):
             tile.test_generator[0].channel_select(inputs & 0xFFFF)
             tile.test_generator[1].channel_select((inputs >> 16) & 0xFFFF)
 
+    # ------------------------------- HEALTH MONITORING OPERATIONS -----------------------------------
+    def start_health_monitoring(self, rate_periods=None):
+        """ Start polling the health monitoring points of all tiles in the background. The latest values are
+        available in health_monitoring.store and polling statistics from health_monitoring.get_statistics()
+        :param rate_periods: Polling period, in seconds, for each monitoring point rate. See HealthMonitoringScheduler
+        :return: HealthMonitoringScheduler """
+        if self.health_monitoring is not None and self.health_monitoring.is_running():
+            logging.warning("Health monitoring already running")
+            return self.health_monitoring
+
+        self.health_monitoring = HealthMonitoringScheduler(self.tiles, rate_periods)
+        self.health_monitoring.start()
+        return self.health_monitoring
+
+    def stop_health_monitoring(self):
+        """ Stop background health monitoring """
+        if self.health_monitoring is not None:
+            self.health_monitoring.stop()
+
     # --------------------------------- CALIBRATION OPERATIONS ---------------------------------------
     def calibrate_station(self, coefficients, switch_time=2048):
         """Coefficients is a 3D complex array of the form [antenna, channel, polarization], with each 
@@ -586,37 +669,93 @@ class Station(object):
                 len(self.tiles) * 16, nof_channels, coefficients.shape))
             return
 
-        t0 = time.time()
-
         # Download coefficients
-        for i, tile in enumerate(self.tiles):
-            for antenna in range(16):
-                tile.load_calibration_coefficients(antenna,
-                                                   coefficients[i * 16 + antenna, :, :].tolist())
+        self.download_calibration_coefficients(coefficients)
 
-        t1 = time.time()
-        logging.info("Downloaded coefficients to tiles in {0:.2}s".format(t1 - t0))
+        # Done downloading coefficient, switch calibration bank. False is returned if no switch frame far enough
+        # ahead could be found, in which case no tile is switched
+        if self.switch_calibration_banks(switch_time):
+            self._slack.info("Calibration coefficients loaded to station")
+            logging.info("Switched calibration banks")
+        else:
+            logging.error("Calibration banks not switched, station calibration not applied")
 
-        # Done downloading coefficient, switch calibration bank
-        self.switch_calibration_banks(switch_time)
-        self._slack.info("Calibration coefficients loaded to station")
-        logging.info("Switched calibration banks")
+    def download_calibration_coefficients(self, coefficients):
+        """ Download calibration coefficients to all tiles in parallel, without switching calibration banks.
+        :param coefficients: Coefficients array of the form [antenna, channel, polarization], with 16 antennas per tile
+        :return: List with the download time, in seconds, of each tile """
 
-    def switch_calibration_banks(self, switch_time=0):
-        """ Switch calibration bank on all tiles"""
+        def download_tile(tile, tile_coefficients):
+            t_start = time.time()
+            tile.load_all_calibration_coefficients(tile_coefficients)
+            return time.time() - t_start
 
-        if switch_time == 0:
-            switch_time = self.tiles[0].current_tile_beamformer_frame() + 64
-        else:
-            switch_time = self.tiles[0].current_tile_beamformer_frame() + switch_time
+        t0 = time.time()
+        latencies = self._map_tiles(download_tile, [coefficients[i * 16:(i + 1) * 16, :, :]
+                                                    for i in range(len(self.tiles))])
+        t1 = time.time()
 
-        # Switch calibration bank on all tiles
-        for tile in self.tiles:
-            tile.beamf_fd[0].switch_calibration_bank(switch_time)
-            tile.beamf_fd[1].switch_calibration_bank(switch_time)
+        for tile, latency in zip(self.tiles, latencies):
+            logging.info("Downloaded coefficients to tile {} in {:.3f}s".format(tile.get_ip(), latency))
+        logging.info("Downloaded coefficients to tiles in {:.3f}s (slowest tile {:.3f}s)".format(
+            t1 - t0, max(latencies)))
+
+        return latencies
+
+    def switch_calibration_banks(self, switch_time=0, max_attempts=3):
+        """ Switch calibration bank on all tiles at the same frame. The current frame of every tile is read before any
+        switch is requested, and the switch frame is set switch_time frames after the latest tile. If reading the
+        frames left too little time to request the switch, a later frame is picked without switching anything. If
+        any tile reaches the switch frame before the switch was requested on all tiles, the switch may have been
+        missed on some of them, so it is requested again on the whole station at a later frame
+        :param switch_time: Delay, in beamformer frames, from the latest tile frame to the switch frame
+        :param max_attempts: Maximum number of switch frames to try, the delay is doubled after each attempt
+        :return: False if the switch was not requested on any tile, True otherwise """
 
-        if switch_time < self.tiles[0].current_tile_beamformer_frame():
-            logging.warning("Calibration switching not synchronised!")
+        if switch_time == 0:
+            switch_time = 64
+
+        def current_frame(tile):
+            return tile.current_tile_beamformer_frame()
+
+        def switch_tile(tile, frame):
+            tile.beamf_fd[0].switch_calibration_bank(frame)
+            tile.beamf_fd[1].switch_calibration_bank(frame)
+
+        requested = False
+        for attempt in range(max_attempts):
+            t0 = time.time()
+            switch_frame = max(self._map_tiles(current_frame)) + switch_time
+
+            # Requesting the switch takes about as long as reading the frames, so at least twice that time must be
+            # left before the switch frame
+            elapsed_frames = (time.time() - t0) / beamformer_frame_time
+            if 2 * elapsed_frames >= switch_time:
+                logging.warning("Calibration switch frame {} too close, not switching. Retrying with a delay of {} "
+                                "frames".format(switch_frame, 2 * switch_time))
+                switch_time *= 2
+                continue
+
+            self._map_tiles(switch_tile, [switch_frame] * len(self.tiles))
+            requested = True
+
+            # If no tile has reached the switch frame once all requests completed, they were all in time
+            if max(self._map_tiles(current_frame)) < switch_frame:
+                return True
+
+            logging.warning("Calibration switch frame {} reached before the switch was requested on all tiles. "
+                            "Requesting it again on all tiles with a delay of {} frames".format(switch_frame,
+                                                                                               2 * switch_time))
+            switch_time *= 2
+
+        if not requested:
+            logging.error("Calibration banks not switched, no switch frame far enough ahead after {} attempts".format(
+                max_attempts))
+            return False
+
+        logging.error("Calibration switching not synchronised! Switch frame reached before the switch was "
+                      "requested on all tiles after {} attempts".format(max_attempts))
+        return True
 
     def load_pointing_delay(self, load_time=0):
         """ Load pointing delays on all tiles """
@@ -375,8 +375,10 @@ class TestFullStation():
                 for antenna in range(self._antennas_per_tile):
                     tile.load_calibration_coefficients(antenna, one_matrix.tolist())
 
-            # Done downloading coefficient, switch calibration bank
-            self._test_station.switch_calibration_banks(1024)
+            # Done downloading coefficient, switch calibration bank. False is returned if no switch frame far
+            # enough ahead could be found, in which case no tile is switched
+            if not self._test_station.switch_calibration_banks(1024):
+                self._logger.error("Calibration banks not switched")
             self._logger.info("Applied default beamformer coefficients")
 
             nof_antennas = len(self._station_config['tiles']) * self._antennas_per_tile
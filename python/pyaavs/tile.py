@@ -13,6 +13,7 @@ Hardware functions for the TPM 1.2 hardware.
 import functools
 import logging
 import socket
+import threading
 import numpy as np
 import time
 import math
@@ -24,6 +25,9 @@ from pyfabil.boards.tpm import TPM
 
 from pyaavs.tile_health_monitor import TileHealthMonitor
 
+# Plugin directories and plugin classes are registered in pyfabil module level state, so when tiles are connected
+# concurrently plugins are added and loaded by one tile at a time
+plugin_loading_lock = threading.Lock()
 
 # Helper to disallow certain function calls on unconnected tiles
 def connected(f):
@@ -196,7 +200,8 @@ class Tile(TileHealthMonitor):
 
         # Add plugin directory (load module locally)
         tf = __import__("pyaavs.plugins.tpm.tpm_test_firmware", fromlist=[None])
-        self.tpm.add_plugin_directory(os.path.dirname(tf.__file__))
+        with plugin_loading_lock:
+            self.tpm.add_plugin_directory(os.path.dirname(tf.__file__))
 
         # Connect using tpm object.
         # simulator parameter is used not to load the TPM specific plugins,
@@ -221,14 +226,15 @@ class Tile(TileHealthMonitor):
 
         # Load tpm test firmware for both FPGAs (no need to load in simulation)
         if load_plugin and self.tpm.is_programmed():
-            for device in [Device.FPGA_1, Device.FPGA_2]:
-                self.tpm.load_plugin(
-                    "TpmTestFirmware",
-                    device=device,
-                    fsample=self._sampling_rate,
-                    dsp_core=dsp_core,
-                    logger=self.logger,
-                )
+            with plugin_loading_lock:
+                for device in [Device.FPGA_1, Device.FPGA_2]:
+                    self.tpm.load_plugin(
+                        "TpmTestFirmware",
+                        device=device,
+                        fsample=self._sampling_rate,
+                        dsp_core=dsp_core,
+                        logger=self.logger,
+                    )
         elif not self.tpm.is_programmed():
             self.logger.warning("TPM is not programmed! No plugins loaded")
 
@@ -1432,6 +1438,30 @@ class Tile(TileHealthMonitor):
         else:
             self.tpm.beamf_fd[1].load_calibration(antenna - 8, calibration_coefficients)
 
+    @connected
+    def load_all_calibration_coefficients(self, calibration_coefficients):
+        """
+        Loads calibration coefficients for all antennas in the tile.
+        calibration_coefficients is a three-dimensional complex array of the form
+        calibration_coefficients[antenna, channel, polarization], with one entry per
+        antenna (0-15) and channel and polarization indexed as in
+        load_calibration_coefficients. The shape of the array is checked once, then
+        the coefficients of each antenna are loaded into its FPGA beamformer with
+        load_calibration, as in load_calibration_coefficients.
+
+        :param calibration_coefficients: Calibration coefficient array
+        :type calibration_coefficients: numpy.ndarray
+        """
+        calibration_coefficients = np.asarray(calibration_coefficients)
+        if calibration_coefficients.ndim != 3 or calibration_coefficients.shape[0] != 16:
+            raise ValueError("Calibration coefficients should have shape (16, channels, 4), is {}".format(
+                calibration_coefficients.shape))
+
+        for fpga, beamformer in enumerate(self.tpm.beamf_fd[:2]):
+            coefficients = calibration_coefficients[fpga * 8:(fpga + 1) * 8].tolist()
+            for antenna, antenna_coefficients in enumerate(coefficients):
+                beamformer.load_calibration(antenna, antenna_coefficients)
+
     @connected
     def load_antenna_tapering(self, beam, tapering_coefficients):
         """
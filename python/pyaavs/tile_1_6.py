@@ -18,7 +18,7 @@ import os
 from pyfabil.base.definitions import Device, LibraryError, BoardError
 from pyfabil.base.utils import ip2long
 from pyfabil.boards.tpm_1_6 import TPM_1_6
-from pyaavs.tile import Tile
+from pyaavs.tile import Tile, plugin_loading_lock
 
 
 # Helper to disallow certain function calls on unconnected tiles
@@ -175,7 +175,8 @@ class Tile_1_6(Tile):
 
         # Add plugin directory (load module locally)
         tf = __import__("pyaavs.plugins.tpm_1_6.tpm_test_firmware", fromlist=[None])
-        self.tpm.add_plugin_directory(os.path.dirname(tf.__file__))
+        with plugin_loading_lock:
+            self.tpm.add_plugin_directory(os.path.dirname(tf.__file__))
         # Connect using tpm object.
         # simulator parameter is used not to load the TPM specific plugins,
         # no actual simulation is performed.
@@ -198,14 +199,15 @@ class Tile_1_6(Tile):
 
         # Load tpm test firmware for both FPGAs (no need to load in simulation)
         if load_plugin and self.tpm.is_programmed():
-            for device in [Device.FPGA_1, Device.FPGA_2]:
-                self.tpm.load_plugin(
-                    "Tpm_1_6_TestFirmware",
-                    device=device,
-                    fsample=self._sampling_rate,
-                    dsp_core=dsp_core,
-                    logger=self.logger,
-                )
+            with plugin_loading_lock:
+                for device in [Device.FPGA_1, Device.FPGA_2]:
+                    self.tpm.load_plugin(
+                        "Tpm_1_6_TestFirmware",
+                        device=device,
+                        fsample=self._sampling_rate,
+                        dsp_core=dsp_core,
+                        logger=self.logger,
+                    )
         elif not self.tpm.is_programmed():
             self.logger.warning("TPM is not programmed! No plugins loaded")
 
@@ -15,25 +15,73 @@ pyfabil low level software and specific hardware module plugins.
 
 import time
 from pyfabil.base.definitions import LibraryError, BoardError
+from contextlib import contextmanager
 from copy import copy
-from functools import reduce
+from functools import partial, reduce
 import operator
 
 from pyaavs.tpm_1_6_monitoring_point_lookup import load_tpm_1_6_lookup
 from pyaavs.tpm_1_2_monitoring_point_lookup import load_tpm_1_2_lookup
 
 
+# Monitoring point methods which can read all of their items in a single call. Maps the method name to
+# the keyword argument that selects a single item and to the key under which each item is returned when all items
+# are read (for example get_voltage(voltage_name='VIN') and get_voltage()['VIN'])
+BLOCK_READ_METHODS = {
+    'get_voltage':                     ('voltage_name', '{}'),
+    'get_current':                     ('current_name', '{}'),
+    'get_fpga_temperature':            ('fpga_id', 'FPGA{}'),
+    'check_adc_pll_status':            ('adc_id', 'ADC{}'),
+    'check_adc_sysref_setup_and_hold': ('adc_id', 'ADC{}'),
+    'check_adc_sysref_counter':        ('adc_id', 'ADC{}'),
+    'check_clock_status':              ('fpga_id', 'FPGA{}'),
+    'check_clock_manager_status':      ('fpga_id', 'FPGA{}'),
+    'check_jesd_lane_error_counter':   ('fpga_id', 'FPGA{}'),
+    'check_jesd_resync_counter':       ('fpga_id', 'FPGA{}'),
+    'check_jesd_qpll_status':          ('fpga_id', 'FPGA{}'),
+    'check_ddr_reset_counter':         ('fpga_id', 'FPGA{}'),
+    'check_udp_crc_error_counter':     ('fpga_id', 'FPGA{}'),
+    'check_udp_bip_error_counter':     ('fpga_id', 'FPGA{}'),
+    'check_udp_decode_error_counter':  ('fpga_id', 'FPGA{}'),
+    'check_udp_linkup_loss_counter':   ('fpga_id', 'FPGA{}'),
+}
+
+# TPM methods which access registers, each call is one UCP round trip
+REGISTER_ACCESS_METHODS = ['read_register', 'read_address', 'write_register', 'write_address']
+
+
+def _check_passed(obj, check_name):
+    """
+    Returns True if the named decorator check has already passed for the current TPM connection.
+    """
+    tpm, passed_checks = obj._health_check_cache
+    return tpm is obj.tpm and check_name in passed_checks
+
+
+def _set_check_passed(obj, check_name):
+    """
+    Records that the named decorator check passed for the current TPM connection.
+    A new connection (a new TPM object) invalidates all previously passed checks.
+    """
+    if obj._health_check_cache[0] is not obj.tpm:
+        obj._health_check_cache = (obj.tpm, set())
+    obj._health_check_cache[1].add(check_name)
+
+
 def health_monitoring_compatible(func):
     """
     Decorator method to check if provided firmware supports TPM health monitoring.
     Achieved by attempting to access a register which was added for TPM health monitoring.
     Bitstreams generated prior to ~03/2023 will not support TPM health monitoring.
+    The check is performed once per TPM connection.
     """
     def inner_func(self, *args, **kwargs):
-        try:
-            self['fpga1.pps_manager.pps_errors']
-        except Exception as e:  # noqa: F841
-            raise LibraryError(f"TPM Health Monitoring not supported by FPGA firmware!")
+        if not _check_passed(self, 'health_monitoring_compatible'):
+            try:
+                self['fpga1.pps_manager.pps_errors']
+            except Exception as e:  # noqa: F841
+                raise LibraryError(f"TPM Health Monitoring not supported by FPGA firmware!")
+            _set_check_passed(self, 'health_monitoring_compatible')
         return func(self, *args, **kwargs)
     return inner_func
 
@@ -42,6 +90,8 @@ def communication_check(func):
     """
     Decorator method to check if communication is established between FPGA and CPLD.
     Non-destructive version of tile tpm_communication_check.
+    The check is performed on every call, so that a link lost during a session is
+    detected by the next health monitoring pass.
     """
     def inner_func(self, *args, **kwargs):
         try:
@@ -77,6 +127,10 @@ class TileHealthMonitor():
         tpm_1_6_monitoring_point_lookup.py
         """
         self.monitoring_point_lookup_dict = load_tpm_1_2_lookup(self) if  self.tpm_version() == "tpm_v1_2" else load_tpm_1_6_lookup(self)
+        # Decorator checks which passed, cached per TPM connection
+        self._health_check_cache = (None, set())
+        # Statistics of the last get_health_status call
+        self.health_status_statistics = None
         return
 
     @communication_check
@@ -182,10 +236,10 @@ class TileHealthMonitor():
                     if not isinstance(value, list):
                         value = [value]
                     if override or key not in lookup_entry:
-                        self.logger.info(f"Setting {key} for {monitoring_point} to {', '.join(value)}.")
+                        self.logger.info(f"Setting {key} for {monitoring_point} to {', '.join(map(str, value))}.")
                         lookup_entry[key] = copy(value)
                     else:
-                        self.logger.info(f"Appending {key} for {monitoring_point} with {', '.join(value)}.")
+                        self.logger.info(f"Appending {key} for {monitoring_point} with {', '.join(map(str, value))}.")
                         lookup_entry[key].extend(value)
                         lookup_entry[key] = copy(list(set(lookup_entry[key])))  # remove duplicates from list by converting to set and back
                         self.logger.info(f"{key} for {monitoring_point} now {lookup_entry[key]}.")
@@ -305,14 +359,50 @@ class TileHealthMonitor():
         tile.get_health_status(group='io')
 
         Full documentation on usage available at https://confluence.skatelescope.org/x/nDhED
+
+        All monitoring points are read in a single snapshot, see _read_health_snapshot.
+        The number of method calls, the number of register accesses (UCP round
+        trips) and the time taken by the call are stored in health_status_statistics.
         """
         health_status = {}
+        for monitoring_point, value in self._get_health_values(kwargs).items():
+            # Create dictionary of monitoring points in same format as lookup
+            health_status = self._create_nested_dict(monitoring_point.split('.'), value, health_status)
+        return health_status
+
+    @communication_check
+    @health_monitoring_compatible
+    def get_health_values(self, **kwargs):
+        """
+        Returns the current value of TPM monitoring points with the
+        specified attributes, selected as in get_health_status, as a flat
+        dictionary keyed by monitoring point. For example:
+        {'voltages.VIN': 12.01, 'io.udp_interface.crc_error_count.FPGA0': 0}
+
+        :return: monitoring point values
+        :rtype: dict
+        """
+        return self._get_health_values(kwargs)
+
+    def _get_health_values(self, kwargs):
+        """
+        Read a snapshot of the monitoring points selected by kwargs and update
+        health_status_statistics.
+
+        :param kwargs: dictionary of kwargs, see _kwargs_handler
+        :type kwargs: dict
+
+        :return: monitoring point values
+        :rtype: dict
+        """
+        start_time = time.perf_counter()
         mon_point_list = self._kwargs_handler(kwargs)
+        with self._count_register_accesses() as nof_transactions:
+            values, nof_method_calls = self._read_health_snapshot(mon_point_list)
+
+        health_values = {}
         for monitoring_point in mon_point_list:
-            lookup = monitoring_point.split('.')
-            lookup_entry = self._parse_dict_by_path(self.monitoring_point_lookup_dict, lookup)
-            # call method stored in lookup entry
-            value = lookup_entry["method"]()
+            value = values[monitoring_point]
             # Resolve nested values with only one value i.e
             # get_voltage("voltage_name") returns {"voltage_name": voltage}
             # get_clock_manager_status(fpga_id, name) returns {"FPGAid": {"name": status}}
@@ -322,10 +412,123 @@ class TileHealthMonitor():
                 if len(value) != 1:
                     break
                 value = list(value.values())[0]
-            # Create dictionary of monitoring points in same format as lookup
-            health_status = self._create_nested_dict(lookup, value, health_status)
-        return health_status
-    
+            health_values[monitoring_point] = value
+
+        self.health_status_statistics = {'monitoring_points': len(mon_point_list),
+                                         'method_calls': nof_method_calls,
+                                         'transactions': nof_transactions[0],
+                                         'duration': time.perf_counter() - start_time}
+        self.logger.debug(f"Read {len(mon_point_list)} monitoring points with {nof_method_calls} method calls, "
+                          f"{nof_transactions[0]} transactions and "
+                          f"{self.health_status_statistics['duration']:.3f} s")
+        return health_values
+
+    @contextmanager
+    def _count_register_accesses(self):
+        """
+        Count the register accesses made through the TPM while the context is
+        active. Each access is a UCP round trip, so this is the number of
+        transactions. Accesses made by other threads on the same TPM in the
+        meantime are also counted.
+
+        :return: list whose single element is the number of accesses
+        :rtype: list
+        """
+        count = [0]
+        replaced = {}
+        for name in REGISTER_ACCESS_METHODS:
+            method = getattr(self.tpm, name, None)
+            if method is None:
+                continue
+
+            def counting_method(*args, _method=method, **kwargs):
+                count[0] += 1
+                return _method(*args, **kwargs)
+
+            replaced[name] = self.tpm.__dict__.get(name)
+            setattr(self.tpm, name, counting_method)
+        try:
+            yield count
+        finally:
+            for name, original in replaced.items():
+                if original is None:
+                    delattr(self.tpm, name)
+                else:
+                    setattr(self.tpm, name, original)
+
+    def all_monitoring_rates(self):
+        """
+        Returns the list of rate attribute values assigned to monitoring points,
+        see set_monitoring_point_attr. Used by HealthMonitoringScheduler.
+
+        :return: list of rates
+        :rtype: list
+        """
+        rates = set()
+        for monitoring_point in self.all_monitoring_points():
+            lookup_entry = self._parse_dict_by_path(self.monitoring_point_lookup_dict, monitoring_point.split('.'))
+            rates.update(lookup_entry.get('rate', []))
+        return sorted(rates, key=str)
+
+    def _read_health_snapshot(self, mon_point_list):
+        """
+        Read the raw value of a list of monitoring points.
+
+        Monitoring points are grouped by the method which reads them. When the
+        method is listed in BLOCK_READ_METHODS and more than one monitoring point
+        uses it with the same arguments, apart from the argument selecting the
+        item, the method is called once for all items and the value of each
+        monitoring point is extracted from the result. For example, all voltages
+        are read with a single get_voltage() call rather than one call per
+        voltage. A single call can still make several register accesses.
+
+        :param mon_point_list: List of monitoring points
+        :type mon_point_list: list of strings
+
+        :return: raw value of each monitoring point and number of method calls
+        :rtype: tuple(dict, int)
+        """
+        values = {}
+        blocks = {}
+        for monitoring_point in mon_point_list:
+            lookup = monitoring_point.split('.')
+            method = self._parse_dict_by_path(self.monitoring_point_lookup_dict, lookup)["method"]
+            block = None
+            if isinstance(method, partial) and not method.args:
+                select_arg, key_format = BLOCK_READ_METHODS.get(method.func.__name__, (None, None))
+                if select_arg in method.keywords:
+                    block_kwargs = {k: v for k, v in method.keywords.items() if k != select_arg}
+                    block = (method.func, select_arg, tuple(sorted(block_kwargs.items())))
+                    item = key_format.format(method.keywords[select_arg])
+            if block is None:
+                blocks[(monitoring_point,)] = [(monitoring_point, None)]
+            else:
+                blocks.setdefault(block, []).append((monitoring_point, item))
+
+        def read_single(monitoring_point):
+            # Read a monitoring point with its own method
+            return self._parse_dict_by_path(self.monitoring_point_lookup_dict, monitoring_point.split('.'))["method"]()
+
+        nof_method_calls = 0
+        for block, items in blocks.items():
+            if len(items) == 1:
+                monitoring_point = items[0][0]
+                values[monitoring_point] = read_single(monitoring_point)
+                nof_method_calls += 1
+                continue
+
+            func, select_arg, block_kwargs = block
+            result = func(**dict(block_kwargs), **{select_arg: None})
+            nof_method_calls += 1
+            for monitoring_point, item in items:
+                if isinstance(result, dict) and item in result:
+                    values[monitoring_point] = {item: result[item]}
+                else:
+                    # Item not returned by the block read, read it on its own
+                    values[monitoring_point] = read_single(monitoring_point)
+                    nof_method_calls += 1
+        return values, nof_method_calls
+
     @communication_check
     @health_monitoring_compatible
     def clear_health_status(self):
@@ -0,0 +1,90 @@
+from __future__ import division
+import numpy as np
+
+# Real-valued precision used to accumulate visibilities for each supported output precision
+_ACCUMULATOR_TYPES = {np.dtype(np.complex64): np.float32,
+                      np.dtype(np.complex128): np.float64}
+
+# Cache of upper triangular baseline antenna indices, keyed by number of antennas
+_baseline_indices = {}
+
+
+def nof_baselines(nof_antennas):
+    """ Return the number of baselines, including autocorrelations, for a number of antennas
+    :param nof_antennas: Number of antennas
+    :return: Number of baselines """
+    return nof_antennas * (nof_antennas + 1) // 2
+
+
+def baseline_indices(nof_antennas):
+    """ Return the antenna pair of each baseline in upper triangular order, that is antenna1 <= antenna2 with
+    antenna2 varying fastest. This is the order in which correlation files are stored.
+    :param nof_antennas: Number of antennas
+    :return: Tuple with arrays of first and second antenna indices """
+    if nof_antennas not in _baseline_indices:
+        _baseline_indices[nof_antennas] = np.triu_indices(nof_antennas)
+    return _baseline_indices[nof_antennas]
+
+
+def correlate(data, output=None, precision=np.complex64, block_size=16384):
+    """ Correlate all antenna and polarisation pairs, generating the full upper triangular set of visibilities.
+    Visibilities are computed as the matrix product X.X^H, where X contains the antenna/polarisation signals as rows,
+    accumulated over blocks of samples. Signed 8-bit complex input (with 'real' and 'imag' fields) is converted to
+    real-valued blocks of the accumulator precision, rather than to a complex copy of the entire input, and the real
+    and imaginary parts are correlated with a single real matrix product.
+    :param data: Input data with shape [..., antennas, polarisations, samples]. Leading dimensions, such as channels,
+                 are correlated independently in the same call. Data can be complex or have a complex_8t dtype
+    :param output: Optional output array with shape [..., polarisations ** 2, baselines]
+    :param precision: Output precision, np.complex64 or np.complex128
+    :param block_size: Number of samples correlated per matrix product, which limits temporary memory usage
+    :return: Visibilities with shape [..., polarisations ** 2, baselines], where the polarisation product index is
+             pol1 * polarisations + pol2 and each visibility is sum(x[antenna1, pol1] * conj(x[antenna2, pol2])) """
+
+    precision = np.dtype(precision)
+    if precision not in _ACCUMULATOR_TYPES:
+        raise ValueError("Unsupported output precision {}".format(precision))
+    accumulator_type = _ACCUMULATOR_TYPES[precision]
+
+    nof_antennas, nof_pols, nof_samples = data.shape[-3:]
+    batch_shape = data.shape[:-3]
+    nof_inputs = nof_antennas * nof_pols
+
+    # Flatten antennas and polarisations into signal rows
+    data = data.reshape(batch_shape + (nof_inputs, nof_samples))
+
+    if data.dtype.names is not None:
+        # Stack real and imaginary parts as real-valued rows, so that Y.Y^T contains all real and imaginary products
+        gram = np.zeros(batch_shape + (2 * nof_inputs, 2 * nof_inputs), dtype=accumulator_type)
+        block = np.empty(batch_shape + (2 * nof_inputs, min(block_size, nof_samples)), dtype=accumulator_type)
+        for start in range(0, nof_samples, block_size):
+            end = min(start + block_size, nof_samples)
+            current = block[..., :end - start]
+            current[..., :nof_inputs, :] = data['real'][..., start:end]
+            current[..., nof_inputs:, :] = data['imag'][..., start:end]
+            gram += np.matmul(current, np.swapaxes(current, -1, -2))
+
+        # For x = r + ji, x1.conj(x2) = (r1.r2 + i1.i2) + j(i1.r2 - r1.i2)
+        visibilities = np.empty(batch_shape + (nof_inputs, nof_inputs), dtype=precision)
+        visibilities.real = gram[..., :nof_inputs, :nof_inputs] + gram[..., nof_inputs:, nof_inputs:]
+        visibilities.imag = gram[..., nof_inputs:, :nof_inputs] - gram[..., :nof_inputs, nof_inputs:]
+    else:
+        visibilities = np.zeros(batch_shape + (nof_inputs, nof_inputs), dtype=precision)
+        for start in range(0, nof_samples, block_size):
+            current = data[..., start:start + block_size].astype(precision, copy=False)
+            visibilities += np.matmul(current, np.swapaxes(current, -1, -2).conj())
+
+    # Select upper triangular antenna pairs and arrange as [..., pol1 * pols + pol2, baseline]
+    antenna1, antenna2 = baseline_indices(nof_antennas)
+    visibilities = visibilities.reshape(batch_shape + (nof_antennas, nof_pols, nof_antennas, nof_pols))
+    visibilities = visibilities[..., antenna1, :, antenna2, :]
+
+    # Advanced indexing places the baseline dimension first
+    visibilities = np.moveaxis(visibilities, 0, -3)
+    visibilities = visibilities.reshape(batch_shape + (nof_baselines(nof_antennas), nof_pols * nof_pols))
+    visibilities = np.swapaxes(visibilities, -1, -2)
+
+    if output is None:
+        return np.ascontiguousarray(visibilities)
+
+    output[...] = visibilities
+    return output
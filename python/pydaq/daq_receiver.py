@@ -19,6 +19,7 @@ import numpy as np
 from pyaavs.slack import get_slack_instance
 from pydaq.interface import *
 from pydaq.persisters import *
+from pydaq.persisters.utils import lower_to_upper_triangular
 import pyaavs.logger
 
 
@@ -397,31 +398,7 @@ def correlator_callback(data, timestamp, channel, arg2):
 
     # The correlator reorders the matrix in lower triangular form, this needs to be converted
     # to upper triangular form to be compatible with the rest of the system
-    data = np.reshape(np.conj(values), (nof_baselines, nof_stokes))
-    grid = np.zeros((nof_antennas, nof_antennas, nof_stokes), dtype=np.complex64)
-
-    counter = 0
-    for i in range(nof_antennas):
-        for j in range(i + 1):
-            grid[j, i, :] = data[counter, :]
-            counter += 1
-
-    values = np.zeros(nof_baselines * nof_stokes, dtype=np.complex64)
-
-    counter = 0
-    for i in range(nof_antennas):
-        for j in range(i, nof_antennas):
-            values[counter * nof_stokes:(counter + 1) * nof_stokes] = grid[i, j, :]
-            counter += 1
-
-    # # Convert from lower triangular to upper triangular form using some numpy magic
-    # values = values.reshape((nof_channels, nof_baselines, nof_stokes))
-    # indices = np.tril_indices(nof_antennas)
-    # grid = np.zeros((nof_channels, nof_antennas, nof_antennas, nof_stokes))
-    # grid[:, indices[0], indices[1]] = values[:]
-    # grid.transpose((0, 2, 1, 3))
-    # indices = np.triu_indices(nof_antennas)
-    # values = np.conj(grid[:, indices[0], indices[1], :])
+    values = lower_to_upper_triangular(values, nof_antennas, nof_stokes)
 
     # Persist extracted data to file
     if conf['nof_correlator_channels'] == 1:
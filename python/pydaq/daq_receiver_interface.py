@@ -1,13 +1,15 @@
 import ctypes
 import fcntl
 import json
+import queue
 import signal
 import socket
 import struct
 import threading
+import time
 from ctypes.util import find_library
 from enum import IntEnum
-from typing import Callable, Union, List, Dict, Any, Optional, Type
+from typing import Callable, Union, List, Dict, Any, Optional, Tuple, Type
 
 import numpy as np
 import yaml
@@ -16,6 +18,8 @@ from pyaavs.logger import root_logger as daq_logger
 from pyaavs.slack import get_slack_instance
 from pydaq.persisters import *
 from pydaq.persisters import aavs_file
+from pydaq.live_tap import LiveDataPublisher, segment_name
+from pydaq.persisters.utils import lower_to_upper_triangular
 
 
 # Define consumer type Enums
@@ -36,6 +40,110 @@ class DaqModes(IntEnum):
 complex_8t = np.dtype([('real', np.int8), ('imag', np.int8)])
 
 
+class PersistenceQueue:
+    """ Bounded queue of received buffers drained by a dedicated writer thread, used to decouple
+    data callbacks from disk writes. When the queue is full buffers are dropped and counted """
+
+    def __init__(self, name: str, writer: Callable, depth: int):
+        """ Class constructor
+        :param name: Name of the writer thread
+        :param writer: Function called by the writer thread for each queued item
+        :param depth: Maximum number of buffers which can be queued """
+        self._name = name
+        self._writer = writer
+        self._queue = queue.Queue(maxsize=depth)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._depth = depth
+        self._nof_queued = 0
+        self._nof_dropped = 0
+        self._nof_written = 0
+        self._nof_failed = 0
+        self._max_queue_depth = 0
+        self._total_write_time = 0
+        self._max_write_time = 0
+        self._last_write_time = 0
+        self._total_latency = 0
+        self._max_latency = 0
+
+    def start(self) -> None:
+        """ Start writer thread """
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Wait for all queued buffers to be written and stop writer thread """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def put(self, *item) -> bool:
+        """ Queue an item for the writer thread without blocking
+        :param item: Arguments to pass to the writer function
+        :return: True if item was queued, False if it was dropped """
+        try:
+            self._queue.put_nowait((time.time(), item))
+        except queue.Full:
+            with self._lock:
+                self._nof_dropped += 1
+                nof_dropped = self._nof_dropped
+            if nof_dropped == 1 or nof_dropped % 100 == 0:
+                logging.warning("{} queue full, dropped {} buffers so far".format(self._name, nof_dropped))
+            return False
+
+        with self._lock:
+            self._nof_queued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return True
+
+    def statistics(self) -> Dict[str, Any]:
+        """ Return queue and writer statistics. Times are in seconds, latency is measured
+        from when a buffer is queued to when it has been written """
+        with self._lock:
+            nof_written = max(self._nof_written, 1)
+            return {"queue_depth": self._queue.qsize(),
+                    "max_queue_depth": self._max_queue_depth,
+                    "queue_size": self._depth,
+                    "queued": self._nof_queued,
+                    "dropped": self._nof_dropped,
+                    "written": self._nof_written,
+                    "failed": self._nof_failed,
+                    "last_write_time": self._last_write_time,
+                    "mean_write_time": self._total_write_time / nof_written,
+                    "max_write_time": self._max_write_time,
+                    "mean_latency": self._total_latency / nof_written,
+                    "max_latency": self._max_latency}
+
+    def _run(self) -> None:
+        """ Writer thread main loop """
+        while True:
+            queued_item = self._queue.get()
+            if queued_item is None:
+                break
+
+            queued_time, item = queued_item
+            start_time = time.time()
+            try:
+                self._writer(*item)
+            except Exception as e:
+                logging.error("{} failed to persist buffer: {}".format(self._name, e))
+                with self._lock:
+                    self._nof_failed += 1
+                continue
+
+            end_time = time.time()
+            with self._lock:
+                self._nof_written += 1
+                self._last_write_time = end_time - start_time
+                self._total_write_time += self._last_write_time
+                self._max_write_time = max(self._max_write_time, self._last_write_time)
+                self._total_latency += end_time - queued_time
+                self._max_latency = max(self._max_latency, end_time - queued_time)
+
+
 class DaqReceiver:
     """ Class implementing interface to low-level data acquisition system """
 
@@ -120,6 +228,14 @@ class DaqReceiver:
                         "write_to_disk": True,
                         "station_config": None,
                         "max_filesize": None,
+                        "cache_file_handles": False,
+                        "file_flush_interval": 1.0,
+                        "file_idle_timeout": 60.0,
+                        "asynchronous_persistence": False,
+                        "persistence_queue_depth": 32,
+                        "live_tap": False,
+                        "live_tap_name": "aavs_daq",
+                        "live_tap_slots": 4,
                         "acquisition_duration": -1,
                         "acquisition_start_time": -1,
                         "description": "",
@@ -149,6 +265,12 @@ class DaqReceiver:
         # List of data persisters
         self._persisters = {}
 
+        # Persistence queues, one per running mode, used when asynchronous persistence is enabled
+        self._persistence_queues = {}
+
+        # Live data publishers, one per running mode, used when the live tap is enabled
+        self._live_publishers = {}
+
         # Timestamp placeholders for append mode (otherwise we'd end up creating
         # a different file per callback
         self._timestamps = {}
@@ -165,6 +287,9 @@ class DaqReceiver:
         # Placeholder for continuous and station data to skip first few buffers
         self._buffer_counter = {}
 
+        # Reusable output buffer for reordered correlator data
+        self._correlator_buffer = None
+
         # Slack messenger, get default instance (dummy)
         self._slack = get_slack_instance("")
 
@@ -177,14 +302,18 @@ class DaqReceiver:
         :param timestamp: Timestamp of first data point in data
         """
 
-        # If writing to disk is not enabled, return immediately
-        if not self._config['write_to_disk']:
+        # If writing to disk and the live tap are not enabled, return immediately
+        if not self._config['write_to_disk'] and DaqModes.RAW_DATA not in self._live_publishers:
             return
 
         # Extract data sent by DAQ
         nof_values = self._config['nof_antennas'] * self._config['nof_polarisations'] * self._config['nof_raw_samples']
         values = self._get_numpy_from_ctypes(data, np.int8, nof_values)
 
+        self._publish_live_data(DaqModes.RAW_DATA, tile, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         # If we have threshold enabled, then calculate RMS and only save if the threshold is not exceeded
         if self._config['raw_rms_threshold'] > -1:
             # Note data is in antennas/samples/pols
@@ -198,11 +327,8 @@ class DaqReceiver:
                 return
 
         # Persist extracted data to file
-        filename = self._persisters[DaqModes.RAW_DATA].ingest_data(data_ptr=values, timestamp=timestamp, tile_id=tile)
-
-        # Call external callback if defined
-        if self._external_callbacks[DaqModes.RAW_DATA] is not None:
-            self._external_callbacks[DaqModes.RAW_DATA]("burst_raw", filename, tile)
+        self._persist_data(DaqModes.RAW_DATA, self._persisters[DaqModes.RAW_DATA], ("burst_raw", tile),
+                           data_ptr=values, timestamp=timestamp, tile_id=tile)
 
         if self._config['logging']:
             logging.info("Received raw data for tile {}".format(tile))
@@ -217,8 +343,15 @@ class DaqReceiver:
         :param mode: Channel transmission mode
         """
 
-        # If writing to disk is not enabled, return immediately
-        if not self._config['write_to_disk']:
+        if mode == 'continuous':
+            daq_mode = DaqModes.CONTINUOUS_CHANNEL_DATA
+        elif mode == 'integrated':
+            daq_mode = DaqModes.INTEGRATED_CHANNEL_DATA
+        else:
+            daq_mode = DaqModes.CHANNEL_DATA
+
+        # If writing to disk and the live tap are not enabled, return immediately
+        if not self._config['write_to_disk'] and daq_mode not in self._live_publishers:
             return
 
         # Ignore first two buffers for continuous channel mode
@@ -248,6 +381,10 @@ class DaqReceiver:
                                                  self._config['nof_antennas'] * self._config['nof_polarisations'] * \
                                                  self._config['nof_channel_samples'] * self._config['nof_channels'])
 
+        self._publish_live_data(daq_mode, tile, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         # Persist extracted data to file
         if mode == 'continuous':
             if DaqModes.CONTINUOUS_CHANNEL_DATA not in list(self._timestamps.keys()):
@@ -256,25 +393,23 @@ class DaqReceiver:
             persister = self._persisters[DaqModes.CHANNEL_DATA]
 
             if self._config['continuous_period'] == 0:
-                filename = persister.ingest_data(append=True,
-                                                 data_ptr=values,
-                                                 timestamp=self._timestamps[DaqModes.CONTINUOUS_CHANNEL_DATA],
-                                                 sampling_time=self._sampling_time[DaqModes.CONTINUOUS_CHANNEL_DATA],
-                                                 buffer_timestamp=timestamp,
-                                                 channel_id=channel_id,
-                                                 tile_id=tile)
+                self._persist_data(DaqModes.CONTINUOUS_CHANNEL_DATA, persister, ("cont_channel", tile),
+                                   append=True,
+                                   data_ptr=values,
+                                   timestamp=self._timestamps[DaqModes.CONTINUOUS_CHANNEL_DATA],
+                                   sampling_time=self._sampling_time[DaqModes.CONTINUOUS_CHANNEL_DATA],
+                                   buffer_timestamp=timestamp,
+                                   channel_id=channel_id,
+                                   tile_id=tile)
             else:
-                filename = persister.ingest_data(append=False,
-                                                 data_ptr=values,
-                                                 timestamp=timestamp,
-                                                 sampling_time=self._sampling_time[DaqModes.CONTINUOUS_CHANNEL_DATA],
-                                                 channel_id=channel_id,
-                                                 buffer_timestamp=timestamp,
-                                                 tile_id=tile)
-
-            # Call external callback if defined
-            if self._external_callbacks[DaqModes.CONTINUOUS_CHANNEL_DATA] is not None:
-                self._external_callbacks[DaqModes.CONTINUOUS_CHANNEL_DATA]("cont_channel", filename, tile)
+                self._persist_data(DaqModes.CONTINUOUS_CHANNEL_DATA, persister, ("cont_channel", tile),
+                                   append=False,
+                                   data_ptr=values,
+                                   timestamp=timestamp,
+                                   sampling_time=self._sampling_time[DaqModes.CONTINUOUS_CHANNEL_DATA],
+                                   channel_id=channel_id,
+                                   buffer_timestamp=timestamp,
+                                   tile_id=tile)
 
             if self._config['logging']:
                 logging.info("Received continuous channel data for tile {} - channel {}".format(tile, channel_id))
@@ -286,36 +421,31 @@ class DaqReceiver:
             persister = self._persisters[DaqModes.INTEGRATED_CHANNEL_DATA]
 
             if self._config['append_integrated']:
-                filename = persister.ingest_data(append=True,
-                                                 data_ptr=values,
-                                                 timestamp=self._timestamps[DaqModes.INTEGRATED_CHANNEL_DATA],
-                                                 buffer_timestamp=timestamp,
-                                                 tile_id=tile)
+                self._persist_data(DaqModes.INTEGRATED_CHANNEL_DATA, persister, ("integrated_channel", tile),
+                                   append=True,
+                                   data_ptr=values,
+                                   timestamp=self._timestamps[DaqModes.INTEGRATED_CHANNEL_DATA],
+                                   buffer_timestamp=timestamp,
+                                   tile_id=tile)
             else:
-                filename = persister.ingest_data(append=False,
-                                                 data_ptr=values,
-                                                 timestamp=timestamp,
-                                                 sampling_time=self._sampling_time[DaqModes.INTEGRATED_CHANNEL_DATA],
-                                                 buffer_timestamp=timestamp,
-                                                 tile_id=tile)
-
-            # Call external callback if defined
-            if self._external_callbacks[DaqModes.INTEGRATED_CHANNEL_DATA] is not None:
-                self._external_callbacks[DaqModes.INTEGRATED_CHANNEL_DATA]("integrated_channel", filename, tile)
+                self._persist_data(DaqModes.INTEGRATED_CHANNEL_DATA, persister, ("integrated_channel", tile),
+                                   append=False,
+                                   data_ptr=values,
+                                   timestamp=timestamp,
+                                   sampling_time=self._sampling_time[DaqModes.INTEGRATED_CHANNEL_DATA],
+                                   buffer_timestamp=timestamp,
+                                   tile_id=tile)
 
             if self._config['logging']:
                 logging.info("Received integrated channel data for tile {}".format(tile))
 
         else:
             persister = self._persisters[DaqModes.CHANNEL_DATA]
-            filename = persister.ingest_data(data_ptr=values,
-                                             timestamp=timestamp,
-                                             sampling_time=self._sampling_time[DaqModes.CHANNEL_DATA],
-                                             tile_id=tile)
-
-            # Call external callback if defined
-            if self._external_callbacks[DaqModes.CHANNEL_DATA] is not None:
-                self._external_callbacks[DaqModes.CHANNEL_DATA]("burst_channel", filename, tile)
+            self._persist_data(DaqModes.CHANNEL_DATA, persister, ("burst_channel", tile),
+                               data_ptr=values,
+                               timestamp=timestamp,
+                               sampling_time=self._sampling_time[DaqModes.CHANNEL_DATA],
+                               tile_id=tile)
 
             if self._config['logging']:
                 logging.info("Received burst channel data for tile {}".format(tile))
@@ -353,8 +483,8 @@ class DaqReceiver:
         :param tile: The tile from which the data was acquired
         """
 
-        # If writing to disk is not enabled, return immediately
-        if not self._config['write_to_disk']:
+        # If writing to disk and the live tap are not enabled, return immediately
+        if not self._config['write_to_disk'] and DaqModes.BEAM_DATA not in self._live_publishers:
             return
 
         # Extract data sent by DAQ
@@ -362,16 +492,17 @@ class DaqReceiver:
                                              self._config['nof_beams'] * self._config['nof_polarisations'] * \
                                              self._config['nof_beam_samples'] * self._config['nof_beam_channels'])
 
+        self._publish_live_data(DaqModes.BEAM_DATA, tile, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         # Persist extracted data to file
         persister = self._persisters[DaqModes.BEAM_DATA]
-        filename = persister.ingest_data(data_ptr=values,
-                                         timestamp=timestamp,
-                                         sampling_time=self._sampling_time[DaqModes.BEAM_DATA],
-                                         tile_id=tile)
-
-        # Call external callback if defined
-        if self._external_callbacks[DaqModes.BEAM_DATA] is not None:
-            self._external_callbacks[DaqModes.BEAM_DATA]("burst_beam", filename, tile)
+        self._persist_data(DaqModes.BEAM_DATA, persister, ("burst_beam", tile),
+                           data_ptr=values,
+                           timestamp=timestamp,
+                           sampling_time=self._sampling_time[DaqModes.BEAM_DATA],
+                           tile_id=tile)
 
         if self._config['logging']:
             logging.info("Received beam data for tile {}".format(tile))
@@ -383,8 +514,8 @@ class DaqReceiver:
         :param timestamp: Timestamp of first data point in data
         """
 
-        # If writing to disk is not enabled, return immediately
-        if not self._config['write_to_disk']:
+        # If writing to disk and the live tap are not enabled, return immediately
+        if not self._config['write_to_disk'] and DaqModes.INTEGRATED_BEAM_DATA not in self._live_publishers:
             return
 
         # Extract data sent by DAQ
@@ -395,32 +526,33 @@ class DaqReceiver:
         values = np.reshape(values, (self._config['nof_beams'], self._config['nof_polarisations'], 384))
         values = values.flatten()
 
+        self._publish_live_data(DaqModes.INTEGRATED_BEAM_DATA, tile, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         if DaqModes.INTEGRATED_BEAM_DATA not in list(self._timestamps.keys()):
             self._timestamps[DaqModes.INTEGRATED_BEAM_DATA] = timestamp
 
         # Persist extracted data to file
         persister = self._persisters[DaqModes.INTEGRATED_BEAM_DATA]
-        filename = persister.ingest_data(append=self._config['append_integrated'],
-                                         data_ptr=values,
-                                         timestamp=self._timestamps[DaqModes.INTEGRATED_BEAM_DATA],
-                                         sampling_time=self._sampling_time[DaqModes.INTEGRATED_BEAM_DATA],
-                                         buffer_timestamp=timestamp,
-                                         tile_id=tile)
+        self._persist_data(DaqModes.INTEGRATED_BEAM_DATA, persister, ("integrated_beam", tile),
+                           append=self._config['append_integrated'],
+                           data_ptr=values,
+                           timestamp=self._timestamps[DaqModes.INTEGRATED_BEAM_DATA],
+                           sampling_time=self._sampling_time[DaqModes.INTEGRATED_BEAM_DATA],
+                           buffer_timestamp=timestamp,
+                           tile_id=tile)
 
         if self._config['logging']:
             logging.info("Received integrated beam data for tile {}".format(tile))
 
-        # Call external callback if defined
-        if self._external_callbacks[DaqModes.INTEGRATED_BEAM_DATA] is not None:
-            self._external_callbacks[DaqModes.INTEGRATED_BEAM_DATA]("integrated_beam", filename, tile)
-
     def _correlator_callback(self, data: ctypes.POINTER, timestamp: float, channel_id: int, _: int) -> None:
         """ Correlated data callback
         :param data: Received data
         :param timestamp: Timestamp of first sample in data
         :param channel_id: Channel identifier"""
 
-        if not self._config['write_to_disk']:
+        if not self._config['write_to_disk'] and DaqModes.CORRELATOR_DATA not in self._live_publishers:
             return
 
         # Extract data sent by DAQ
@@ -433,22 +565,13 @@ class DaqReceiver:
 
         # The correlator reorders the matrix in lower triangular form, this needs to be converted
         # to upper triangular form to be compatible with the rest of the system
-        data = np.reshape(np.conj(values), (nof_baselines, nof_stokes))
-        grid = np.zeros((nof_antennas, nof_antennas, nof_stokes), dtype=np.complex64)
-
-        counter = 0
-        for i in range(nof_antennas):
-            for j in range(i + 1):
-                grid[j, i, :] = data[counter, :]
-                counter += 1
+        if self._correlator_buffer is None or self._correlator_buffer.size != values.size:
+            self._correlator_buffer = np.empty(values.size, dtype=np.complex64)
+        values = lower_to_upper_triangular(values, nof_antennas, nof_stokes, self._correlator_buffer)
 
-        values = np.zeros(nof_baselines * nof_stokes, dtype=np.complex64)
-
-        counter = 0
-        for i in range(nof_antennas):
-            for j in range(i, nof_antennas):
-                values[counter * nof_stokes:(counter + 1) * nof_stokes] = grid[i, j, :]
-                counter += 1
+        self._publish_live_data(DaqModes.CORRELATOR_DATA, channel_id, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
 
         # Persist extracted data to file
         persister = self._persisters[DaqModes.CORRELATOR_DATA]
@@ -457,25 +580,23 @@ class DaqReceiver:
             if DaqModes.CORRELATOR_DATA not in list(self._timestamps.keys()):
                 self._timestamps[DaqModes.CORRELATOR_DATA] = timestamp
 
-            filename = persister.ingest_data(append=True,
-                                             data_ptr=values,
-                                             timestamp=self._timestamps[DaqModes.CORRELATOR_DATA],
-                                             sampling_time=self._sampling_time[DaqModes.CORRELATOR_DATA],
-                                             buffer_timestamp=timestamp,
-                                             channel_id=channel_id)
+            self._persist_data(DaqModes.CORRELATOR_DATA, persister, ("correlator",),
+                               append=True,
+                               data_ptr=values,
+                               timestamp=self._timestamps[DaqModes.CORRELATOR_DATA],
+                               sampling_time=self._sampling_time[DaqModes.CORRELATOR_DATA],
+                               buffer_timestamp=timestamp,
+                               channel_id=channel_id)
         else:
-            filename = persister.ingest_data(append=False,
-                                             data_ptr=values,
-                                             timestamp=timestamp,
-                                             sampling_time=self._sampling_time[DaqModes.CORRELATOR_DATA],
-                                             channel_id=channel_id)
-
-        # Call external callback if defined
-        if self._external_callbacks[DaqModes.CORRELATOR_DATA] is not None:
-            self._external_callbacks[DaqModes.CORRELATOR_DATA]("correlator", filename)
+            self._persist_data(DaqModes.CORRELATOR_DATA, persister, ("correlator",),
+                               append=False,
+                               data_ptr=values,
+                               timestamp=timestamp,
+                               sampling_time=self._sampling_time[DaqModes.CORRELATOR_DATA],
+                               channel_id=channel_id)
 
         if self._config['logging']:
-            logging.info("Received correlated data for channel {}".format(channel))
+            logging.info("Received correlated data for channel {}".format(channel_id))
 
     def _station_callback(self, data: ctypes.POINTER, timestamp: float, nof_packets: int, nof_saturations: int) -> None:
         """ Correlated data callback
@@ -484,7 +605,7 @@ class DaqReceiver:
         :param nof_packets: Number of packets received for this buffer
         :param nof_saturations: Number of saturated samples whilst acquiring buffer"""
 
-        if not self._config['write_to_disk']:
+        if not self._config['write_to_disk'] and DaqModes.STATION_BEAM_DATA not in self._live_publishers:
             return
 
         if 'station' not in list(self._buffer_counter.keys()):
@@ -500,22 +621,23 @@ class DaqReceiver:
         values = self._get_numpy_from_ctypes(data, np.double,
                                              self._config['nof_beam_channels'] * self._config['nof_polarisations'])
 
+        self._publish_live_data(DaqModes.STATION_BEAM_DATA, 0, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         # Persist extracted data to file
         if DaqModes.STATION_BEAM_DATA not in list(self._timestamps.keys()):
             self._timestamps[DaqModes.STATION_BEAM_DATA] = timestamp
 
         persister = self._persisters[DaqModes.STATION_BEAM_DATA]
-        filename = persister.ingest_data(append=True,
-                                         data_ptr=values,
-                                         timestamp=self._timestamps[DaqModes.STATION_BEAM_DATA],
-                                         sampling_time=self._sampling_time[DaqModes.STATION_BEAM_DATA],
-                                         buffer_timestamp=timestamp,
-                                         station_id=0,  # TODO: Get station ID from station config, if possible
-                                         sample_packets=nof_packets)
-
-        # Call external callback
-        if self._external_callbacks[DaqModes.STATION_BEAM_DATA] is not None:
-            self._external_callbacks[DaqModes.STATION_BEAM_DATA]("station", filename, nof_packets * 256)
+        self._persist_data(DaqModes.STATION_BEAM_DATA, persister, ("station", nof_packets * 256),
+                           append=True,
+                           data_ptr=values,
+                           timestamp=self._timestamps[DaqModes.STATION_BEAM_DATA],
+                           sampling_time=self._sampling_time[DaqModes.STATION_BEAM_DATA],
+                           buffer_timestamp=timestamp,
+                           station_id=0,  # TODO: Get station ID from station config, if possible
+                           sample_packets=nof_packets)
 
         if self._config['logging']:
             logging.info(
@@ -529,8 +651,8 @@ class DaqReceiver:
         :param timestamp: Timestamp of first data point in data
         """
 
-        # If writing to disk is not enabled, return immediately
-        if not self._config['write_to_disk']:
+        # If writing to disk and the live tap are not enabled, return immediately
+        if not self._config['write_to_disk'] and DaqModes.ANTENNA_BUFFER not in self._live_publishers:
             return
 
         # Extract data sent by DAQ
@@ -538,26 +660,112 @@ class DaqReceiver:
                      self._config['nof_raw_samples']
         values = self._get_numpy_from_ctypes(data, np.int8, nof_values)
 
+        self._publish_live_data(DaqModes.ANTENNA_BUFFER, tile, timestamp, values)
+        if not self._config['write_to_disk']:
+            return
+
         # Persist extracted data to file
         if DaqModes.ANTENNA_BUFFER not in list(self._timestamps.keys()):
             self._timestamps[DaqModes.ANTENNA_BUFFER] = timestamp
 
         # Persist extracted data to file
-        filename = self._persisters[DaqModes.ANTENNA_BUFFER].ingest_data(append=True,
-                                                                         data_ptr=values,
-                                                                         timestamp=self._timestamps[
-                                                                             DaqModes.ANTENNA_BUFFER],
-                                                                         buffer_timestamp=timestamp,
-                                                                         tile_id=tile,
-                                                                         disable_per_sample_timestamp=True)
-
-        # Call external callback if defined
-        if self._external_callbacks[DaqModes.ANTENNA_BUFFER] is not None:
-            self._external_callbacks[DaqModes.ANTENNA_BUFFER]("antenna_buffer", filename, tile)
+        self._persist_data(DaqModes.ANTENNA_BUFFER, self._persisters[DaqModes.ANTENNA_BUFFER],
+                           ("antenna_buffer", tile),
+                           append=True,
+                           data_ptr=values,
+                           timestamp=self._timestamps[DaqModes.ANTENNA_BUFFER],
+                           buffer_timestamp=timestamp,
+                           tile_id=tile,
+                           disable_per_sample_timestamp=True)
 
         if self._config['logging']:
             logging.info("Received antenna buffer data for tile {}".format(tile))
 
+    def _persist_data(self, mode: DaqModes, persister: aavs_file.AAVSFileManager, callback_args: tuple,
+                      **kwargs) -> None:
+        """ Persist a received buffer and call the external callback for the mode. If asynchronous persistence
+        is enabled the buffer is copied and queued for the mode's writer thread, and this returns immediately
+        :param mode: DAQ mode which received the buffer
+        :param persister: Data persister to write the buffer with
+        :param callback_args: External callback arguments, the filename is inserted after the first one
+        :param kwargs: Arguments for the persister's ingest_data """
+
+        if mode in self._persistence_queues:
+            # Received buffer is owned by the C++ consumer, so it must be copied before queueing
+            kwargs['data_ptr'] = np.copy(kwargs['data_ptr'])
+            self._persistence_queues[mode].put(mode, persister, callback_args, kwargs)
+        else:
+            self._write_data(mode, persister, callback_args, kwargs)
+
+    def _write_data(self, mode: DaqModes, persister: aavs_file.AAVSFileManager, callback_args: tuple,
+                    kwargs: Dict[str, Any]) -> None:
+        """ Write a buffer to disk and call the external callback for the mode
+        :param mode: DAQ mode which received the buffer
+        :param persister: Data persister to write the buffer with
+        :param callback_args: External callback arguments, the filename is inserted after the first one
+        :param kwargs: Arguments for the persister's ingest_data """
+
+        filename = persister.ingest_data(**kwargs)
+
+        # Call external callback if defined
+        if self._external_callbacks[mode] is not None:
+            self._external_callbacks[mode](callback_args[0], filename, *callback_args[1:])
+
+    def _publish_live_data(self, mode: DaqModes, source: int, timestamp: float, values: np.ndarray) -> None:
+        """ Publish a received buffer to the live tap of its mode, if enabled
+        :param mode: DAQ mode which received the buffer
+        :param source: Tile, or channel for correlated data, from which the buffer was received
+        :param timestamp: Timestamp of first data point in buffer
+        :param values: Received buffer """
+        publisher = self._live_publishers.get(mode)
+        if publisher is not None:
+            publisher.publish(source, timestamp, values)
+
+    def _live_data_layout(self, mode: DaqModes) -> Tuple[np.dtype, Tuple[int, ...], Tuple[str, ...], int]:
+        """ Buffer layout of a mode as received in data callbacks
+        :param mode: DAQ mode
+        :return: Data type, shape, axis names and maximum number of sources """
+        nof_antennas = self._config['nof_antennas']
+        nof_pols = self._config['nof_polarisations']
+        nof_tiles = self._config['nof_tiles']
+
+        if mode in [DaqModes.RAW_DATA, DaqModes.ANTENNA_BUFFER]:
+            return (np.dtype(np.int8), (nof_antennas, self._config['nof_raw_samples'], nof_pols),
+                    ('antennas', 'samples', 'pols'), nof_tiles)
+        if mode == DaqModes.CHANNEL_DATA:
+            return (complex_8t, (self._config['nof_channels'], self._config['nof_channel_samples'], nof_antennas,
+                                 nof_pols), ('channels', 'samples', 'antennas', 'pols'), nof_tiles)
+        if mode == DaqModes.CONTINUOUS_CHANNEL_DATA:
+            return (complex_8t, (self._config['nof_channel_samples'], nof_antennas, nof_pols),
+                    ('samples', 'antennas', 'pols'), nof_tiles)
+        if mode == DaqModes.INTEGRATED_CHANNEL_DATA:
+            return (np.dtype(np.uint16), (self._config['nof_channels'], nof_antennas, nof_pols),
+                    ('channels', 'antennas', 'pols'), nof_tiles)
+        if mode == DaqModes.BEAM_DATA:
+            return (complex_16t, (nof_pols, self._config['nof_beam_samples'], self._config['nof_beam_channels'],
+                                  self._config['nof_beams']), ('pols', 'samples', 'channels', 'beams'), nof_tiles)
+        if mode == DaqModes.INTEGRATED_BEAM_DATA:
+            return (np.dtype(np.uint32), (self._config['nof_beams'], nof_pols, 384), ('beams', 'pols', 'channels'),
+                    nof_tiles)
+        if mode == DaqModes.STATION_BEAM_DATA:
+            return (np.dtype(np.double), (nof_pols, self._config['nof_beam_channels']), ('pols', 'channels'), 1)
+        if mode == DaqModes.CORRELATOR_DATA:
+            nof_stations_antennas = nof_tiles * nof_antennas
+            return (np.dtype(np.complex64), (nof_stations_antennas * (nof_stations_antennas + 1) // 2,
+                                             nof_pols * nof_pols), ('baselines', 'stokes'),
+                    self._config['nof_correlator_channels'])
+        raise ValueError("Unknown DAQ mode {}".format(mode))
+
+    def get_live_tap_names(self) -> Dict[DaqModes, str]:
+        """ Return the shared memory segment name of the live tap of each running mode, to be used
+        with pydaq.live_tap.LiveDataSubscriber """
+        return {mode: publisher.name for mode, publisher in self._live_publishers.items()}
+
+    def get_persistence_statistics(self) -> Dict[DaqModes, Dict[str, Any]]:
+        """ Return queue depth, dropped buffer and write latency statistics for each mode using
+        asynchronous persistence """
+        return {mode: persistence_queue.statistics() for mode, persistence_queue in self._persistence_queues.items()}
+
     def _start_raw_data_consumer(self, callback: Optional[Callable] = None) -> None:
         """ Start raw data consumer
         :param callback: Caller callback """
@@ -1063,6 +1271,33 @@ class DaqReceiver:
             if DaqModes.ANTENNA_BUFFER == mode:
                 self._start_antenna_buffer_data_consumer()
 
+        # Start a writer thread per mode if asynchronous persistence is enabled
+        if self._config['asynchronous_persistence']:
+            for mode in daq_modes:
+                if mode not in self._persistence_queues:
+                    self._persistence_queues[mode] = PersistenceQueue("{}_writer".format(mode.name.lower()),
+                                                                      self._write_data,
+                                                                      self._config['persistence_queue_depth'])
+                    self._persistence_queues[mode].start()
+
+        # Publish received buffers to shared memory for local subscribers if requested
+        if self._config['live_tap']:
+            for mode in daq_modes:
+                if mode not in self._live_publishers:
+                    dtype, shape, axes, nof_sources = self._live_data_layout(mode)
+                    self._live_publishers[mode] = LiveDataPublisher(
+                        segment_name(self._config['live_tap_name'], mode), mode.name, dtype, shape, nof_sources,
+                        nof_slots=self._config['live_tap_slots'],
+                        metadata={'axes': axes, 'sampling_time': self._sampling_time[mode]})
+                    logging.info("Publishing live {} to shared memory segment {}".format(
+                        mode.name, self._live_publishers[mode].name))
+
+        # Keep files open across appends if requested
+        if self._config['cache_file_handles']:
+            for persister in self._persisters.values():
+                persister.enable_handle_cache(flush_interval=self._config['file_flush_interval'],
+                                              idle_timeout=self._config['file_idle_timeout'])
+
     def stop_daq(self) -> None:
         """ Stop DAQ """
 
@@ -1086,6 +1321,21 @@ class DaqReceiver:
             if running:
                 stop_functions[k]()
 
+        # Remove live taps, subscribers keep their mapping until they detach
+        for publisher in self._live_publishers.values():
+            publisher.close()
+        self._live_publishers = {}
+
+        # Write any queued buffers and stop writer threads
+        for mode, persistence_queue in self._persistence_queues.items():
+            persistence_queue.stop()
+            logging.info("{} persistence statistics: {}".format(mode.name, persistence_queue.statistics()))
+        self._persistence_queues = {}
+
+        # Flush and close any files kept open by the persisters
+        for persister in self._persisters.values():
+            persister.close_cached_files()
+
         # Stop DAQ receiver thread
         if self._call_stop_receiver() != self.Result.Success.value:
             raise Exception("Failed to stop receiver")
@@ -1527,6 +1777,26 @@ if __name__ == "__main__":
                       default=None, type="float",
                       help="Maximum file size in GB, set 0 to save each data set to a separate "
                            "hdf5 file [default: 4 GB]")
+    parser.add_option("--cache-file-handles", action="store_true", dest="cache_file_handles", default=False,
+                      help="Keep files open across appends instead of re-opening them for every buffer. Files are "
+                           "locked whilst open [default: Disabled]")
+    parser.add_option("--file-flush-interval", action="store", dest="file_flush_interval", default=1.0,
+                      type="float", help="Minimum time in seconds between flushes of open files [default: 1.0]")
+    parser.add_option("--file-idle-timeout", action="store", dest="file_idle_timeout", default=60.0,
+                      type="float", help="Time in seconds after which an unused open file is closed [default: 60]")
+    parser.add_option("--asynchronous-persistence", action="store_true", dest="asynchronous_persistence",
+                      default=False, help="Queue received buffers and write them to disk in a separate thread per "
+                                          "mode [default: Disabled]")
+    parser.add_option("--persistence-queue-depth", action="store", dest="persistence_queue_depth", default=32,
+                      type="int", help="Maximum number of buffers queued per mode when using asynchronous "
+                                       "persistence, additional buffers are dropped [default: 32]")
+    parser.add_option("--live-tap", action="store_true", dest="live_tap", default=False,
+                      help="Publish the latest buffers of each mode in shared memory for local subscribers, "
+                           "see pydaq.live_tap [default: Disabled]")
+    parser.add_option("--live-tap-name", action="store", dest="live_tap_name", default="aavs_daq",
+                      help="Prefix of live tap shared memory segment names [default: aavs_daq]")
+    parser.add_option("--live-tap-slots", action="store", dest="live_tap_slots", default=4, type="int",
+                      help="Number of buffers kept per tile in each live tap [default: 4]")
     parser.add_option("--disable-logging", action="store_false", dest="logging", default=True,
                       help="Disable logging [default: Enabled]")
 
@@ -0,0 +1,339 @@
+import json
+import logging
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Identifies an initialised live tap segment
+LIVE_TAP_MAGIC = 0x4141565354415031
+LIVE_TAP_VERSION = 2
+
+# Size of the segment header, containing the control structure followed by JSON metadata
+HEADER_SIZE = 4096
+
+# Alignment of the source table and slots in the segment
+ALIGNMENT = 64
+
+# Segment control structure, at the start of the header
+_CONTROL_DTYPE = np.dtype([('magic', np.uint64), ('version', np.uint32), ('nof_sources', np.uint32),
+                           ('nof_slots', np.uint32), ('metadata_size', np.uint32), ('slot_size', np.uint64),
+                           ('data_size', np.uint64), ('tracker', np.uint64)])
+
+# Source table entry: source identifier (-1 if unused) and sequence number of its latest buffer (0 if none)
+_SOURCE_DTYPE = np.dtype([('source', np.int64), ('sequence', np.uint64)])
+
+# Slot header, followed by the buffer data. A sequence number of 0 marks a slot being written
+_SLOT_DTYPE = np.dtype([('sequence', np.uint64), ('timestamp', np.float64)])
+
+
+def _align(size: int) -> int:
+    """ Round a size up to the segment alignment """
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def segment_name(prefix: str, mode: Any) -> str:
+    """ Name of the shared memory segment of a DAQ mode
+    :param prefix: Live tap name prefix, the DaqReceiver live_tap_name setting
+    :param mode: DaqModes mode or mode name """
+    name = mode.name if hasattr(mode, 'name') else str(mode)
+    return "{}_{}".format(prefix, name.lower())
+
+
+def _tracker_id() -> int:
+    """ Identifier of the resource tracker of this process. Processes started through multiprocessing share the
+    tracker of their parent, and with it the tracker pipe, so the pipe inode identifies the tracker """
+    try:
+        return os.fstat(resource_tracker.getfd()).st_ino
+    except (AttributeError, OSError):
+        return 0
+
+
+def _attach(name: str) -> Tuple[shared_memory.SharedMemory, bool]:
+    """ Attach to an existing shared memory segment, without registering it with the resource tracker if possible
+    :return: The segment and whether it was registered with the resource tracker """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False), False
+    except TypeError:
+        return shared_memory.SharedMemory(name=name), True
+
+
+def _release_registration(segment: shared_memory.SharedMemory, publisher_tracker: int) -> None:
+    """ Remove the registration made when attaching to a segment on Pythons without SharedMemory(track=False).
+    A tracker other than the publisher's would unlink the segment when this process exits, so the registration
+    is removed. The publisher's tracker holds a single registration per segment, which the publisher removes when
+    it unlinks the segment, so it is left in place when the tracker is shared, for example by a subscriber started
+    through multiprocessing from the publisher's process
+    :param segment: Attached segment
+    :param publisher_tracker: Tracker identifier stored by the publisher, 0 if not known """
+    if publisher_tracker == 0 or publisher_tracker != _tracker_id():
+        resource_tracker.unregister(segment._name, "shared_memory")
+
+
+class _LiveTapSegment:
+    """ Views of the control structure, source table and slots of a live tap segment """
+
+    def __init__(self, segment: shared_memory.SharedMemory, nof_sources: int, nof_slots: int,
+                 dtype: np.dtype, shape: Tuple[int, ...]):
+        self.segment = segment
+        self.dtype = dtype
+        self.shape = tuple(shape)
+        self.nof_sources = nof_sources
+        self.nof_slots = nof_slots
+        self.data_size = int(np.prod(self.shape)) * dtype.itemsize
+        self.slot_size = ALIGNMENT + _align(self.data_size)
+
+        self.control = np.ndarray((), dtype=_CONTROL_DTYPE, buffer=segment.buf)
+        self.sources = np.ndarray(nof_sources, dtype=_SOURCE_DTYPE, buffer=segment.buf, offset=HEADER_SIZE)
+
+        # Slot headers and data are strided views of the slots, so that writes go straight to the segment
+        slots_offset = HEADER_SIZE + _align(nof_sources * _SOURCE_DTYPE.itemsize)
+        slot_strides = (nof_slots * self.slot_size, self.slot_size)
+        self.slot_headers = np.ndarray((nof_sources, nof_slots), dtype=_SLOT_DTYPE, buffer=segment.buf,
+                                       offset=slots_offset, strides=slot_strides)
+        data_strides = tuple(int(np.prod(self.shape[i + 1:])) * dtype.itemsize for i in range(len(self.shape)))
+        self.slot_data = np.ndarray((nof_sources, nof_slots) + self.shape, dtype=dtype, buffer=segment.buf,
+                                    offset=slots_offset + ALIGNMENT, strides=slot_strides + data_strides)
+
+    @staticmethod
+    def segment_size(nof_sources: int, nof_slots: int, dtype: np.dtype, shape: Tuple[int, ...]) -> int:
+        """ Size in bytes of a segment """
+        slot_size = ALIGNMENT + _align(int(np.prod(shape)) * dtype.itemsize)
+        return HEADER_SIZE + _align(nof_sources * _SOURCE_DTYPE.itemsize) + nof_sources * nof_slots * slot_size
+
+    def release(self) -> None:
+        """ Drop views of the segment, so that it can be closed """
+        self.control = self.sources = self.slot_headers = self.slot_data = None
+
+
+class LiveDataPublisher:
+    """ Publishes the most recent buffers of a DAQ mode in a shared memory segment, for local subscribers.
+
+    Each source (a tile, or a channel for correlated data) has a ring of slots holding its latest buffers with
+    increasing sequence numbers. A buffer is published by invalidating the slot after the current one, copying
+    the data into it and then updating the source's latest sequence number, so subscribers can read the latest
+    buffer in place and check whether it was overwritten while they were reading it. Publishing never blocks
+    on subscribers """
+
+    def __init__(self, name: str, mode: str, dtype: Union[np.dtype, type], shape: Tuple[int, ...],
+                 nof_sources: int, nof_slots: int = 4, metadata: Optional[Dict[str, Any]] = None):
+        """ Class constructor
+        :param name: Shared memory segment name
+        :param mode: Name of the DAQ mode
+        :param dtype: Data type of buffers
+        :param shape: Shape of buffers
+        :param nof_sources: Maximum number of sources
+        :param nof_slots: Number of slots per source, at least 2
+        :param metadata: Additional metadata for subscribers, must be JSON serialisable """
+
+        dtype = np.dtype(dtype)
+        metadata = json.dumps(dict(metadata or {}, mode=mode, dtype=np.lib.format.dtype_to_descr(dtype),
+                                   shape=list(shape))).encode()
+        if len(metadata) > HEADER_SIZE - _CONTROL_DTYPE.itemsize:
+            raise ValueError("Live tap metadata for {} too large".format(mode))
+        nof_slots = max(nof_slots, 2)
+
+        size = _LiveTapSegment.segment_size(nof_sources, nof_slots, dtype, shape)
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a DAQ which was not stopped cleanly
+            logging.warning("Replacing existing live tap segment {}".format(name))
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.name = name
+        self.mode = mode
+        self._segment = _LiveTapSegment(segment, nof_sources, nof_slots, dtype, shape)
+        self._source_index = {}
+        self._rejected_sources = set()
+
+        buffer = segment.buf
+        buffer[_CONTROL_DTYPE.itemsize:_CONTROL_DTYPE.itemsize + len(metadata)] = metadata
+        self._segment.sources['source'] = -1
+        self._segment.sources['sequence'] = 0
+        self._segment.slot_headers['sequence'] = 0
+
+        control = self._segment.control
+        control['version'] = LIVE_TAP_VERSION
+        control['nof_sources'] = nof_sources
+        control['nof_slots'] = nof_slots
+        control['metadata_size'] = len(metadata)
+        control['slot_size'] = self._segment.slot_size
+        control['data_size'] = self._segment.data_size
+        control['tracker'] = _tracker_id()
+
+        # Written last, subscribers only attach to initialised segments
+        control['magic'] = LIVE_TAP_MAGIC
+
+    def publish(self, source: int, timestamp: float, data: np.ndarray) -> Optional[int]:
+        """ Copy a buffer into the next slot of a source
+        :param source: Source identifier, such as the tile
+        :param timestamp: Buffer timestamp
+        :param data: Buffer data, with as many values as the buffer shape
+        :return: Sequence number of the published buffer, None if there is no room for a new source """
+
+        index = self._source_index.get(source)
+        if index is None:
+            if len(self._source_index) == self._segment.nof_sources:
+                # Only warn the first time a source is rejected, this is called for every buffer
+                if source not in self._rejected_sources:
+                    self._rejected_sources.add(source)
+                    logging.warning("Live tap {} full, not publishing source {}".format(self.name, source))
+                return None
+            index = len(self._source_index)
+            self._source_index[source] = index
+            self._segment.sources[index]['source'] = source
+
+        sequence = int(self._segment.sources[index]['sequence']) + 1
+        slot = sequence % self._segment.nof_slots
+
+        slot_header = self._segment.slot_headers[index, slot]
+        slot_header['sequence'] = 0
+        self._segment.slot_data[index, slot] = np.reshape(data, self._segment.shape)
+        slot_header['timestamp'] = timestamp
+        slot_header['sequence'] = sequence
+
+        self._segment.sources[index]['sequence'] = sequence
+        return sequence
+
+    def close(self) -> None:
+        """ Close and remove the segment. Attached subscribers keep their mapping until they close """
+        segment = self._segment.segment
+        self._segment.control['magic'] = 0
+        self._segment.release()
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class LiveDataSubscriber:
+    """ Reads the latest buffers of a DAQ mode published by a LiveDataPublisher in another process """
+
+    def __init__(self, name: str):
+        """ Class constructor
+        :param name: Shared memory segment name, see segment_name """
+        segment, registered = _attach(name)
+        control = np.ndarray((), dtype=_CONTROL_DTYPE, buffer=segment.buf)
+        valid = control['magic'] == LIVE_TAP_MAGIC and control['version'] == LIVE_TAP_VERSION
+        if registered:
+            _release_registration(segment, int(control['tracker']) if valid else 0)
+        if not valid:
+            del control
+            segment.close()
+            raise IOError("Shared memory segment {} is not an initialised live tap".format(name))
+
+        start = _CONTROL_DTYPE.itemsize
+        self.metadata = json.loads(bytes(segment.buf[start:start + int(control['metadata_size'])]).decode())
+        self.name = name
+        self.mode = self.metadata['mode']
+        self._segment = _LiveTapSegment(segment, int(control['nof_sources']), int(control['nof_slots']),
+                                        np.lib.format.descr_to_dtype(self.metadata['dtype']),
+                                        tuple(self.metadata['shape']))
+        del control
+
+    @classmethod
+    def for_mode(cls, mode: Any, prefix: str = "aavs_daq") -> "LiveDataSubscriber":
+        """ Attach to the live tap of a DAQ mode
+        :param mode: DaqModes mode or mode name
+        :param prefix: Live tap name prefix, the DaqReceiver live_tap_name setting """
+        return cls(segment_name(prefix, mode))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._segment.dtype
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._segment.shape
+
+    def is_active(self) -> bool:
+        """ Whether the publisher is still publishing to this segment """
+        return self._segment.control['magic'] == LIVE_TAP_MAGIC
+
+    def sources(self) -> List[int]:
+        """ Identifiers of sources which have published buffers """
+        sources = self._segment.sources['source']
+        return [int(source) for source in sources[sources >= 0]]
+
+    def latest_sequence(self, source: int) -> int:
+        """ Sequence number of the latest buffer of a source, 0 if none was published """
+        index = self._index(source)
+        return 0 if index is None else int(self._segment.sources[index]['sequence'])
+
+    def view(self, source: int, sequence: Optional[int] = None) -> Optional[Tuple[int, float, np.ndarray]]:
+        """ Get a buffer without copying it. The returned array maps the slot, which the publisher overwrites after
+        nof_slots - 1 newer buffers, so check is_valid after using the data
+        :param source: Source identifier
+        :param sequence: Sequence number of the buffer, the latest buffer if None
+        :return: (sequence, timestamp, data) tuple, None if the buffer is not available """
+        index = self._index(source)
+        if index is None:
+            return None
+        if sequence is None:
+            sequence = int(self._segment.sources[index]['sequence'])
+        if sequence == 0:
+            return None
+
+        slot_header = self._segment.slot_headers[index, sequence % self._segment.nof_slots]
+        timestamp = float(slot_header['timestamp'])
+        if int(slot_header['sequence']) != sequence:
+            return None
+        return sequence, timestamp, self._segment.slot_data[index, sequence % self._segment.nof_slots]
+
+    def is_valid(self, source: int, sequence: int) -> bool:
+        """ Whether a buffer obtained with view is still held in its slot """
+        index = self._index(source)
+        return index is not None and \
+            int(self._segment.slot_headers[index, sequence % self._segment.nof_slots]['sequence']) == sequence
+
+    def read_latest(self, source: int, out: Optional[np.ndarray] = None,
+                    retries: int = 3) -> Optional[Tuple[int, float, np.ndarray]]:
+        """ Copy the latest buffer of a source, retrying if it is overwritten while being copied
+        :param source: Source identifier
+        :param out: Array in which to copy the buffer, allocated if None
+        :param retries: Number of attempts
+        :return: (sequence, timestamp, data) tuple, None if no consistent buffer could be read """
+        for _ in range(retries):
+            latest = self.view(source)
+            if latest is None:
+                return None
+            sequence, timestamp, data = latest
+            if out is None:
+                out = np.empty(self.shape, dtype=self.dtype)
+            out[...] = data
+            if self.is_valid(source, sequence):
+                return sequence, timestamp, out
+        return None
+
+    def wait_for_update(self, source: int, last_sequence: int, timeout: Optional[float] = None,
+                        poll_interval: float = 0.01) -> int:
+        """ Wait until a source publishes a buffer newer than last_sequence
+        :param source: Source identifier
+        :param last_sequence: Sequence number of the last buffer read
+        :param timeout: Maximum time to wait in seconds, None to wait indefinitely
+        :param poll_interval: Time in seconds between checks
+        :return: Latest sequence number, equal to last_sequence on timeout """
+        start = time.time()
+        while True:
+            sequence = self.latest_sequence(source)
+            if sequence > last_sequence or (timeout is not None and time.time() - start >= timeout):
+                return sequence
+            time.sleep(poll_interval)
+
+    def close(self) -> None:
+        """ Detach from the segment. Arrays returned by view must not be used afterwards """
+        segment = self._segment.segment
+        self._segment.release()
+        segment.close()
+
+    def _index(self, source: int) -> Optional[int]:
+        """ Index of a source in the source table """
+        indices = np.flatnonzero(self._segment.sources['source'] == source)
+        return int(indices[0]) if len(indices) > 0 else None
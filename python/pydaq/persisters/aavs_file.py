@@ -13,10 +13,10 @@ import sys
 import time
 import logging
 from abc import abstractmethod
-import ntpath
 
 from lockfile import FileLock
 from pydaq.persisters.definitions import *
+from pydaq.persisters.file_index import DirectoryIndex
 
 
 class PlotTypes(Enum):
@@ -40,6 +40,11 @@ class AAVSFileManager(object):
     # following an append operation, the next append operation will be placed in a new partition.
     FILE_SIZE_GIGABYTES = 4.0  # 0.1GB
 
+    # Default flush cadence and idle timeout (in seconds) for file handles kept open in append mode when handle caching
+    # is enabled. Cached handles are flushed at most once per flush interval and closed after the idle timeout.
+    HANDLE_FLUSH_INTERVAL = 1.0
+    HANDLE_IDLE_TIMEOUT = 60.0
+
     def __init__(self, root_path=None, file_type=None, daq_mode=None, data_type=None, observation_metadata=None):
         """
         Constructor for the AAVSFileManager
@@ -104,6 +109,13 @@ class AAVSFileManager(object):
         self.station_id = 0
         self.tsamp = 0
 
+        # Open file handle cache for append mode, disabled by default. Entries are keyed by (DAQ mode, tile ID, file
+        # timestamp) and keep the file handle, partition, number of blocks and final timestamp in memory
+        self.cache_handles = False
+        self.flush_interval = self.HANDLE_FLUSH_INTERVAL
+        self.idle_timeout = self.HANDLE_IDLE_TIMEOUT
+        self._handle_cache = {}
+
     @abstractmethod
     def configure(self, file_obj):
         """
@@ -308,6 +320,106 @@ class AAVSFileManager(object):
         elif sys.version_info.major == 3:
             return list(range(start_idx, end_idx))
 
+    @staticmethod
+    def index_selection(indices):
+        """
+        Converts a list of indices into an equivalent slice if the indices are increasing and equally spaced (e.g. all
+        channels, a contiguous range of antennas or every other column).
+        :param indices: A list of indices
+        :return: An equivalent slice, or None if the indices cannot be represented as a slice
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64).ravel()
+        if indices.size == 0:
+            return None
+        if indices.size == 1:
+            return slice(int(indices[0]), int(indices[0]) + 1)
+
+        step = int(indices[1] - indices[0])
+        if step > 0 and numpy.all(numpy.diff(indices) == step):
+            return slice(int(indices[0]), int(indices[-1]) + 1, step)
+        return None
+
+    @staticmethod
+    def read_selection(dset, selection, output):
+        """
+        Reads a selection from an HDF5 dataset into a preallocated output buffer. Dimensions which are selected with a
+        contiguous slice, or with a list of indices which can be converted to one, are read as a hyperslab. If all
+        dimensions are contiguous and the output buffer is C-contiguous the data is read directly into the output
+        buffer. Otherwise the bounding hyperslab is read and the requested indices are gathered into the output buffer
+        with a single copy, which is much faster than an HDF5 point or strided selection since chunks span entire
+        rows of the datasets.
+        :param dset: The HDF5 dataset to read from
+        :param selection: A tuple with a slice or a list of indices for each dimension of the dataset
+        :param output: Output buffer, with the same number of elements as the selection
+        :return:
+        """
+        if output.size == 0:
+            return
+
+        source_sel, gather = [], []
+        for sel, size in zip(selection, dset.shape):
+            if not isinstance(sel, slice):
+                sel = AAVSFileManager.index_selection(sel) or numpy.asarray(sel, dtype=numpy.int64).ravel()
+
+            if isinstance(sel, slice) and sel.step in [None, 1]:
+                source_sel.append(sel)
+                gather.append(None)
+            else:
+                # Strided or irregular selection, read the bounding hyperslab and gather the indices afterwards
+                indices = numpy.arange(size)[sel] if isinstance(sel, slice) else sel
+                source_sel.append(slice(int(indices.min()), int(indices.max()) + 1))
+                gather.append(indices - indices.min())
+
+        source_sel = tuple(source_sel)
+        if all(indices is None for indices in gather):
+            if output.flags.c_contiguous and output.dtype == dset.dtype:
+                selection_shape = tuple(len(range(*sel.indices(size))) for sel, size in zip(source_sel, dset.shape))
+                dset.read_direct(output.reshape(selection_shape), source_sel)
+            else:
+                output[...] = dset[source_sel].reshape(output.shape)
+        else:
+            data = dset[source_sel]
+            gather = [numpy.arange(data.shape[i]) if indices is None else indices for i, indices in enumerate(gather)]
+            output[...] = data[numpy.ix_(*gather)].reshape(output.shape)
+
+    @staticmethod
+    def memmap_dataset(dset):
+        """
+        Memory-maps an HDF5 dataset using its offset in the file. This is only possible for datasets with a
+        contiguous, uncompressed layout, such as those in files rewritten by finalise_file().
+        :param dset: The HDF5 dataset to map
+        :return: A read-only numpy.memmap of the dataset, or None if the dataset cannot be memory-mapped
+        """
+        if dset.chunks is not None or dset.compression is not None or dset.size == 0:
+            return None
+
+        offset = dset.id.get_offset()
+        if offset is None:
+            return None
+
+        return numpy.memmap(dset.file.filename, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape)
+
+    @staticmethod
+    def memmap_selection(data, selection):
+        """
+        Applies a selection to a memory-mapped dataset. If every dimension can be selected with a slice, a view of
+        the memory map is returned, otherwise the selected elements are copied.
+        :param data: A memory-mapped dataset
+        :param selection: A tuple with a slice or a list of indices for each dimension of the dataset
+        :return: The selected data
+        """
+        index = []
+        for sel in selection:
+            if not isinstance(sel, slice):
+                sel = AAVSFileManager.index_selection(sel) or numpy.asarray(sel, dtype=numpy.int64).ravel()
+            index.append(sel)
+
+        if all(isinstance(sel, slice) for sel in index):
+            return data[tuple(index)]
+
+        index = [numpy.arange(size)[sel] if isinstance(sel, slice) else sel for sel, size in zip(index, data.shape)]
+        return data[numpy.ix_(*index)]
+
     def ingest_data(self, data_ptr=None, timestamp=None, append=False, sampling_time=0,
                     buffer_timestamp=None, tile_id=0, beam_id=0, **kwargs):
         """
@@ -338,7 +450,15 @@ class AAVSFileManager(object):
 
         self.tsamp = sampling_time
 
-        if append:
+        # If handle caching is enabled, partition, final timestamp and file size are served from the cached entry
+        cached_handle = None
+        if append and self.cache_handles:
+            self._evict_idle_handles()
+            cached_handle = self._get_cached_handle(timestamp=timestamp, tile_id=tile_id)
+
+        if cached_handle is not None:
+            final_timestamp = cached_handle.previous_ts_end
+        elif append:
             n_parts = self.file_partitions(timestamp=timestamp, tile_id=tile_id)
             if n_parts > 0:
                 final_timestamp = self.file_final_timestamp(timestamp=timestamp, tile_id=tile_id, partition=n_parts - 1)
@@ -353,16 +473,28 @@ class AAVSFileManager(object):
             timestamp_pad = final_timestamp
 
         # check file size
-        current_size = self.file_size(timestamp=timestamp, tile_id=tile_id)
+        if cached_handle is not None:
+            current_size = cached_handle.file_size()
+        else:
+            current_size = self.file_size(timestamp=timestamp, tile_id=tile_id)
+
         if current_size < self.FILE_SIZE_GIGABYTES:
             if append:
-                return self._append_data(data_ptr=data_ptr,
-                                         timestamp=timestamp,
-                                         sampling_time=sampling_time,
-                                         buffer_timestamp=buffer_timestamp,
-                                         tile_id=tile_id,
-                                         timestamp_pad=timestamp_pad,
-                                         **kwargs)
+                filename = self._append_data(data_ptr=data_ptr,
+                                             timestamp=timestamp,
+                                             sampling_time=sampling_time,
+                                             buffer_timestamp=buffer_timestamp,
+                                             tile_id=tile_id,
+                                             timestamp_pad=timestamp_pad,
+                                             **kwargs)
+
+                # A newly cached handle keeps the final timestamp of the previous partition used for padding
+                if self.cache_handles and cached_handle is None:
+                    new_handle = self._handle_cache.get(self._handle_cache_key(timestamp=timestamp, tile_id=tile_id))
+                    if new_handle is not None:
+                        new_handle.previous_ts_end = final_timestamp
+
+                return filename
             else:
                 return self._write_data(data_ptr=data_ptr,
                                         timestamp=timestamp,
@@ -373,6 +505,10 @@ class AAVSFileManager(object):
                                         timestamp_pad=timestamp_pad,
                                         **kwargs)
         else:
+            # Partition rollover, the current partition handle must be closed before a new partition is created
+            if cached_handle is not None:
+                self._evict_handle(cached_handle.key)
+
             last_partition = self.file_partitions(timestamp=timestamp, tile_id=tile_id)
             final_timestamp = self.file_final_timestamp(timestamp=timestamp, tile_id=tile_id)
             new_partition = last_partition + 1
@@ -385,6 +521,139 @@ class AAVSFileManager(object):
                                     timestamp_pad=final_timestamp + sampling_time,
                                     **kwargs)
 
+    def enable_handle_cache(self, flush_interval=None, idle_timeout=None):
+        """
+        Keep files open across append operations instead of re-opening them for every ingested buffer. Whilst a handle
+        is cached the file remains locked by this manager, so readers will only be able to access it once the handle
+        is evicted (on partition rollover, idle timeout or when close_cached_files() is called).
+        :param flush_interval: Minimum time, in seconds, between flushes of a cached file. None uses the default.
+        :param idle_timeout: Time, in seconds, after which an unused cached file is closed. None uses the default.
+        :return:
+        """
+        self.cache_handles = True
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+
+    def disable_handle_cache(self):
+        """
+        Close all cached file handles and revert to opening and closing files on every append operation.
+        :return:
+        """
+        self.close_cached_files()
+        self.cache_handles = False
+
+    def close_cached_files(self):
+        """
+        Flush and close all file handles held in the handle cache.
+        :return:
+        """
+        for key in list(self._handle_cache.keys()):
+            self._evict_handle(key)
+
+    def _handle_cache_key(self, timestamp=None, tile_id=0):
+        """
+        Returns the handle cache key for a file batch.
+        :param timestamp: The base timestamp for a file batch.
+        :param tile_id: The tile identifier for a file batch.
+        :return: Cache key tuple
+        """
+        return self.daqmode, tile_id, timestamp
+
+    def _get_cached_handle(self, timestamp=None, tile_id=0):
+        """
+        Returns the cached handle entry for a file batch, if any. Entries for the same tile but a different file
+        timestamp are evicted, since a new timestamp marks the start of a new file batch.
+        :param timestamp: The base timestamp for a file batch.
+        :param tile_id: The tile identifier for a file batch.
+        :return: A _CachedFileHandle, or None if the file batch is not cached.
+        """
+        key = self._handle_cache_key(timestamp=timestamp, tile_id=tile_id)
+        for other_key in list(self._handle_cache.keys()):
+            if other_key != key and other_key[:2] == key[:2]:
+                self._evict_handle(other_key)
+
+        return self._handle_cache.get(key, None)
+
+    def _evict_handle(self, key):
+        """
+        Remove an entry from the handle cache, flushing and closing its file.
+        :param key: Handle cache key.
+        :return:
+        """
+        cached_handle = self._handle_cache.pop(key, None)
+        if cached_handle is not None:
+            cached_handle.file_obj.flush()
+            self.close_file(cached_handle.file_obj)
+
+    def _evict_idle_handles(self):
+        """
+        Close cached file handles which have not been used within the idle timeout.
+        :return:
+        """
+        now = time.time()
+        for key, cached_handle in list(self._handle_cache.items()):
+            if now - cached_handle.last_access > self.idle_timeout:
+                self._evict_handle(key)
+
+    def _open_append_file(self, timestamp=None, tile_id=0, partition_id=0):
+        """
+        Returns a file object to be appended to. If handle caching is enabled, the cached handle is re-used, otherwise
+        the latest partition is loaded, or created if it does not exist.
+        :param timestamp: The base timestamp for a file batch.
+        :param tile_id: The tile identifier for a file batch.
+        :param partition_id: The partition to create if no file exists for the file batch.
+        :return: An HDF5 file object.
+        """
+        if self.cache_handles:
+            cached_handle = self._handle_cache.get(self._handle_cache_key(timestamp=timestamp, tile_id=tile_id), None)
+            if cached_handle is not None:
+                cached_handle.last_access = time.time()
+                self._load_root_metadata(cached_handle.file_obj)
+                return cached_handle.file_obj
+
+        file_obj = None
+        # noinspection PyBroadException
+        try:
+            file_obj = self.load_file(timestamp=timestamp, tile_id=tile_id, mode='r+')
+        except:
+            logging.error("Error opening file in append mode")
+
+        # Finalised files have a contiguous layout, so their datasets cannot be resized
+        if file_obj is not None and file_obj["root"].attrs.get('finalised', False):
+            filename = file_obj.filename
+            self.close_file(file_obj)
+            raise ValueError("File {} is finalised and can no longer be appended to".format(filename))
+
+        if file_obj is None:
+            file_obj = self.create_file(timestamp=timestamp, tile_id=tile_id, partition_id=partition_id)
+
+        if self.cache_handles:
+            key = self._handle_cache_key(timestamp=timestamp, tile_id=tile_id)
+            self._handle_cache[key] = _CachedFileHandle(key, file_obj)
+
+        return file_obj
+
+    def _close_append_file(self, file_obj, timestamp=None, tile_id=0):
+        """
+        Releases a file object obtained through _open_append_file. Cached handles are kept open and only flushed if the
+        flush interval has elapsed, otherwise the file is flushed and closed.
+        :param file_obj: The file object to release.
+        :param timestamp: The base timestamp for a file batch.
+        :param tile_id: The tile identifier for a file batch.
+        :return:
+        """
+        cached_handle = self._handle_cache.get(self._handle_cache_key(timestamp=timestamp, tile_id=tile_id), None)
+        if cached_handle is not None and cached_handle.file_obj is file_obj:
+            now = time.time()
+            if now - cached_handle.last_flush >= self.flush_interval:
+                file_obj.flush()
+                cached_handle.last_flush = now
+        else:
+            file_obj.flush()
+            self.close_file(file_obj)
+
     @staticmethod
     def check_root_integrity(file_obj):
         """
@@ -511,81 +780,16 @@ class AAVSFileManager(object):
         """
 
         filename_prefix, filename_mode_prefix = self.get_prefixes()
-        largest_partition_id = -1
+        directory_index = DirectoryIndex.get_index(self.root_path)
 
         if timestamp is None:
-            date_time = None
+            date_time = directory_index.latest_date_time(filename_prefix, filename_mode_prefix, tile_id)
+            if date_time is None:
+                return -1
         else:
             date_time = self._get_date_time(timestamp=timestamp)
 
-        if tile_id is None:
-            tile_id_str = ''
-        else:
-            tile_id_str = str(tile_id)
-
-        matched_files = []
-        if date_time is not None:
-            files = next(os.walk(self.root_path))[2]
-            for file_obj in files:
-                if file_obj.startswith(filename_prefix + filename_mode_prefix + tile_id_str + "_" + str(
-                        date_time) + "_") and file_obj.endswith(".hdf5"):
-                    matched_files.append(os.path.join(self.root_path, file_obj))
-        else:
-            files = next(os.walk(self.root_path))[2]
-            for file_obj in files:
-                if file_obj.startswith(filename_prefix + filename_mode_prefix + tile_id_str) \
-                        and file_obj.endswith(".hdf5"):
-                    file_obj_filename = ntpath.basename(file_obj)
-                    if len(filename_mode_prefix) > 0:
-                        file_tile = file_obj_filename.split('_')[2]
-                    else:
-                        file_tile = file_obj_filename.split('_')[1]
-                    if int(file_tile) == tile_id:
-                        matched_files.append(os.path.join(self.root_path, file_obj))
-
-        latest_file_time = 0
-        if len(matched_files) > 0:
-            # We have a list of matched filename, sort by last modified date and get latest one
-            latest_file_time = 0
-            for file_obj in matched_files:
-                file_obj_filename = ntpath.basename(file_obj)
-                if len(filename_mode_prefix) > 0:
-                    file_time1 = file_obj_filename.split('_')[3]
-                    file_time2 = file_obj_filename.split('_')[4]
-                else:
-                    file_time1 = file_obj_filename.split('_')[2]
-                    file_time2 = file_obj_filename.split('_')[3]
-                file_time_str = file_time1 + file_time2
-                file_time = int(file_time_str)
-                if file_time > latest_file_time:
-                    latest_file_time = file_time
-
-        filtered_matched_files = []
-        for file_obj in matched_files:
-            file_obj_filename = ntpath.basename(file_obj)
-            if len(filename_mode_prefix) > 0:
-                file_time1 = file_obj_filename.split('_')[3]
-                file_time2 = file_obj_filename.split('_')[4]
-            else:
-                file_time1 = file_obj_filename.split('_')[2]
-                file_time2 = file_obj_filename.split('_')[3]
-            file_time_str = file_time1 + file_time2
-            file_time = int(file_time_str)
-            if file_time == latest_file_time:
-                filtered_matched_files.append(os.path.join(self.root_path, file_obj))
-
-        # filter matched files for timestamp
-        for file_obj in filtered_matched_files:
-            file_obj_filename = ntpath.basename(file_obj)
-            if len(filename_mode_prefix) > 0:
-                file_partition = file_obj_filename.split('_')[5]
-            else:
-                file_partition = file_obj_filename.split('_')[4]
-            file_partition = file_partition.replace(".hdf5", "")
-            if int(file_partition) > largest_partition_id:
-                largest_partition_id = int(file_partition)
-
-        return largest_partition_id
+        return directory_index.max_partition(filename_prefix, filename_mode_prefix, tile_id, date_time)
 
     def file_size(self, timestamp=None, tile_id=0):
         """
@@ -758,9 +962,15 @@ class AAVSFileManager(object):
         else:
             load_partition = partition
 
-        full_filename = None
         if timestamp is None:
-            date_time = None
+            # Get latest file set containing the partition to load
+            date_time = DirectoryIndex.get_index(self.root_path).latest_date_time(filename_prefix,
+                                                                                  filename_mode_prefix,
+                                                                                  tile_id,
+                                                                                  partition=load_partition)
+            if date_time is None:
+                logging.error("No file matching arguments were found. Check data directory")
+                return None
         else:
             date_time = self._get_date_time(timestamp=timestamp)
 
@@ -769,101 +979,68 @@ class AAVSFileManager(object):
         else:
             tile_id_str = str(tile_id)
 
-        if date_time is not None:
-            full_filename = os.path.join(self.root_path,
-                                         filename_prefix + filename_mode_prefix + tile_id_str + "_" + str(
-                                             date_time) + "_" + str(load_partition) + ".hdf5")
-
-        if date_time is None:
-            matched_files = []
-            files = next(os.walk(self.root_path))[2]
-            for file_obj in files:
-                if file_obj.startswith(filename_prefix + filename_mode_prefix) and \
-                        file_obj.endswith('_' + str(load_partition) + ".hdf5"):
-                    file_obj_filename = ntpath.basename(file_obj)
-                    if len(filename_mode_prefix) > 0:
-                        file_tile = file_obj_filename.split('_')[2]
-                    else:
-                        file_tile = file_obj_filename.split('_')[1]
-                    if int(file_tile) == tile_id:
-                        matched_files.append(os.path.join(self.root_path, file_obj))
-
-            if len(matched_files) > 0:
-                # We have a list of matched filename, sort by last modified date and get latest one
-                latest_file_time = 0
-                for file_obj in matched_files:
-                    file_obj_filename = ntpath.basename(file_obj)
-                    if len(filename_mode_prefix) > 0:
-                        file_time1 = file_obj_filename.split('_')[3]
-                        file_time2 = file_obj_filename.split('_')[4]
-                    else:
-                        file_time1 = file_obj_filename.split('_')[2]
-                        file_time2 = file_obj_filename.split('_')[3]
-                    file_time_str = file_time1 + file_time2
-                    file_time = int(file_time_str)
-                    if file_time > latest_file_time:
-                        latest_file_time = file_time
-                        full_filename = file_obj
-            else:
-                logging.error("No file matching arguments were found. Check data directory")
-                return None
+        full_filename = os.path.join(self.root_path,
+                                     filename_prefix + filename_mode_prefix + tile_id_str + "_" + str(
+                                         date_time) + "_" + str(load_partition) + ".hdf5")
 
-        if full_filename is not None:
-            if os.path.isfile(full_filename):
-                generic_full_filename = full_filename
-                try:
-                    file_obj = self.open_file(generic_full_filename, mode=mode)
-                    if AAVSFileManager.check_root_integrity(file_obj):
-                        self.main_dset = file_obj["root"]
-                        self.n_antennas = self.main_dset.attrs['n_antennas']
-                        self.n_pols = self.main_dset.attrs['n_pols']
-                        self.n_beams = self.main_dset.attrs['n_beams']
-                        self.tile_id = self.main_dset.attrs['tile_id']
-                        self.n_chans = self.main_dset.attrs['n_chans']
-                        self.n_samples = self.main_dset.attrs['n_samples']
-                        self.n_blocks = self.main_dset.attrs['n_blocks']
-                        self.date_time = self.main_dset.attrs['date_time']
-                        self.ts_start = self.main_dset.attrs['ts_start']
-                        self.ts_end = self.main_dset.attrs['ts_end']
-                        self.n_baselines = self.main_dset.attrs['n_baselines']
-                        self.n_stokes = self.main_dset.attrs['n_stokes']
-                        self.channel_id = self.main_dset.attrs['channel_id']
-                        if 'nsamp' in list(self.main_dset.attrs.keys()):
-                            self.nsamp = self.main_dset.attrs['nsamp']
-
-                        if 'station_id' in list(self.main_dset.attrs.keys()):
-                            self.station_id = self.main_dset.attrs['station_id']
-
-                        self.timestamp = self.main_dset.attrs['timestamp']
-                        self.data_type_name = self.main_dset.attrs['data_type']
-                        self.data_type = DATA_TYPE_MAP[self.data_type_name]
-
-                        if self.n_samples == 1:
-                            self.resize_factor = 1024
-                        else:
-                            self.resize_factor = self.n_samples
-
-                        if self.n_samples == 1:
-                            self.resize_factor = 1024
-                        else:
-                            self.resize_factor = self.n_samples
-
-                        if self.n_baselines > 0:
-                            self.resize_factor = self.n_baselines
-
-                        return file_obj
-                    else:
-                        logging.error("File root integrity check failed, can't load file.")
-                        return None
-                except Exception as e:
-                    logging.error(str(e))
-                    raise
-            else:
-                return None
+        if os.path.isfile(full_filename):
+            try:
+                file_obj = self.open_file(full_filename, mode=mode)
+                if AAVSFileManager.check_root_integrity(file_obj):
+                    self._load_root_metadata(file_obj)
+                    return file_obj
+                else:
+                    logging.error("File root integrity check failed, can't load file.")
+                    return None
+            except Exception as e:
+                logging.error(str(e))
+                raise
         else:
-            logging.error("Expected file does not exist.")
             return None
 
+    def _load_root_metadata(self, file_obj):
+        """
+        Populates the file manager metadata properties from the root dataset of a loaded file.
+        :param file_obj: An HDF5 file object which passed the root integrity check.
+        :return:
+        """
+        self.main_dset = file_obj["root"]
+        self.n_antennas = self.main_dset.attrs['n_antennas']
+        self.n_pols = self.main_dset.attrs['n_pols']
+        self.n_beams = self.main_dset.attrs['n_beams']
+        self.tile_id = self.main_dset.attrs['tile_id']
+        self.n_chans = self.main_dset.attrs['n_chans']
+        self.n_samples = self.main_dset.attrs['n_samples']
+        self.n_blocks = self.main_dset.attrs['n_blocks']
+        self.date_time = self.main_dset.attrs['date_time']
+        self.ts_start = self.main_dset.attrs['ts_start']
+        self.ts_end = self.main_dset.attrs['ts_end']
+        self.n_baselines = self.main_dset.attrs['n_baselines']
+        self.n_stokes = self.main_dset.attrs['n_stokes']
+        self.channel_id = self.main_dset.attrs['channel_id']
+        if 'nsamp' in list(self.main_dset.attrs.keys()):
+            self.nsamp = self.main_dset.attrs['nsamp']
+
+        if 'station_id' in list(self.main_dset.attrs.keys()):
+            self.station_id = self.main_dset.attrs['station_id']
+
+        self.timestamp = self.main_dset.attrs['timestamp']
+        self.data_type_name = self.main_dset.attrs['data_type']
+        self.data_type = DATA_TYPE_MAP[self.data_type_name]
+
+        if self.n_samples == 1:
+            self.resize_factor = 1024
+        else:
+            self.resize_factor = self.n_samples
+
+        if self.n_samples == 1:
+            self.resize_factor = 1024
+        else:
+            self.resize_factor = self.n_samples
+
+        if self.n_baselines > 0:
+            self.resize_factor = self.n_baselines
+
     def create_file(self, timestamp=None, tile_id=0, partition_id=0):
         """
         Creates a file for a particular timestamp, tile id, and particular partition.
@@ -901,6 +1078,7 @@ class AAVSFileManager(object):
 
         file_obj = self.open_file(full_filename, 'w')
         os.chmod(first_full_filename, 0o776)
+        DirectoryIndex.get_index(self.root_path).add_file(full_filename)
 
         # Create dataset with data content metadata
         self.main_dset = file_obj.create_dataset("root", (1,), chunks=True, dtype='float16')
@@ -948,7 +1126,10 @@ class AAVSFileManager(object):
 
         lock = FileLock(first_full_filename)
         file_obj.close()
-        lock.release()
+
+        # Lock files are created in the data directory, which should not force a rescan of its index
+        with DirectoryIndex.get_index(os.path.dirname(first_full_filename)).own_changes():
+            lock.release()
 
     @staticmethod
     def open_file(filename, mode='r'):
@@ -961,11 +1142,87 @@ class AAVSFileManager(object):
         first_full_filename = filename
 
         lock = FileLock(first_full_filename)
-        lock.acquire(timeout=None)
+        with DirectoryIndex.get_index(os.path.dirname(first_full_filename)).own_changes():
+            lock.acquire(timeout=None)
 
         file_obj = h5py.File(filename, mode)
         return file_obj
 
+    def finalise_file(self, timestamp=None, tile_id=0):
+        """
+        Rewrites all partitions of a closed file batch such that all datasets have a contiguous, uncompressed layout.
+        Finalised files can be memory-mapped when read (see memmap_dataset()), but can no longer be appended to.
+        :param timestamp: The base timestamp for a file batch, if None the latest file batch is finalised.
+        :param tile_id: The tile identifier for a file batch.
+        :return: The number of partitions which were rewritten.
+        """
+        nof_partitions = 0
+        for partition in range(self.file_partitions(timestamp=timestamp, tile_id=tile_id) + 1):
+            file_obj = self.load_file(timestamp=timestamp, tile_id=tile_id, partition=partition, mode='r')
+            if file_obj is None:
+                continue
+
+            filename = file_obj.filename
+            if file_obj["root"].attrs.get('finalised', False):
+                self.close_file(file_obj)
+                continue
+
+            # Write contiguous copy to a temporary file and replace the original file while the lock is still held
+            temporary_filename = filename + ".finalise"
+            try:
+                with h5py.File(temporary_filename, 'w') as finalised_obj:
+                    self._copy_contiguous(file_obj, finalised_obj)
+                    finalised_obj["root"].attrs['finalised'] = True
+                file_obj.close()
+                os.replace(temporary_filename, filename)
+                os.chmod(filename, 0o776)
+            except Exception as e:
+                logging.error("Could not finalise file {}: {}".format(filename, e))
+                if os.path.exists(temporary_filename):
+                    os.remove(temporary_filename)
+                raise
+            finally:
+                if file_obj:
+                    file_obj.close()
+                FileLock(filename).release()
+
+            nof_partitions += 1
+
+        return nof_partitions
+
+    @staticmethod
+    def _copy_contiguous(source, destination):
+        """
+        Recursively copies the groups, datasets and attributes of an HDF5 group, creating all datasets with a
+        contiguous layout. Datasets are copied in blocks of rows to limit memory usage.
+        :param source: The HDF5 group to copy from.
+        :param destination: The HDF5 group to copy to.
+        :return:
+        """
+        for key, value in source.attrs.items():
+            destination.attrs[key] = value
+
+        for name, item in source.items():
+            if isinstance(item, h5py.Group):
+                AAVSFileManager._copy_contiguous(item, destination.create_group(name))
+                continue
+
+            dset = destination.create_dataset(name, shape=item.shape, dtype=item.dtype)
+            for key, value in item.attrs.items():
+                dset.attrs[key] = value
+
+            if item.size == 0:
+                continue
+
+            if len(item.shape) == 0:
+                dset[()] = item[()]
+                continue
+
+            row_size = item.dtype.itemsize * (item.size // item.shape[0])
+            block_rows = max(1, int(256 * 1024 ** 2 // max(row_size, 1)))
+            for start in range(0, item.shape[0], block_rows):
+                dset[start:start + block_rows] = item[start:start + block_rows]
+
     def get_prefixes(self):
         """
         Given the file type and DAQ mode set up for this file manager, this method returns the appropriate filename
@@ -996,3 +1253,27 @@ class AAVSFileManager(object):
             filename_mode_prefix = "burst_"
 
         return filename_prefix, filename_mode_prefix
+
+
+class _CachedFileHandle(object):
+    """ An open file handle kept by the AAVSFileManager handle cache, together with the final timestamp of the previous
+    partition, so that the file need not be reopened for every append operation """
+
+    def __init__(self, key, file_obj):
+        """
+        Constructor for a cached file handle.
+        :param key: Handle cache key.
+        :param file_obj: The open HDF5 file object (loaded or created, so root metadata is available).
+        """
+        self.key = key
+        self.file_obj = file_obj
+        self.previous_ts_end = 0.0
+        self.last_access = time.time()
+        self.last_flush = self.last_access
+
+    def file_size(self):
+        """
+        Returns the current size of the open file in gigabytes.
+        :return: Size in gigabytes.
+        """
+        return self.file_obj.id.get_filesize() * 1e-9
@@ -54,7 +54,7 @@ class BeamFormatFileManager(AAVSFileManager):
         file_obj.flush()
 
     def read_data(self, timestamp=None, tile_id=0, channels=None, antennas=None, polarizations=None, beams=None,
-                  n_samples=None, sample_offset=None, start_ts=None, end_ts=None):
+                  n_samples=None, sample_offset=None, start_ts=None, end_ts=None, output_buffer=None, memory_map=False):
         """
         Method to read data from a beamformed data file for a given query. Queries can be done based on sample indexes,
         or timestamps.
@@ -70,9 +70,14 @@ class BeamFormatFileManager(AAVSFileManager):
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param start_ts: A start timestamp for a read query based on timestamps.
         :param end_ts: An end timestamp for a ready query based on timestamps.
-        :return:
+        :param output_buffer: An optional preallocated buffer of shape [polarizations, channels, samples, beams] to
+        read into. Data is read directly into the buffer if it is a transposed view of a C-contiguous
+        [polarizations, samples, channels, beams] array, such as the one returned by a previous call.
+        :param memory_map: If True, memory-map the data of finalised files (see finalise_file()). When the read spans a
+        single partition and polarization and no output buffer is provided, a numpy.memmap view of the file is
+        returned.
+        :return: The data, of shape [polarizations, channels, samples, beams], and the sample timestamps
         """
-        output_buffer = []
         timestamp_buffer = []
 
         metadata_dict = self.get_metadata(timestamp=timestamp, tile_id=tile_id)
@@ -110,30 +115,59 @@ class BeamFormatFileManager(AAVSFileManager):
                                                                            query_samples_read=n_samples,
                                                                            query_sample_offset=sample_offset)
 
-        concat_cnt = 0
+        if len(result) == 0:
+            return [], timestamp_buffer
+
+        # A memory-mapped read from a single partition can return a view of the file
+        if memory_map and output_buffer is None and len(result) == 1:
+            return self._read_data(timestamp=timestamp,
+                                   tile_id=tile_id,
+                                   channels=channels,
+                                   polarizations=polarizations,
+                                   beams=beams,
+                                   n_samples=result[0]["indexes"][1] - result[0]["indexes"][0],
+                                   sample_offset=result[0]["indexes"][0],
+                                   partition_id=result[0]["partition"],
+                                   memory_map=True)
+
+        # Allocate a sample-major buffer for all partitions and read each partition directly into its sample range
+        total_samples = sum([part["indexes"][1] - part["indexes"][0] for part in result])
+        output_shape = (len(polarizations), len(channels), total_samples, len(beams))
+        if output_buffer is None:
+            output_buffer = numpy.zeros([len(polarizations), total_samples, len(channels), len(beams)],
+                                        dtype=self.data_type)
+            output_buffer = numpy.transpose(output_buffer, (0, 2, 1, 3))
+        elif output_buffer.shape != output_shape:
+            raise ValueError("Output buffer shape {} does not match requested shape {}".format(output_buffer.shape,
+                                                                                            output_shape))
+        timestamp_buffer = numpy.zeros([total_samples, 1], dtype=float)
+
+        sample_index = 0
         for part in result:
             partition = part["partition"]
             indexes = part["indexes"]
+            partition_samples = indexes[1] - indexes[0]
+            partition_buffer = output_buffer[:, :, sample_index:sample_index + partition_samples, :]
             partition_data, partition_timestamps = self._read_data(timestamp=timestamp,
                                                                    tile_id=tile_id,
                                                                    channels=channels,
                                                                    polarizations=polarizations,
                                                                    beams=beams,
-                                                                   n_samples=indexes[1] - indexes[0],
+                                                                   n_samples=partition_samples,
                                                                    sample_offset=indexes[0],
-                                                                   partition_id=partition)
-            if concat_cnt < 1:
-                output_buffer = partition_data
-                timestamp_buffer = partition_timestamps
-                concat_cnt += 1
-            else:
-                output_buffer = numpy.concatenate((output_buffer, partition_data), 2)
-                timestamp_buffer = numpy.concatenate((timestamp_buffer, partition_timestamps), 0)
+                                                                   partition_id=partition,
+                                                                   output_buffer=partition_buffer,
+                                                                   memory_map=memory_map)
+            if len(partition_data) == 0:
+                return [], []
+
+            timestamp_buffer[sample_index:sample_index + partition_samples] = partition_timestamps
+            sample_index += partition_samples
 
         return output_buffer, timestamp_buffer
 
     def _read_data(self, timestamp=0, beam_id=0, tile_id=0, channels=None, polarizations=None, n_samples=0,
-                  beams = None, sample_offset=0, partition_id=None):
+                  beams = None, sample_offset=0, partition_id=None, output_buffer=None, memory_map=False):
         """
         A helper for the read_data() method. This method performs a read operation based on a sample offset and a
         requested number of samples to be read. If the read_data() method has been called with start and end timestamps
@@ -149,6 +183,9 @@ class BeamFormatFileManager(AAVSFileManager):
         :param beams: An array with a list of beams to be read. If None, all beams in the file are read.
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param partition_id: Indicates which partition for the batch is being read.
+        :param output_buffer: An optional preallocated buffer of shape [polarizations, channels, n_samples, beams] to
+        read into (see read_data()).
+        :param memory_map: If True, memory-map the data if the file is finalised (see read_data()).
         :return:
         """
         metadata_dict = self.get_metadata(timestamp=timestamp, tile_id=tile_id)
@@ -171,7 +208,11 @@ class BeamFormatFileManager(AAVSFileManager):
             logging.error("Can't load file for data reading: ", e.message)
             raise
 
-        output_buffer = numpy.zeros([len(polarizations), len(channels), n_samples, len(beams)], dtype=self.data_type)
+        preallocated = output_buffer is not None
+        if output_buffer is None:
+            output_buffer = numpy.zeros([len(polarizations), n_samples, len(channels), len(beams)],
+                                        dtype=self.data_type)
+            output_buffer = numpy.transpose(output_buffer, (0, 2, 1, 3))
         timestamp_buffer = numpy.zeros([n_samples, 1], dtype=float)
 
         data_flushed = False
@@ -189,27 +230,30 @@ class BeamFormatFileManager(AAVSFileManager):
                             dset = polarization_grp["data"]
                             dset_rows = dset.shape[0]
                             dset_columns = dset.shape[1]
-                            dset_depth = dset.shape[2]
                             nof_items = dset_rows
                             if (dset_columns == temp_dset.attrs["n_chans"]) and \
                                     (dset_rows >= temp_dset.attrs["n_samples"]):
-                                for channel_idx in AAVSFileManager.range_array(0, len(channels)):
-                                    current_channel = channels[channel_idx]
-                                    if sample_offset + n_samples > nof_items:
-                                        output_buffer[polarization_idx, channel_idx, 0:nof_items, :] = \
-                                            dset[0:nof_items, current_channel, beams]
-                                    else:
-                                        output_buffer[polarization_idx, channel_idx, :, :] = \
-                                            dset[sample_offset:sample_offset + n_samples, current_channel, beams]
+                                # Data is stored as [sample, channel, beam], so read it into a sample-major view of
+                                # the output buffer. Samples beyond the end of the file are zero-padded
+                                nof_read = max(0, min(n_samples, nof_items - sample_offset))
+                                selection = (slice(sample_offset, sample_offset + nof_read), channels, beams)
+                                sample_buffer = numpy.transpose(output_buffer[polarization_idx], (1, 0, 2))
+                                memmap = self.memmap_dataset(dset) if memory_map else None
+                                if memmap is None:
+                                    self.read_selection(dset, selection, sample_buffer[0:nof_read])
+                                elif not preallocated and nof_read == n_samples and len(polarizations) == 1:
+                                    sample_buffer = self.memmap_selection(memmap, selection)
+                                    output_buffer = numpy.transpose(sample_buffer, (1, 0, 2))[numpy.newaxis]
+                                else:
+                                    sample_buffer[0:nof_read] = self.memmap_selection(memmap, selection)
+
+                                if nof_read < n_samples:
+                                    sample_buffer[nof_read:] = 0
+
                 # extracting timestamps
-                if sample_offset + n_samples > nof_items:
-                    timestamp_grp = file_obj["sample_timestamps"]
-                    dset = timestamp_grp["data"]
-                    timestamp_buffer[0:nof_items] = dset[0:nof_items]
-                else:
-                    timestamp_grp = file_obj["sample_timestamps"]
-                    dset = timestamp_grp["data"]
-                    timestamp_buffer[:] = dset[sample_offset:sample_offset + n_samples]
+                timestamp_grp = file_obj["sample_timestamps"]
+                dset = timestamp_grp["data"]
+                timestamp_buffer[0:nof_read] = dset[sample_offset:sample_offset + nof_read]
 
                 data_flushed = True
             except Exception as e:
@@ -317,15 +361,7 @@ class BeamFormatFileManager(AAVSFileManager):
         :param timestamp_pad: Padded timestamp from the end of previous partitions in the file batch.
         :return:
         """
-        file_obj = None
-        # noinspection PyBroadException
-        try:
-            file_obj = self.load_file(timestamp=timestamp, tile_id=tile_id, mode='r+')
-        except:
-            logging.error("Error opening file in append mode")
-
-        if file_obj is None:
-            file_obj = self.create_file(timestamp=timestamp, tile_id=tile_id)
+        file_obj = self._open_append_file(timestamp=timestamp, tile_id=tile_id)
 
         n_pols = self.main_dset.attrs['n_pols']
         n_samp = self.main_dset.attrs['n_samples']
@@ -387,8 +423,7 @@ class BeamFormatFileManager(AAVSFileManager):
         # set new final timestamp in file
         self.main_dset.attrs['ts_end'] = sample_timestamps[-1]
 
-        file_obj.flush()
         filename = file_obj.filename
-        self.close_file(file_obj)
+        self._close_append_file(file_obj, timestamp=timestamp, tile_id=tile_id)
 
         return filename
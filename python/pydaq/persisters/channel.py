@@ -53,7 +53,7 @@ class ChannelFormatFileManager(AAVSFileManager):
         file_obj.flush()
 
     def read_data(self, timestamp=None, tile_id=0, channels=None, antennas=None, polarizations=None, n_samples=None,
-                  sample_offset=None, start_ts=None, end_ts=None, **kwargs):
+                  sample_offset=None, start_ts=None, end_ts=None, output_buffer=None, memory_map=False, **kwargs):
         """
         Method to read data from a channel data file for a given query. Queries can be done based on sample indexes,
         or timestamps.
@@ -68,10 +68,14 @@ class ChannelFormatFileManager(AAVSFileManager):
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param start_ts: A start timestamp for a read query based on timestamps.
         :param end_ts: An end timestamp for a ready query based on timestamps.
+        :param output_buffer: An optional preallocated buffer of shape [channels, antennas, polarizations, samples]
+        to read into. Data is read directly into the buffer if it is a transposed view of a C-contiguous
+        [samples, channels, antennas, polarizations] array, such as the one returned by a previous call.
+        :param memory_map: If True, memory-map the data of finalised files (see finalise_file()). When the read spans a
+        single partition and no output buffer is provided, a numpy.memmap view of the file is returned.
         :param kwargs: dictionary of keyword arguments
-        :return:
+        :return: The data, of shape [channels, antennas, polarizations, samples], and the sample timestamps
         """
-        output_buffer = []
         timestamp_buffer = []
 
         metadata_dict = self.get_metadata(timestamp=timestamp, tile_id=tile_id)
@@ -106,30 +110,58 @@ class ChannelFormatFileManager(AAVSFileManager):
                                                                            query_samples_read=n_samples,
                                                                            query_sample_offset=sample_offset)
 
-        concat_cnt = 0
+        if len(result) == 0:
+            return [], timestamp_buffer
+
+        # A memory-mapped read from a single partition can return a view of the file
+        if memory_map and output_buffer is None and len(result) == 1:
+            return self._read_data(timestamp=timestamp,
+                                   tile_id=tile_id,
+                                   channels=channels,
+                                   antennas=antennas,
+                                   polarizations=polarizations,
+                                   n_samples=result[0]["indexes"][1] - result[0]["indexes"][0],
+                                   sample_offset=result[0]["indexes"][0],
+                                   partition_id=result[0]["partition"],
+                                   memory_map=True)
+
+        # Allocate a sample-major buffer for all partitions and read each partition directly into its sample range
+        total_samples = sum([part["indexes"][1] - part["indexes"][0] for part in result])
+        output_shape = (len(channels), len(antennas), len(polarizations), total_samples)
+        if output_buffer is None:
+            output_buffer = numpy.zeros(output_shape[-1:] + output_shape[:-1], dtype=self.data_type)
+            output_buffer = numpy.transpose(output_buffer, (1, 2, 3, 0))
+        elif output_buffer.shape != output_shape:
+            raise ValueError("Output buffer shape {} does not match requested shape {}".format(output_buffer.shape,
+                                                                                            output_shape))
+        timestamp_buffer = numpy.zeros([total_samples, 1], dtype=float)
+
+        sample_index = 0
         for part in result:
             partition = part["partition"]
             indexes = part["indexes"]
+            partition_samples = indexes[1] - indexes[0]
+            partition_buffer = output_buffer[:, :, :, sample_index:sample_index + partition_samples]
             partition_data, partition_timestamps = self._read_data(timestamp=timestamp,
                                                                    tile_id=tile_id,
                                                                    channels=channels,
                                                                    antennas=antennas,
                                                                    polarizations=polarizations,
-                                                                   n_samples=indexes[1] - indexes[0],
+                                                                   n_samples=partition_samples,
                                                                    sample_offset=indexes[0],
-                                                                   partition_id=partition)
-            if concat_cnt < 1:
-                output_buffer = partition_data
-                timestamp_buffer = partition_timestamps
-                concat_cnt += 1
-            else:
-                output_buffer = numpy.concatenate((output_buffer, partition_data), 3)
-                timestamp_buffer = numpy.concatenate((timestamp_buffer, partition_timestamps), 0)
+                                                                   partition_id=partition,
+                                                                   output_buffer=partition_buffer,
+                                                                   memory_map=memory_map)
+            if len(partition_data) == 0:
+                return [], []
+
+            timestamp_buffer[sample_index:sample_index + partition_samples] = partition_timestamps
+            sample_index += partition_samples
 
         return output_buffer, timestamp_buffer
 
     def _read_data(self, timestamp=None, tile_id=0, channels=None, antennas=None, polarizations=None, n_samples=0,
-                   sample_offset=0, partition_id=None, **kwargs):
+                   sample_offset=0, partition_id=None, output_buffer=None, memory_map=False, **kwargs):
         """
         A helper for the read_data() method. This method performs a read operation based on a sample offset and a
         requested number of samples to be read. If the read_data() method has been called with start and end timestamps
@@ -144,6 +176,9 @@ class ChannelFormatFileManager(AAVSFileManager):
         :param n_samples: The number of samples to be read.
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param partition_id: Indicates which partition for the batch is being read.
+        :param output_buffer: An optional preallocated buffer of shape [channels, antennas, polarizations, n_samples]
+        to read into (see read_data()).
+        :param memory_map: If True, memory-map the data if the file is finalised (see read_data()).
         :param kwargs: dictionary of keyword arguments
         :return:
         """
@@ -169,7 +204,11 @@ class ChannelFormatFileManager(AAVSFileManager):
             logging.error("Can't load file for data reading: {}".format(e))
             raise
 
-        output_buffer = numpy.zeros([len(channels), len(antennas), len(polarizations), n_samples], dtype=self.data_type)
+        preallocated = output_buffer is not None
+        if output_buffer is None:
+            output_buffer = numpy.zeros([n_samples, len(channels), len(antennas), len(polarizations)],
+                                        dtype=self.data_type)
+            output_buffer = numpy.transpose(output_buffer, (1, 2, 3, 0))
         timestamp_buffer = numpy.zeros([n_samples, 1], dtype=float)
 
         data_flushed = False
@@ -181,35 +220,34 @@ class ChannelFormatFileManager(AAVSFileManager):
                     dset = channel_grp["data"]
                     nof_items = dset.shape[0]
 
-                    list_of_indices = []
-                    for channel in channels:
-                        for antenna in antennas:
-                            for pol in polarizations:
-                                list_of_indices.append((channel * (self.n_antennas * self.n_pols)) + (
-                                    antenna * self.n_pols) + pol)
+                    # Dataset column for each requested channel, antenna and polarization
+                    list_of_indices = (numpy.asarray(channels)[:, None, None] * (self.n_antennas * self.n_pols) +
+                                       numpy.asarray(antennas)[None, :, None] * self.n_pols +
+                                       numpy.asarray(polarizations)[None, None, :])
 
                     try:
-                        temp_buffer = dset[sample_offset:n_samples + sample_offset, list_of_indices]
-                        if sample_offset + n_samples > nof_items:
-                            temp_buffer = numpy.pad(temp_buffer, ((0, n_samples - nof_items), (0, 0)),
-                                                    mode='constant', constant_values=0)
-
-                        output_buffer = temp_buffer.reshape((n_samples, len(channels),
-                                                             len(antennas), len(polarizations)))
+                        # Data is stored as [sample, channel * antenna * polarization], so read it into a sample-major
+                        # view of the output buffer. Samples beyond the end of the file are zero-padded
+                        nof_read = max(0, min(n_samples, nof_items - sample_offset))
+                        selection = (slice(sample_offset, sample_offset + nof_read), list_of_indices)
+                        sample_buffer = numpy.transpose(output_buffer, (3, 0, 1, 2))
+                        memmap = self.memmap_dataset(dset) if memory_map else None
+                        if memmap is None:
+                            self.read_selection(dset, selection, sample_buffer[0:nof_read])
+                        elif not preallocated and nof_read == n_samples:
+                            sample_buffer = self.memmap_selection(memmap, selection).reshape(sample_buffer.shape)
+                            output_buffer = numpy.transpose(sample_buffer, (1, 2, 3, 0))
+                        else:
+                            sample_buffer[0:nof_read] = self.memmap_selection(memmap, selection).reshape(
+                                sample_buffer[0:nof_read].shape)
 
-                        output_buffer = numpy.transpose(output_buffer, (3, 1, 2, 0))
-                        output_buffer = numpy.transpose(output_buffer, (1, 0, 2, 3))
-                        output_buffer = numpy.transpose(output_buffer, (0, 2, 1, 3))
+                        if nof_read < n_samples:
+                            sample_buffer[nof_read:] = 0
 
                         # extracting timestamps
-                        if sample_offset + n_samples > nof_items:
-                            timestamp_grp = file_obj["sample_timestamps"]
-                            dset = timestamp_grp["data"]
-                            timestamp_buffer[0:nof_items] = dset[0:nof_items]
-                        else:
-                            timestamp_grp = file_obj["sample_timestamps"]
-                            dset = timestamp_grp["data"]
-                            timestamp_buffer[:] = dset[sample_offset:sample_offset + n_samples]
+                        timestamp_grp = file_obj["sample_timestamps"]
+                        dset = timestamp_grp["data"]
+                        timestamp_buffer[0:nof_read] = dset[sample_offset:sample_offset + nof_read]
                         data_flushed = True
 
                     except Exception as e:
@@ -318,15 +356,7 @@ class ChannelFormatFileManager(AAVSFileManager):
         :param kwargs: dictionary of keyword arguments
         :return:
         """
-        file_obj = None
-        # noinspection PyBroadException
-        try:
-            file_obj = self.load_file(timestamp=timestamp, tile_id=tile_id, mode='r+')
-        except:
-            logging.error("Error opening file in append mode")
-
-        if file_obj is None:
-            file_obj = self.create_file(timestamp=timestamp, tile_id=tile_id)
+        file_obj = self._open_append_file(timestamp=timestamp, tile_id=tile_id)
 
         n_pols = self.main_dset.attrs['n_pols']
         n_antennas = self.main_dset.attrs['n_antennas']
@@ -385,8 +415,7 @@ class ChannelFormatFileManager(AAVSFileManager):
         # set new final timestamp in file
         self.main_dset.attrs['ts_end'] = sample_timestamps[-1]
 
-        file_obj.flush()
         filename = file_obj.filename
-        self.close_file(file_obj)
+        self._close_append_file(file_obj, timestamp=timestamp, tile_id=tile_id)
 
         return filename
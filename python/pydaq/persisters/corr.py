@@ -325,14 +325,7 @@ class CorrelationFormatFileManager(AAVSFileManager):
         :param kwargs: dictionary of keyword arguments
         :return:
         """
-        file_obj = None
-        try:
-            file_obj = self.load_file(timestamp=timestamp, tile_id=channel_id, mode='r+')
-        except:
-            logging.error("Error opening file in append mode")
-
-        if file_obj is None:
-            file_obj = self.create_file(timestamp=timestamp, tile_id=channel_id, partition_id=partition_id)
+        file_obj = self._open_append_file(timestamp=timestamp, tile_id=channel_id, partition_id=partition_id)
 
         filename = file_obj.filename
 
@@ -384,7 +377,6 @@ class CorrelationFormatFileManager(AAVSFileManager):
         n_blocks += 1
         self.main_dset.attrs['n_blocks'] = n_blocks
 
-        file_obj.flush()
-        self.close_file(file_obj)
+        self._close_append_file(file_obj, timestamp=timestamp, tile_id=channel_id)
 
         return filename
\ No newline at end of file
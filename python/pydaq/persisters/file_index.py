@@ -0,0 +1,218 @@
+from builtins import object
+from contextlib import contextmanager
+import threading
+import time
+import os
+
+
+class DirectoryIndex(object):
+    """
+    An in-memory index of the DAQ files in a directory, used by the file managers to find the latest file timestamp and
+    the largest partition of a file set without listing the directory on every lookup. Files are indexed by file type
+    prefix, DAQ mode prefix, tile (or channel/station) ID, date/time string and partition. The index is updated by the
+    file managers whenever they create a file, and the directory is rescanned when its modification time changes or
+    periodically, to pick up files written by other processes.
+    """
+
+    # Maximum time, in seconds, between rescans of the directory
+    RESCAN_INTERVAL = 5.0
+
+    # One index per directory, shared by all file managers in this process
+    _indices = {}
+    _indices_lock = threading.Lock()
+
+    def __init__(self, root_path):
+        """
+        Constructor for a directory index. Use get_index() to get the shared index for a directory.
+        :param root_path: Directory to index.
+        """
+        self.root_path = root_path
+        self._lock = threading.RLock()
+
+        # File sets, (file prefix, mode prefix, tile ID) -> {date/time string: set of partitions}
+        self._file_sets = {}
+
+        # Latest file set, (file prefix, mode prefix, tile ID) -> (file time, date/time string)
+        self._latest = {}
+
+        self._directory_mtime = None
+        self._scan_time = 0
+
+    @classmethod
+    def get_index(cls, root_path):
+        """
+        Returns the shared index for a directory, creating it if required.
+        :param root_path: Directory to index.
+        :return: A DirectoryIndex
+        """
+        key = os.path.abspath(root_path)
+        with cls._indices_lock:
+            if key not in cls._indices:
+                cls._indices[key] = DirectoryIndex(key)
+            return cls._indices[key]
+
+    @staticmethod
+    def parse_filename(filename):
+        """
+        Splits a DAQ filename of the form <type>_<mode>_<tile>_<date>_<seconds>_<partition>.hdf5 (where the mode part
+        is optional) into its components.
+        :param filename: File name (without path).
+        :return: A (file prefix, mode prefix, tile ID, date/time string, partition) tuple, or None if the filename
+        is not a DAQ filename.
+        """
+        if not filename.endswith(".hdf5"):
+            return None
+
+        parts = filename[:-len(".hdf5")].split('_')
+        if len(parts) == 6:
+            filename_prefix, filename_mode_prefix = parts[0] + '_', parts[1] + '_'
+        elif len(parts) == 5:
+            filename_prefix, filename_mode_prefix = parts[0] + '_', ''
+        else:
+            return None
+
+        try:
+            tile_id = int(parts[-4]) if parts[-4] != '' else None
+            date_time = parts[-3] + '_' + parts[-2]
+            int(parts[-3] + parts[-2])
+            partition = int(parts[-1])
+        except ValueError:
+            return None
+
+        return filename_prefix, filename_mode_prefix, tile_id, date_time, partition
+
+    def add_file(self, filename):
+        """
+        Add a file to the index. Called by file managers when they create a file.
+        :param filename: File name, with or without path.
+        :return:
+        """
+        with self._lock:
+            self._add(os.path.basename(filename))
+
+            # This process changed the directory, so there is no need to rescan it
+            self._directory_mtime = self._stat()
+
+    @contextmanager
+    def own_changes(self):
+        """
+        Context manager for directory changes made by this process which do not add DAQ files, such as creating and
+        removing lock files. If the directory was unchanged before entering the context, the modification time
+        after the changes is recorded, so that they do not trigger a rescan. Files created by other processes during
+        the changes are picked up by the periodic rescan.
+        :return:
+        """
+        before = self._stat()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if before is not None and before == self._directory_mtime:
+                    self._directory_mtime = self._stat()
+
+    def max_partition(self, filename_prefix, filename_mode_prefix, tile_id, date_time):
+        """
+        Returns the largest partition of a file set.
+        :param filename_prefix: File type prefix.
+        :param filename_mode_prefix: DAQ mode prefix.
+        :param tile_id: Tile identifier.
+        :param date_time: Date/time string of the file set.
+        :return: Largest partition ID, or -1 if the file set does not exist.
+        """
+        with self._lock:
+            self._refresh()
+            partitions = self._file_sets.get((filename_prefix, filename_mode_prefix, tile_id), {}).get(date_time)
+            if not partitions:
+                return -1
+            return max(partitions)
+
+    def latest_date_time(self, filename_prefix, filename_mode_prefix, tile_id, partition=None):
+        """
+        Returns the date/time string of the latest file set for a tile.
+        :param filename_prefix: File type prefix.
+        :param filename_mode_prefix: DAQ mode prefix.
+        :param tile_id: Tile identifier.
+        :param partition: If not None, only file sets containing this partition are considered.
+        :return: Date/time string, or None if no file set exists.
+        """
+        key = (filename_prefix, filename_mode_prefix, tile_id)
+        with self._lock:
+            self._refresh()
+            if key not in self._latest:
+                return None
+
+            date_time = self._latest[key][1]
+            if partition is None or partition in self._file_sets[key][date_time]:
+                return date_time
+
+            # Latest file set does not contain requested partition, search through all file sets
+            matched = [(self._file_time(d), d) for d, p in self._file_sets[key].items() if partition in p]
+            if len(matched) == 0:
+                return None
+            return max(matched)[1]
+
+    def rescan(self):
+        """
+        Rebuild the index from the directory listing.
+        :return:
+        """
+        with self._lock:
+            try:
+                directory_mtime = os.stat(self.root_path).st_mtime_ns
+                filenames = [entry.name for entry in os.scandir(self.root_path) if entry.is_file()]
+            except OSError:
+                directory_mtime, filenames = None, []
+
+            self._file_sets = {}
+            self._latest = {}
+            for filename in filenames:
+                self._add(filename)
+
+            self._directory_mtime = directory_mtime
+            self._scan_time = time.time()
+
+    def _refresh(self):
+        """
+        Rescan the directory if it was modified by another process or if the rescan interval has elapsed.
+        :return:
+        """
+        directory_mtime = self._stat()
+        if directory_mtime != self._directory_mtime or time.time() - self._scan_time > self.RESCAN_INTERVAL:
+            self.rescan()
+
+    def _stat(self):
+        """
+        Returns the modification time of the directory.
+        :return: Modification time in nanoseconds, or None if the directory cannot be accessed.
+        """
+        try:
+            return os.stat(self.root_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _add(self, filename):
+        """
+        Add a file name to the index data structures.
+        :param filename: File name (without path).
+        :return:
+        """
+        parsed = self.parse_filename(filename)
+        if parsed is None:
+            return
+
+        filename_prefix, filename_mode_prefix, tile_id, date_time, partition = parsed
+        key = (filename_prefix, filename_mode_prefix, tile_id)
+        self._file_sets.setdefault(key, {}).setdefault(date_time, set()).add(partition)
+
+        file_time = self._file_time(date_time)
+        if key not in self._latest or file_time > self._latest[key][0]:
+            self._latest[key] = (file_time, date_time)
+
+    @staticmethod
+    def _file_time(date_time):
+        """
+        Converts a date/time string to an integer which can be used for ordering file sets.
+        :param date_time: Date/time string of the form yyyymmdd_secs
+        :return: Integer file time
+        """
+        return int(date_time.replace('_', ''))
@@ -51,7 +51,7 @@ class RawFormatFileManager(AAVSFileManager):
         file_obj.flush()
 
     def read_data(self, timestamp=None, tile_id=0, channels=None, antennas=None, polarizations=None, n_samples=None,
-                  sample_offset=None, start_ts=0, end_ts=0):
+                  sample_offset=None, start_ts=0, end_ts=0, output_buffer=None, memory_map=False):
         """
         Method to read data from a raw data file for a given query. Queries can be done based on sample indexes,
         or timestamps.
@@ -66,10 +66,13 @@ class RawFormatFileManager(AAVSFileManager):
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param start_ts: A start timestamp for a read query based on timestamps.
         :param end_ts: An end timestamp for a ready query based on timestamps.
-        :return:
+        :param output_buffer: An optional preallocated buffer of shape [antennas, polarizations, samples] to read
+        into. Data is read directly into the buffer if it is C-contiguous and the read spans a single partition.
+        :param memory_map: If True, memory-map the data of finalised files (see finalise_file()). When the read spans a
+        single partition and no output buffer is provided, a numpy.memmap view of the file is returned.
+        :return: The data, of shape [antennas, polarizations, samples], and the sample timestamps
         """
 
-        output_buffer = []
         timestamp_buffer = []
 
         metadata_dict = self.get_metadata(timestamp=timestamp, tile_id=tile_id)
@@ -101,30 +104,59 @@ class RawFormatFileManager(AAVSFileManager):
                                                                            tile_id=tile_id,
                                                                            query_samples_read=n_samples,
                                                                            query_sample_offset=sample_offset)
+        if len(result) == 0:
+            return [], timestamp_buffer
+
+        # A memory-mapped read from a single partition can return a view of the file
+        if memory_map and output_buffer is None and len(result) == 1:
+            return self._read_data(timestamp=timestamp,
+                                   tile_id=tile_id,
+                                   antennas=antennas,
+                                   polarizations=polarizations,
+                                   n_samples=result[0]["indexes"][1] - result[0]["indexes"][0],
+                                   sample_offset=result[0]["indexes"][0],
+                                   partition_id=result[0]["partition"],
+                                   memory_map=True)
+
+        # Allocate a buffer for all partitions and read each partition directly into its sample range
+        total_samples = sum([part["indexes"][1] - part["indexes"][0] for part in result])
+        output_shape = (len(antennas), len(polarizations), total_samples)
+        if output_buffer is None:
+            output_buffer = numpy.zeros(output_shape, dtype=self.data_type)
+        elif output_buffer.shape != output_shape:
+            raise ValueError("Output buffer shape {} does not match requested shape {}".format(output_buffer.shape,
+                                                                                            output_shape))
+
         concat_cnt = 0
+        sample_index = 0
         for part in result:
             partition = part["partition"]
             indexes = part["indexes"]
+            partition_samples = indexes[1] - indexes[0]
+            partition_buffer = output_buffer[:, :, sample_index:sample_index + partition_samples]
             partition_data, partition_timestamps = self._read_data(timestamp=timestamp,
                                                                    tile_id=tile_id,
                                                                    antennas=antennas,
                                                                    polarizations=polarizations,
-                                                                   n_samples=indexes[1] - indexes[0],
+                                                                   n_samples=partition_samples,
                                                                    sample_offset=indexes[0],
-                                                                   partition_id=partition)
+                                                                   partition_id=partition,
+                                                                   output_buffer=partition_buffer,
+                                                                   memory_map=memory_map)
+            if len(partition_data) == 0:
+                return [], []
+
+            sample_index += partition_samples
             if concat_cnt < 1:
-                output_buffer = partition_data
                 timestamp_buffer = partition_timestamps
                 concat_cnt += 1
-            else:
-                output_buffer = numpy.concatenate((output_buffer, partition_data), 2)
-                if partition_timestamps is not None:
-                    timestamp_buffer = numpy.concatenate((timestamp_buffer, partition_timestamps), 0)
+            elif partition_timestamps is not None:
+                timestamp_buffer = numpy.concatenate((timestamp_buffer, partition_timestamps), 0)
 
         return output_buffer, timestamp_buffer
 
     def _read_data(self, timestamp=None, tile_id=0, antennas=None, polarizations=None, n_samples=0,
-                   sample_offset=0, partition_id=None):
+                   sample_offset=0, partition_id=None, output_buffer=None, memory_map=False):
         """
         A helper for the read_data() method. This method performs a read operation based on a sample offset and a
         requested number of samples to be read. If the read_data() method has been called with start and end timestamps
@@ -138,6 +170,9 @@ class RawFormatFileManager(AAVSFileManager):
         :param n_samples: The number of samples to be read.
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param partition_id: Indicates which partition for the batch is being read.
+        :param output_buffer: An optional preallocated buffer of shape [antennas, polarizations, n_samples] to read
+        into (see read_data()).
+        :param memory_map: If True, memory-map the data if the file is finalised (see read_data()).
         :return:
         """
 
@@ -159,7 +194,9 @@ class RawFormatFileManager(AAVSFileManager):
             logging.error("Can't load file for data reading: ", e)
             raise
 
-        output_buffer = numpy.zeros([len(antennas), len(polarizations), n_samples], dtype=self.data_type)
+        preallocated = output_buffer is not None
+        if output_buffer is None:
+            output_buffer = numpy.zeros([len(antennas), len(polarizations), n_samples], dtype=self.data_type)
         timestamp_buffer = None
 
         data_flushed = False
@@ -175,33 +212,33 @@ class RawFormatFileManager(AAVSFileManager):
                         dset = raw_grp["data"]
                         dset_rows = dset.shape[0]
                         dset_columns = dset.shape[1]
-                        nof_items = dset[0].size
+                        nof_items = dset_columns
                         if (dset_rows == temp_dset.attrs["n_antennas"] * temp_dset.attrs["n_pols"]) and \
                                 (dset_columns >= temp_dset.attrs["n_samples"]):
-                            for antenna_idx in AAVSFileManager.range_array(0, len(antennas)):
-                                current_antenna = antennas[antenna_idx]
-                                for polarization_idx in AAVSFileManager.range_array(0, len(polarizations)):
-                                    current_polarization = polarizations[polarization_idx]
-                                    if sample_offset + n_samples > nof_items:
-                                        output_buffer[antenna_idx, polarization_idx, 0:nof_items] = \
-                                            dset[(current_antenna * self.n_pols) + current_polarization, 0:nof_items]
-                                    else:
-                                        output_buffer[antenna_idx, polarization_idx, :] = \
-                                            dset[(current_antenna * self.n_pols) + current_polarization,
-                                            sample_offset:sample_offset + n_samples]
+                            # Dataset row for each requested antenna and polarization
+                            list_of_indices = (numpy.asarray(antennas)[:, None] * self.n_pols +
+                                               numpy.asarray(polarizations)[None, :])
+
+                            # Samples beyond the end of the file are zero-padded
+                            nof_read = max(0, min(n_samples, nof_items - sample_offset))
+                            selection = (list_of_indices, slice(sample_offset, sample_offset + nof_read))
+                            memmap = self.memmap_dataset(dset) if memory_map else None
+                            if memmap is None:
+                                self.read_selection(dset, selection, output_buffer[:, :, 0:nof_read])
+                            elif not preallocated and nof_read == n_samples:
+                                output_buffer = self.memmap_selection(memmap, selection).reshape(output_buffer.shape)
+                            else:
+                                output_buffer[:, :, 0:nof_read] = self.memmap_selection(memmap, selection).reshape(
+                                    output_buffer[:, :, 0:nof_read].shape)
 
-                            # extracting timestamps
-                            if sample_offset + n_samples > nof_items:
-                                timestamp_grp = file_obj["sample_timestamps"]
-                                dset = timestamp_grp["data"]
-                                if dset.shape[0] > 0:
-                                    timestamp_buffer = numpy.array(dset[0:nof_items])
+                            if nof_read < n_samples:
+                                output_buffer[:, :, nof_read:] = 0
 
-                            else:
-                                timestamp_grp = file_obj["sample_timestamps"]
-                                dset = timestamp_grp["data"]
-                                if dset.shape[0] > 0:
-                                    timestamp_buffer = numpy.array(dset[sample_offset:sample_offset + n_samples])
+                            # extracting timestamps
+                            timestamp_grp = file_obj["sample_timestamps"]
+                            dset = timestamp_grp["data"]
+                            if dset.shape[0] > 0:
+                                timestamp_buffer = numpy.array(dset[sample_offset:sample_offset + nof_read])
 
                             data_flushed = True
             except Exception as e:
@@ -305,15 +342,7 @@ class RawFormatFileManager(AAVSFileManager):
         :param timestamp_pad: Padded timestamp from the end of previous partitions in the file batch.
         :return:
         """
-        file_obj = None
-        # noinspection PyBroadException
-        try:
-            file_obj = self.load_file(timestamp=timestamp, tile_id=tile_id, mode='r+')
-        except:
-            logging.error("Error opening file in append mode")
-
-        if file_obj is None:
-            file_obj = self.create_file(timestamp=timestamp, tile_id=tile_id)
+        file_obj = self._open_append_file(timestamp=timestamp, tile_id=tile_id)
 
         n_pols = self.main_dset.attrs['n_pols']
         n_antennas = self.main_dset.attrs['n_antennas']
@@ -370,8 +399,7 @@ class RawFormatFileManager(AAVSFileManager):
         n_blocks += 1
         self.main_dset.attrs['n_blocks'] = n_blocks
 
-        file_obj.flush()
         filename = file_obj.filename
-        self.close_file(file_obj)
+        self._close_append_file(file_obj, timestamp=timestamp, tile_id=tile_id)
 
         return filename
@@ -54,7 +54,7 @@ class StationBeamFormatFileManager(AAVSFileManager):
         file_obj.flush()
 
     def read_data(self, timestamp=None, station_id=0, channels=None, antennas=None, polarizations=None, beams=None,
-                  n_samples=None, sample_offset=None, start_ts=None, end_ts=None):
+                  n_samples=None, sample_offset=None, start_ts=None, end_ts=None, output_buffer=None):
         """
         Method to read data from a station beam data file for a given query. Queries can be done based on sample indexes,
         or timestamps.
@@ -70,9 +70,11 @@ class StationBeamFormatFileManager(AAVSFileManager):
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param start_ts: A start timestamp for a read query based on timestamps.
         :param end_ts: An end timestamp for a ready query based on timestamps.
-        :return:
+        :param output_buffer: An optional preallocated buffer of shape [polarizations, samples, channels] to read
+        into. Data is read directly into the buffer if it is C-contiguous.
+        :return: The data, of shape [polarizations, samples, channels], the sample timestamps and the number of
+        packets per sample
         """
-        output_buffer = []
         timestamp_buffer = []
         packets_buffer = []
 
@@ -109,32 +111,46 @@ class StationBeamFormatFileManager(AAVSFileManager):
                                                                            query_samples_read=n_samples,
                                                                            query_sample_offset=sample_offset)
 
-        concat_cnt = 0
+        if len(result) == 0:
+            return [], timestamp_buffer, packets_buffer
+
+        # Allocate a buffer for all partitions and read each partition directly into its sample range
+        total_samples = sum([part["indexes"][1] - part["indexes"][0] for part in result])
+        output_shape = (len(polarizations), total_samples, len(channels))
+        if output_buffer is None:
+            output_buffer = numpy.zeros(output_shape, dtype=self.data_type)
+        elif output_buffer.shape != output_shape:
+            raise ValueError("Output buffer shape {} does not match requested shape {}".format(output_buffer.shape,
+                                                                                            output_shape))
+        timestamp_buffer = numpy.zeros([total_samples, 1], dtype=float)
+        packets_buffer = numpy.zeros([total_samples, 1], dtype=numpy.uint32)
+
+        sample_index = 0
         for part in result:
             partition = part["partition"]
             indexes = part["indexes"]
+            partition_samples = indexes[1] - indexes[0]
+            partition_buffer = output_buffer[:, sample_index:sample_index + partition_samples, :]
             partition_data, partition_timestamps, partition_packets = self._read_data(timestamp=timestamp,
                                                                                       station_id=station_id,
                                                                                       channels=channels,
                                                                                       polarizations=polarizations,
                                                                                       beams=beams,
-                                                                                      n_samples=indexes[1] - indexes[0],
+                                                                                      n_samples=partition_samples,
                                                                                       sample_offset=indexes[0],
-                                                                                      partition_id=partition)
-            if concat_cnt < 1:
-                output_buffer = partition_data
-                timestamp_buffer = partition_timestamps
-                packets_buffer = partition_packets
-                concat_cnt += 1
-            else:
-                output_buffer = numpy.concatenate((output_buffer, partition_data), 2)
-                timestamp_buffer = numpy.concatenate((timestamp_buffer, partition_timestamps), 0)
-                packets_buffer = numpy.concatenate((packets_buffer, partition_packets), 0)
+                                                                                      partition_id=partition,
+                                                                                      output_buffer=partition_buffer)
+            if len(partition_data) == 0:
+                return [], [], []
+
+            timestamp_buffer[sample_index:sample_index + partition_samples] = partition_timestamps
+            packets_buffer[sample_index:sample_index + partition_samples] = partition_packets
+            sample_index += partition_samples
 
         return output_buffer, timestamp_buffer, packets_buffer
 
     def _read_data(self, timestamp=0, station_id=0, channels=None, polarizations=None, n_samples=0,
-                   beams=None, sample_offset=0, partition_id=None, **kwargs):
+                   beams=None, sample_offset=0, partition_id=None, output_buffer=None, **kwargs):
         """
         A helper for the read_data() method. This method performs a read operation based on a sample offset and a
         requested number of samples to be read. If the read_data() method has been called with start and end timestamps
@@ -150,6 +166,8 @@ class StationBeamFormatFileManager(AAVSFileManager):
         :param beams: An array with a list of beams to be read. If None, all beams in the file are read.
         :param sample_offset: An offset, in samples, from which the read operation should start.
         :param partition_id: Indicates which partition for the batch is being read.
+        :param output_buffer: An optional preallocated buffer of shape [polarizations, n_samples, channels] to read
+        into (see read_data()).
         :return:
         """
         metadata_dict = self.get_metadata(timestamp=timestamp, tile_id=station_id)
@@ -170,7 +188,8 @@ class StationBeamFormatFileManager(AAVSFileManager):
             logging.error("Can't load file for data reading: ", e)
             raise
 
-        output_buffer = numpy.zeros([len(polarizations), n_samples, len(channels)], dtype=self.data_type)
+        if output_buffer is None:
+            output_buffer = numpy.zeros([len(polarizations), n_samples, len(channels)], dtype=self.data_type)
         timestamp_buffer = numpy.zeros([n_samples, 1], dtype=float)
         packets_buffer = numpy.zeros([n_samples, 1], dtype=numpy.uint32)
 
@@ -192,35 +211,21 @@ class StationBeamFormatFileManager(AAVSFileManager):
                             nof_items = dset_rows
                             if (dset_columns == temp_dset.attrs["n_chans"]) and \
                                     (dset_rows >= temp_dset.attrs["n_samples"]):
-                                for channel_idx in AAVSFileManager.range_array(0, len(channels)):
-                                    current_channel = channels[channel_idx]
-                                    if sample_offset + n_samples > nof_items:
-                                        output_buffer[polarization_idx, 0:nof_items, channel_idx] = dset[0:nof_items,
-                                                                                                    current_channel]
-                                    else:
-                                        output_buffer[polarization_idx, :, channel_idx] = dset[
-                                                                                          sample_offset:sample_offset + n_samples,
-                                                                                          current_channel]
+                                # Samples beyond the end of the file are zero-padded
+                                nof_read = max(0, min(n_samples, nof_items - sample_offset))
+                                self.read_selection(dset, (slice(sample_offset, sample_offset + nof_read), channels),
+                                                    output_buffer[polarization_idx, 0:nof_read])
+                                output_buffer[polarization_idx, nof_read:] = 0
 
                 # extracting timestamps
-                if sample_offset + n_samples > nof_items:
-                    timestamp_grp = file_obj["sample_timestamps"]
-                    dset = timestamp_grp["data"]
-                    timestamp_buffer[0:nof_items] = dset[0:nof_items]
-                else:
-                    timestamp_grp = file_obj["sample_timestamps"]
-                    dset = timestamp_grp["data"]
-                    timestamp_buffer[:] = dset[sample_offset:sample_offset + n_samples]
+                timestamp_grp = file_obj["sample_timestamps"]
+                dset = timestamp_grp["data"]
+                timestamp_buffer[0:nof_read] = dset[sample_offset:sample_offset + nof_read]
 
                 # extracting packets
-                if sample_offset + n_samples > nof_items:
-                    packets_grp = file_obj["sample_packets"]
-                    dset = packets_grp["data"]
-                    packets_buffer[0:nof_items] = dset[0:nof_items]
-                else:
-                    packets_grp = file_obj["sample_packets"]
-                    dset = packets_grp["data"]
-                    packets_buffer[:] = dset[sample_offset:sample_offset + n_samples]
+                packets_grp = file_obj["sample_packets"]
+                dset = packets_grp["data"]
+                packets_buffer[0:nof_read] = dset[sample_offset:sample_offset + nof_read]
 
                 data_flushed = True
             except Exception as e:
@@ -333,15 +338,7 @@ class StationBeamFormatFileManager(AAVSFileManager):
         :param timestamp_pad: Padded timestamp from the end of previous partitions in the file batch.
         :return:
         """
-        file_obj = None
-        # noinspection PyBroadException
-        try:
-            file_obj = self.load_file(timestamp=timestamp, tile_id=station_id, mode='r+')
-        except:
-            logging.error("Error opening file in append mode")
-
-        if file_obj is None:
-            file_obj = self.create_file(timestamp=timestamp, tile_id=station_id)
+        file_obj = self._open_append_file(timestamp=timestamp, tile_id=station_id)
 
         n_pols = self.main_dset.attrs['n_pols']
         n_samp = self.main_dset.attrs['n_samples']
@@ -408,8 +405,7 @@ class StationBeamFormatFileManager(AAVSFileManager):
         # set new final timestamp in file
         self.main_dset.attrs['ts_end'] = sample_timestamps[-1]
 
-        file_obj.flush()
         filename = file_obj.filename
-        self.close_file(file_obj)
+        self._close_append_file(file_obj, timestamp=timestamp, tile_id=station_id)
 
         return filename
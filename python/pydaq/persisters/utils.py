@@ -13,6 +13,9 @@ FILE_NAME_MAP = {b'type': 0,
                  b'time2': 4,
                  b'partition': 5}
 
+# Cache of baseline permutations from lower to upper triangular order, keyed by number of antennas
+_triangular_permutations = {}
+
 
 def complex_imaginary(value):
     """
@@ -112,3 +115,37 @@ def get_timestamp(date_time_string):
     timestamp = time.mktime(d.timetuple())
     timestamp += int(time_parts[1])
     return timestamp
+
+
+def lower_to_upper_triangular_permutation(nof_antennas):
+    """
+    Returns the baseline permutation which converts correlation matrices from lower triangular order (as generated
+    by the correlator) to upper triangular order. Element k of the permutation is the index, in lower triangular
+    order, of the k-th upper triangular baseline. Permutations are computed once per number of antennas.
+    :param nof_antennas: Number of antennas
+    :return: Array of baseline indices
+    """
+    if nof_antennas not in _triangular_permutations:
+        antenna1, antenna2 = np.triu_indices(nof_antennas)
+        _triangular_permutations[nof_antennas] = antenna2 * (antenna2 + 1) // 2 + antenna1
+    return _triangular_permutations[nof_antennas]
+
+
+def lower_to_upper_triangular(values, nof_antennas, nof_stokes, output=None):
+    """
+    Converts a correlation matrix from lower triangular to upper triangular form, conjugating all visibilities.
+    :param values: Lower triangular visibilities, of size nof_baselines * nof_stokes
+    :param nof_antennas: Number of antennas
+    :param nof_stokes: Number of stokes parameters
+    :param output: Optional preallocated output array of size nof_baselines * nof_stokes, which is overwritten
+    :return: Flattened upper triangular visibilities
+    """
+    nof_baselines = nof_antennas * (nof_antennas + 1) // 2
+    if output is None:
+        output = np.empty(nof_baselines * nof_stokes, dtype=values.dtype)
+
+    reordered = output.reshape((nof_baselines, nof_stokes))
+    np.take(values.reshape((nof_baselines, nof_stokes)), lower_to_upper_triangular_permutation(nof_antennas),
+            axis=0, out=reordered)
+    np.conjugate(reordered, out=reordered)
+    return output
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from pydaq.persisters import RawFormatFileManager, FileDAQModes
+
+TIMESTAMP = 1700000000
+
+
+def _file_manager(directory):
+    file_manager = RawFormatFileManager(root_path=str(directory), daq_mode=FileDAQModes.Burst)
+    file_manager.set_metadata(n_antennas=16, n_pols=2, n_samples=1024)
+    return file_manager
+
+
+def _append(file_manager, value):
+    data = np.full(16 * 2 * 1024, value, dtype=np.int8)
+    file_manager.ingest_data(append=True, data_ptr=data, timestamp=TIMESTAMP, sampling_time=1e-6, tile_id=0)
+
+
+@pytest.mark.parametrize("cache_handles", [False, True])
+def test_append_to_finalised_file_raises(tmp_path, cache_handles):
+    file_manager = _file_manager(tmp_path)
+    _append(file_manager, 1)
+    _append(file_manager, 2)
+    assert file_manager.finalise_file(timestamp=TIMESTAMP, tile_id=0) == 1
+
+    writer = _file_manager(tmp_path)
+    if cache_handles:
+        writer.enable_handle_cache()
+    with pytest.raises(ValueError, match="finalised"):
+        _append(writer, 3)
+
+    # The file is released and its contents are unchanged
+    data, _ = _file_manager(tmp_path).read_data(timestamp=TIMESTAMP, tile_id=0, n_samples=4096, memory_map=True)
+    assert data.shape == (16, 2, 2048)
+    assert np.all(data[:, :, :1024] == 1) and np.all(data[:, :, 1024:] == 2)
@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+
+from aavs_calibration import cache
+from aavs_calibration.cache import CalibrationCache
+
+
+class FakeClock(object):
+    """ Replacement for the time module used by the cache """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeBackend(object):
+    """ In-memory calibration database, counting lookups """
+
+    def __init__(self):
+        self.versions = {}
+        self.solutions = {}
+        self.lookups = 0
+        self.version_checks = 0
+
+    def get_calibration_version(self, station):
+        self.version_checks += 1
+        return self.versions.get(station, 0)
+
+    def get_station_information(self, station):
+        self.lookups += 1
+        return {'name': station}
+
+    def get_antenna_positions(self, station):
+        self.lookups += 1
+        return [0, 1], [0.0, 1.0], [0.0, 1.0]
+
+    def get_latest_calibration_solution(self, station, include_delays=False):
+        self.lookups += 1
+        return self.solutions.get(station)
+
+    def get_calibration_solution(self, station, timestamp):
+        self.lookups += 1
+        return self.solutions.get(station)
+
+    def write_solution(self, station, solution):
+        """ Store a solution and bump the station version, as the database writers do """
+        self.solutions[station] = solution
+        self.versions[station] = self.versions.get(station, 0) + 1
+
+
+class FakeVersionCollection(object):
+    """ Stand-in for the calibration_version collection, incrementing the fake backend versions """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def update_one(self, query, update, upsert=False):
+        station = query['station']
+        self._backend.versions[station] = self._backend.versions.get(station, 0) + update['$inc']['version']
+
+
+class FakeDatabase(object):
+    def __init__(self, backend):
+        self.calibration_version = FakeVersionCollection(backend)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend()
+    backend.write_solution("AAVS2", np.ones(4))
+    return backend
+
+
+def test_hit_does_not_query_backend(clock, backend):
+    """ A cached entry is returned without a backend lookup, and callers get their own copy """
+    calibration_cache = CalibrationCache(backend)
+    solution = calibration_cache.get_latest_calibration_solution("AAVS2")
+    solution[:] = 0
+
+    assert np.all(calibration_cache.get_latest_calibration_solution("AAVS2") == 1)
+    assert backend.lookups == 1
+    assert calibration_cache.hits == 1 and calibration_cache.misses == 1
+
+
+def test_version_bump_invalidates_entries(clock, backend):
+    """ Entries cached for an older version are discarded once the version is checked again """
+    calibration_cache = CalibrationCache(backend, version_check_interval=5)
+    calibration_cache.get_latest_calibration_solution("AAVS2")
+
+    backend.write_solution("AAVS2", np.full(4, 2.0))
+
+    # The version is not checked again within the interval, so the old entry is still served
+    clock.now += 1
+    assert np.all(calibration_cache.get_latest_calibration_solution("AAVS2") == 1)
+    assert backend.version_checks == 1
+
+    clock.now += 5
+    assert np.all(calibration_cache.get_latest_calibration_solution("AAVS2") == 2)
+    assert backend.version_checks == 2
+    assert backend.lookups == 2
+
+
+def test_calibration_updated_invalidates_process_cache(clock, backend, monkeypatch):
+    """ Writes in this process bump the database version and invalidate the station immediately """
+    common = pytest.importorskip("aavs_calibration.common")
+    calibration_cache = CalibrationCache(backend, version_check_interval=3600)
+    monkeypatch.setattr(cache, "_cache", calibration_cache)
+    monkeypatch.setattr(common, "db", FakeDatabase(backend))
+    calibration_cache.get_latest_calibration_solution("AAVS2")
+
+    backend.solutions["AAVS2"] = np.full(4, 3.0)
+    common._calibration_updated("AAVS2")
+
+    assert backend.versions["AAVS2"] == 2
+    assert np.all(calibration_cache.get_latest_calibration_solution("AAVS2") == 3)
+    assert backend.lookups == 2
+
+
+def test_entries_expire_after_ttl(clock, backend):
+    calibration_cache = CalibrationCache(backend, ttl=60, version_check_interval=3600)
+    calibration_cache.get_station_information("AAVS2")
+
+    clock.now += 59
+    calibration_cache.get_station_information("AAVS2")
+    assert backend.lookups == 1
+
+    clock.now += 1
+    calibration_cache.get_station_information("AAVS2")
+    assert backend.lookups == 2
+
+
+def test_least_recently_used_entries_evicted(clock, backend):
+    calibration_cache = CalibrationCache(backend, max_entries=cache.DEFAULT_MAX_ENTRIES)
+    for timestamp in range(cache.DEFAULT_MAX_ENTRIES):
+        calibration_cache.get_calibration_solution("AAVS2", timestamp)
+
+    # Use the oldest entry, so that the second oldest is evicted by the next lookup
+    calibration_cache.get_calibration_solution("AAVS2", 0)
+    calibration_cache.get_calibration_solution("AAVS2", cache.DEFAULT_MAX_ENTRIES)
+    assert len(calibration_cache) == cache.DEFAULT_MAX_ENTRIES
+
+    lookups = backend.lookups
+    calibration_cache.get_calibration_solution("AAVS2", 0)
+    assert backend.lookups == lookups
+    calibration_cache.get_calibration_solution("AAVS2", 1)
+    assert backend.lookups == lookups + 1
+
+
+def test_failed_lookups_not_cached(clock, backend):
+    calibration_cache = CalibrationCache(backend)
+    assert calibration_cache.get_latest_calibration_solution("AAVS1") is None
+    assert calibration_cache.get_latest_calibration_solution("AAVS1") is None
+    assert backend.lookups == 2
+
+
+def test_invalidate(clock, backend):
+    backend.write_solution("AAVS1", np.zeros(4))
+    calibration_cache = CalibrationCache(backend, version_check_interval=3600)
+    calibration_cache.get_latest_calibration_solution("AAVS1")
+    calibration_cache.get_latest_calibration_solution("AAVS2")
+
+    calibration_cache.invalidate("AAVS1")
+    assert len(calibration_cache) == 1
+    calibration_cache.get_latest_calibration_solution("AAVS2")
+    assert backend.lookups == 2
+
+    calibration_cache.invalidate()
+    assert len(calibration_cache) == 0
+    calibration_cache.get_latest_calibration_solution("AAVS2")
+    assert backend.lookups == 3
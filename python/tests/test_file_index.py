@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from pydaq.persisters import RawFormatFileManager, FileDAQModes
+from pydaq.persisters.file_index import DirectoryIndex
+
+
+def _count_rescans(monkeypatch):
+    """ Count calls to DirectoryIndex.rescan """
+    count = [0]
+    rescan = DirectoryIndex.rescan
+
+    def counting_rescan(self):
+        count[0] += 1
+        rescan(self)
+
+    monkeypatch.setattr(DirectoryIndex, "rescan", counting_rescan)
+    return count
+
+
+def test_appends_do_not_rescan_directory(tmp_path, monkeypatch):
+    """ Lock files created by appends must not force a rescan of a directory with many files """
+    for n in range(3000):
+        open(os.path.join(str(tmp_path), "raw_burst_1_20200101_%05d_0.hdf5" % n), "w").close()
+
+    count = _count_rescans(monkeypatch)
+    file_manager = RawFormatFileManager(root_path=str(tmp_path), daq_mode=FileDAQModes.Burst)
+    file_manager.set_metadata(n_antennas=16, n_pols=2, n_samples=1024)
+    data = np.zeros(16 * 2 * 1024, dtype=np.int8)
+
+    file_manager.ingest_data(append=True, data_ptr=data, timestamp=1700000000, sampling_time=1e-6, tile_id=0)
+    rescans = count[0]
+    for _ in range(50):
+        file_manager.ingest_data(append=True, data_ptr=data, timestamp=1700000000, sampling_time=1e-6, tile_id=0)
+
+    assert count[0] - rescans <= 1
+    assert file_manager.get_metadata(timestamp=1700000000, tile_id=0)["written_samples"] == 51 * 1024
+
+
+def test_files_from_other_processes_are_indexed(tmp_path, monkeypatch):
+    """ Files created outside the index still trigger a rescan """
+    index = DirectoryIndex(str(tmp_path))
+    assert index.latest_date_time("raw_", "burst_", 2) is None
+
+    with index.own_changes():
+        open(os.path.join(str(tmp_path), "lock_file"), "w").close()
+
+    count = _count_rescans(monkeypatch)
+    open(os.path.join(str(tmp_path), "raw_burst_2_20200101_00010_0.hdf5"), "w").close()
+    os.utime(str(tmp_path), ns=(0, index._directory_mtime + 1))
+    assert index.latest_date_time("raw_", "burst_", 2) == "20200101_00010"
+    assert count[0] == 1
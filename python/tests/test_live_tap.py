@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+# Publisher with subscribers in a multiprocessing child, which shares the publisher's resource tracker, and in an
+# independent process, which has its own tracker
+SCRIPT = textwrap.dedent("""
+    import multiprocessing, os, subprocess, sys
+    import numpy as np
+    from pydaq.live_tap import LiveDataPublisher, LiveDataSubscriber
+
+    def subscribe(name):
+        subscriber = LiveDataSubscriber(name)
+        assert subscriber.sources() == [0]
+        subscriber.close()
+
+    if __name__ == "__main__":
+        name = sys.argv[1]
+        publisher = LiveDataPublisher(name, "raw", np.int8, (4,), nof_sources=2)
+        publisher.publish(0, 0.0, np.zeros(4))
+
+        process = multiprocessing.get_context("spawn").Process(target=subscribe, args=(name,))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+
+        subprocess.run([sys.executable, "-c", "import sys; sys.path[:0] = {path!r}; "
+                        "from pydaq.live_tap import LiveDataSubscriber; LiveDataSubscriber(sys.argv[1]).close()",
+                        name], check=True)
+        assert os.path.exists("/dev/shm/" + name), "segment unlinked by a subscriber"
+        publisher.close()
+""")
+
+
+def test_subscribers_keep_resource_tracker_balanced(tmp_path):
+    """ Closing the publisher after subscribers detached must not make the resource tracker report errors """
+    path = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    script = tmp_path / "live_tap_subscribers.py"
+    script.write_text(SCRIPT.format(path=path))
+
+    name = "test_live_tap_{}".format(os.getpid())
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path + [os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, str(script), name], capture_output=True, text=True, env=env,
+                            timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert "KeyError" not in result.stderr
+    assert "leaked shared_memory" not in result.stderr
+    assert not os.path.exists("/dev/shm/" + name)
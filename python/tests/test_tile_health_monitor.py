@@ -0,0 +1,99 @@
+import logging
+from functools import partial
+
+import pytest
+
+pytest.importorskip("pyfabil")
+
+from pyfabil.base.definitions import BoardError
+from pyaavs.tile_health_monitor import communication_check, TileHealthMonitor
+
+MAGIC = 0xA1CE55AD
+
+
+class FakeTile(object):
+    """ Minimal tile exposing the FPGA magic number registers """
+
+    def __init__(self):
+        self.tpm = object()
+        self.logger = logging.getLogger("FakeTile")
+        self._health_check_cache = (None, set())
+        self.registers = {0x4: MAGIC, 0x10000004: MAGIC}
+        self.reads = 0
+
+    def __getitem__(self, address):
+        self.reads += 1
+        value = self.registers[address]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    @communication_check
+    def get_health_values(self):
+        return {'voltages.VIN': 12.0}
+
+
+def test_communication_checked_on_every_pass():
+    tile = FakeTile()
+    assert tile.get_health_values() == {'voltages.VIN': 12.0}
+    assert tile.get_health_values() == {'voltages.VIN': 12.0}
+    assert tile.reads == 4
+
+
+def test_magic_number_change_after_first_pass():
+    tile = FakeTile()
+    assert tile.get_health_values() is not None
+
+    tile.registers[0x10000004] = 0xFFFFFFFF
+    assert tile.get_health_values() is None
+
+
+def test_lost_link_after_first_pass_raises():
+    tile = FakeTile()
+    assert tile.get_health_values() is not None
+
+    tile.registers[0x4] = IOError("timeout")
+    with pytest.raises(BoardError):
+        tile.get_health_values()
+
+
+class FakeTPM(object):
+    """ TPM whose voltages each take two register reads """
+
+    def __init__(self):
+        self.reads = 0
+
+    def read_register(self, register):
+        self.reads += 1
+        return 0x100
+
+
+class FakeHealthTile(TileHealthMonitor):
+    """ Tile with two voltage monitoring points, read with a single get_voltage call """
+
+    VOLTAGES = ['VIN', 'VM_DRVDD']
+
+    def __init__(self):
+        self.tpm = FakeTPM()
+        self.logger = logging.getLogger("FakeHealthTile")
+        self.health_status_statistics = None
+        self.monitoring_point_lookup_dict = {
+            'voltages': {name: {'method': partial(self.get_voltage, voltage_name=name)} for name in self.VOLTAGES}}
+
+    def _kwargs_handler(self, kwargs):
+        return ['voltages.{}'.format(name) for name in self.VOLTAGES]
+
+    def get_voltage(self, voltage_name=None):
+        names = self.VOLTAGES if voltage_name is None else [voltage_name]
+        return {name: (self.tpm.read_register(name + '.msb') + self.tpm.read_register(name + '.lsb')) / 100.0
+                for name in names}
+
+
+def test_health_statistics_count_register_accesses():
+    tile = FakeHealthTile()
+    assert tile._get_health_values({}) == {'voltages.VIN': 5.12, 'voltages.VM_DRVDD': 5.12}
+    assert tile.health_status_statistics['method_calls'] == 1
+    assert tile.health_status_statistics['transactions'] == tile.tpm.reads == 4
+
+    # Register accesses are only counted during the snapshot
+    assert 'read_register' not in tile.tpm.__dict__
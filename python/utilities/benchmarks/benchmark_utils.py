@@ -0,0 +1,11 @@
+from __future__ import division
+
+import time
+
+
+def time_function(function, repetitions):
+    """ Return the mean execution time of a function in seconds """
+    start = time.time()
+    for _ in range(repetitions):
+        function()
+    return (time.time() - start) / repetitions
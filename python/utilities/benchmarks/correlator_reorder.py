@@ -0,0 +1,63 @@
+from __future__ import print_function
+from __future__ import division
+
+from optparse import OptionParser
+
+import numpy as np
+
+from pydaq.persisters.utils import lower_to_upper_triangular
+
+from benchmark_utils import time_function
+
+
+def loop_reorder(values, nof_antennas, nof_stokes):
+    """ Lower to upper triangular conversion as originally implemented in the DAQ correlator callback """
+    nof_baselines = int((nof_antennas + 1) * 0.5 * nof_antennas)
+    data = np.reshape(np.conj(values), (nof_baselines, nof_stokes))
+    grid = np.zeros((nof_antennas, nof_antennas, nof_stokes), dtype=np.complex64)
+
+    counter = 0
+    for i in range(nof_antennas):
+        for j in range(i + 1):
+            grid[j, i, :] = data[counter, :]
+            counter += 1
+
+    output = np.zeros(nof_baselines * nof_stokes, dtype=np.complex64)
+
+    counter = 0
+    for i in range(nof_antennas):
+        for j in range(i, nof_antennas):
+            output[counter * nof_stokes:(counter + 1) * nof_stokes] = grid[i, j, :]
+            counter += 1
+
+    return output
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %correlator_reorder [options]")
+    parser.add_option("-a", "--antennas", action="store", dest="antennas", default="16,32,64,128,256,512",
+                      help="Comma separated list of antenna counts to benchmark [default: 16,32,64,128,256,512]")
+    parser.add_option("-s", "--nof_stokes", action="store", dest="nof_stokes", type="int", default=4,
+                      help="Number of stokes parameters [default: 4]")
+    parser.add_option("-r", "--repetitions", action="store", dest="repetitions", type="int", default=5,
+                      help="Number of repetitions per measurement [default: 5]")
+    (conf, args) = parser.parse_args()
+
+    print("{:>10} {:>15} {:>15} {:>10}".format("Antennas", "Loop (ms)", "Vectorised (ms)", "Speedup"))
+    for nof_antennas in [int(x) for x in conf.antennas.split(',')]:
+        nof_baselines = nof_antennas * (nof_antennas + 1) // 2
+        values = (np.random.normal(size=nof_baselines * conf.nof_stokes) +
+                  1j * np.random.normal(size=nof_baselines * conf.nof_stokes)).astype(np.complex64)
+        output = np.empty(values.size, dtype=np.complex64)
+
+        # Check that both implementations generate the same output
+        if not np.array_equal(loop_reorder(values, nof_antennas, conf.nof_stokes),
+                              lower_to_upper_triangular(values, nof_antennas, conf.nof_stokes, output)):
+            raise Exception("Reordered output mismatch for {} antennas".format(nof_antennas))
+
+        loop_time = time_function(lambda: loop_reorder(values, nof_antennas, conf.nof_stokes), conf.repetitions)
+        vector_time = time_function(lambda: lower_to_upper_triangular(values, nof_antennas, conf.nof_stokes, output),
+                                    conf.repetitions)
+
+        print("{:>10} {:>15.3f} {:>15.3f} {:>10.1f}".format(nof_antennas, loop_time * 1e3, vector_time * 1e3,
+                                                             loop_time / vector_time))
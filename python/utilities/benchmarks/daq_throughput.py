@@ -0,0 +1,423 @@
+from __future__ import print_function
+from __future__ import division
+
+from optparse import OptionParser
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import sys
+import time
+
+import numpy as np
+
+from pydaq.daq_receiver_interface import DaqReceiver, DaqModes
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulators"))
+from spead_traffic_generator import SpeadTrafficGenerator, raw_stream, burst_channel_stream, \
+    continuous_channel_stream, integrated_channel_stream, tile_beam_stream, integrated_beam_stream, \
+    station_beam_stream
+
+# Internal DaqReceiver callback for each mode, wrapped to measure callback durations
+CALLBACK_METHODS = {DaqModes.RAW_DATA: '_raw_data_callback',
+                    DaqModes.CHANNEL_DATA: '_channel_burst_data_callback',
+                    DaqModes.BEAM_DATA: '_beam_burst_data_callback',
+                    DaqModes.CONTINUOUS_CHANNEL_DATA: '_channel_continuous_data_callback',
+                    DaqModes.INTEGRATED_BEAM_DATA: '_beam_integrated_data_callback',
+                    DaqModes.INTEGRATED_CHANNEL_DATA: '_channel_integrated_data_callback',
+                    DaqModes.STATION_BEAM_DATA: '_station_callback'}
+
+# DaqReceiver configuration for each persistence setting
+PERSISTENCE_SETTINGS = {'none': {'write_to_disk': False},
+                        'sync': {'write_to_disk': True},
+                        'async': {'write_to_disk': True, 'asynchronous_persistence': True},
+                        'cached': {'write_to_disk': True, 'cache_file_handles': True},
+                        'async_cached': {'write_to_disk': True, 'asynchronous_persistence': True,
+                                         'cache_file_handles': True}}
+
+
+def create_stream(mode, config):
+    """ Create the generator stream matching the DAQ configuration of a mode. A frame of the stream fills one
+    buffer per tile (one buffer in total for station beam data)
+    :param mode: DaqModes mode
+    :param config: DaqReceiver configuration """
+    nof_tiles = config['nof_tiles']
+    if mode == DaqModes.RAW_DATA:
+        return raw_stream(nof_tiles, nof_samples=config['nof_raw_samples'], nof_antennas=config['nof_antennas'])
+    if mode == DaqModes.CHANNEL_DATA:
+        return burst_channel_stream(nof_tiles, nof_channels=config['nof_channels'],
+                                    nof_samples=config['nof_channel_samples'], nof_antennas=config['nof_antennas'])
+    if mode == DaqModes.CONTINUOUS_CHANNEL_DATA:
+        return continuous_channel_stream(nof_tiles, nof_samples=config['nof_channel_samples'],
+                                         nof_antennas=config['nof_antennas'])
+    if mode == DaqModes.INTEGRATED_CHANNEL_DATA:
+        return integrated_channel_stream(nof_tiles, nof_channels=config['nof_channels'],
+                                         nof_antennas=config['nof_antennas'])
+    if mode == DaqModes.BEAM_DATA:
+        return tile_beam_stream(nof_tiles, nof_channels=config['nof_beam_channels'],
+                                nof_samples=config['nof_beam_samples'])
+    if mode == DaqModes.INTEGRATED_BEAM_DATA:
+        return integrated_beam_stream(nof_tiles, nof_channels=config['nof_beam_channels'])
+    if mode == DaqModes.STATION_BEAM_DATA:
+        return station_beam_stream(nof_channels=config['nof_beam_channels'],
+                                   nof_samples=config['nof_station_samples'])
+    raise ValueError("No traffic generator stream for mode {}".format(mode.name))
+
+
+class InstrumentedDaqReceiver(DaqReceiver):
+    """ DaqReceiver which records the duration of each data callback and keeps persistence statistics
+    after the DAQ is stopped """
+
+    def __init__(self):
+        super(InstrumentedDaqReceiver, self).__init__()
+        self.callback_durations = {mode: [] for mode in CALLBACK_METHODS}
+        self.persistence_statistics = {}
+        for mode, method in CALLBACK_METHODS.items():
+            self._callbacks[mode] = self.DATA_CALLBACK(self._timed_callback(mode, getattr(self, method)))
+
+    def _timed_callback(self, mode, callback):
+        """ Wrap a data callback to record its duration """
+        durations = self.callback_durations[mode]
+
+        def timed_callback(data, timestamp, tile, argument):
+            start = time.perf_counter()
+            try:
+                callback(data, timestamp, tile, argument)
+            finally:
+                durations.append(time.perf_counter() - start)
+
+        return timed_callback
+
+    def stop_daq(self):
+        """ Stop DAQ, keeping the statistics of the persistence queues once all queued buffers are written """
+        persistence_queues = dict(self._persistence_queues)
+        super(InstrumentedDaqReceiver, self).stop_daq()
+        self.persistence_statistics = {mode.name: persistence_queue.statistics()
+                                       for mode, persistence_queue in persistence_queues.items()}
+
+
+def thread_cpu_times():
+    """ CPU time, in seconds, used by each thread of this process
+    :return: Dictionary mapping thread id to (thread name, CPU time) """
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    times = {}
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open('/proc/self/task/{}/stat'.format(tid)) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # The thread name is in parentheses and can contain spaces
+        name = stat[stat.index('(') + 1:stat.rindex(')')]
+        fields = stat[stat.rindex(')') + 2:].split()
+        times[int(tid)] = (name, (int(fields[11]) + int(fields[12])) / clock_ticks)
+    return times
+
+
+def thread_cpu_usage(start_times, end_times, elapsed):
+    """ CPU usage per thread between two thread_cpu_times snapshots, busiest thread first """
+    usage = []
+    for tid, (name, cpu_time) in end_times.items():
+        cpu_time -= start_times.get(tid, (name, 0))[1]
+        usage.append({'tid': tid, 'name': name, 'cpu_seconds': cpu_time,
+                      'cpu_percent': 100 * cpu_time / elapsed if elapsed > 0 else 0})
+    return sorted(usage, key=lambda thread: thread['cpu_seconds'], reverse=True)
+
+
+def directory_size(directory):
+    """ Total size, in bytes, of the files in a directory tree """
+    size = 0
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+def interface_counters(interface):
+    """ Receive packet and drop counters of a network interface, None if not available """
+    counters = {}
+    for counter in ['rx_packets', 'rx_dropped']:
+        try:
+            with open('/sys/class/net/{}/statistics/{}'.format(interface, counter)) as f:
+                counters[counter] = int(f.read())
+        except IOError:
+            return None
+    return counters
+
+
+def duration_statistics(durations):
+    """ Count, mean, percentiles and maximum of a list of durations, in milliseconds """
+    if len(durations) == 0:
+        return {'count': 0}
+    durations = np.array(durations) * 1e3
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+    return {'count': len(durations), 'mean_ms': durations.mean(), 'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99,
+            'max_ms': durations.max()}
+
+
+def receiver_process(config, mode, stop, results):
+    """ Run DaqReceiver for a mode until stopped, then report callback, CPU and persistence statistics.
+    Runs in a separate process so that CPU usage is not mixed up with the traffic generator and every
+    configuration starts from a fresh receiver. An error, or None once the DAQ is running, is reported before
+    the statistics """
+    try:
+        daq = InstrumentedDaqReceiver()
+        daq.populate_configuration(config)
+        daq.initialise_daq()
+        daq.start_daq(mode)
+    except Exception as e:
+        results.put("Could not start DAQ: {}".format(e))
+        return
+
+    start_time = time.time()
+    start_cpu = thread_cpu_times()
+    results.put(None)
+
+    stop.wait()
+    end_cpu = thread_cpu_times()
+    receive_time = time.time() - start_time
+
+    # Stopping the DAQ writes any buffers still queued for persistence
+    daq.stop_daq()
+    elapsed = time.time() - start_time
+    bytes_written = directory_size(config['directory'])
+
+    results.put({'buffers_received': len(daq.callback_durations[mode]),
+                 'callback_latency': duration_statistics(daq.callback_durations[mode]),
+                 'persistence': daq.persistence_statistics.get(mode.name),
+                 'bytes_written': bytes_written,
+                 'write_bandwidth_mbps': bytes_written / elapsed / 1e6 if elapsed > 0 else 0,
+                 'threads': thread_cpu_usage(start_cpu, end_cpu, receive_time),
+                 'elapsed': elapsed})
+
+
+def wait_for_result(process, results, timeout):
+    """ Wait for the next result of a receiver process, giving up if the process exits without reporting one
+    :param process: Receiver process
+    :param results: Queue on which the process reports results
+    :param timeout: Time in seconds to wait for the result
+    :return: Tuple of (True, result) or (False, error message) """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return True, results.get(timeout=min(1.0, max(deadline - time.time(), 0)))
+        except queue.Empty:
+            pass
+
+        # The process may have put its result just before exiting
+        if not process.is_alive():
+            try:
+                return True, results.get(timeout=1.0)
+            except queue.Empty:
+                return False, "Receiver process exited with code {}".format(process.exitcode)
+
+        if time.time() >= deadline:
+            return False, "No response from receiver process within {} seconds".format(timeout)
+
+
+def run_benchmark(mode, nof_tiles, rate, nof_blocks, frames_per_block, persistence, directory, duration,
+                  port=4660, interface='lo', settle_time=2.0, startup_timeout=60, stop_timeout=300,
+                  keep_files=False):
+    """ Benchmark DaqReceiver on one configuration
+    :param mode: DaqModes mode
+    :param nof_tiles: Number of simulated tiles
+    :param rate: Generator rate in Gb/s, 0 for no limit
+    :param nof_blocks: Receiver number of blocks
+    :param frames_per_block: Receiver frames per block
+    :param persistence: Persistence setting, key of PERSISTENCE_SETTINGS
+    :param directory: Directory in which a data directory is created for this run
+    :param duration: Time in seconds for which traffic is generated
+    :param port: Receiver port
+    :param interface: Receiver interface
+    :param settle_time: Time in seconds to wait for the last buffers after traffic stops
+    :param startup_timeout: Time in seconds to wait for the DAQ to start
+    :param stop_timeout: Time in seconds to wait for the DAQ to stop and report statistics
+    :param keep_files: Keep data files written during the run
+    :return: Run results dictionary """
+
+    parameters = {'mode': mode.name, 'nof_tiles': nof_tiles, 'rate_gbps': rate, 'receiver_nof_blocks': nof_blocks,
+                  'receiver_frames_per_block': frames_per_block, 'persistence': persistence}
+
+    run_directory = os.path.join(directory, "daq_benchmark_{}".format(int(time.time() * 1e3)))
+    os.makedirs(run_directory)
+
+    config = {'nof_tiles': nof_tiles,
+              'receiver_interface': interface,
+              'receiver_ip': '127.0.0.1',
+              'receiver_ports': str(port),
+              'receiver_nof_blocks': nof_blocks,
+              'receiver_frames_per_block': frames_per_block,
+              'directory': run_directory,
+              'logging': False}
+    config.update(PERSISTENCE_SETTINGS[persistence])
+
+    # Generator streams are sized from the full receiver configuration
+    full_config = DaqReceiver().get_configuration()
+    full_config.update(config)
+    stream = create_stream(mode, full_config)
+
+    context = multiprocessing.get_context('fork')
+    stop, results = context.Event(), context.Queue()
+    receiver = context.Process(target=receiver_process, args=(config, mode, stop, results))
+    receiver.start()
+
+    try:
+        received, error = wait_for_result(receiver, results, startup_timeout)
+        if not received:
+            error = "DAQ did not start: {}".format(error)
+        if error is not None:
+            return {'parameters': parameters, 'error': error}
+
+        interface_start = interface_counters(interface)
+        generator = SpeadTrafficGenerator('127.0.0.1', port, [stream], rate=rate if rate > 0 else None)
+        generator.run(duration=duration)
+        generator.close()
+        generator_statistics = generator.statistics()
+
+        time.sleep(settle_time)
+        interface_end = interface_counters(interface)
+        stop.set()
+        received, receiver_statistics = wait_for_result(receiver, results, stop_timeout)
+        if not received:
+            return {'parameters': parameters, 'error': "DAQ did not stop: {}".format(receiver_statistics)}
+    finally:
+        if receiver.is_alive():
+            receiver.terminate()
+        receiver.join()
+        if not keep_files:
+            shutil.rmtree(run_directory, ignore_errors=True)
+
+    # Each frame fills one buffer per tile, except for station beam data
+    buffers_per_frame = 1 if mode == DaqModes.STATION_BEAM_DATA else nof_tiles
+    buffers_expected = generator_statistics['frames_sent'] * buffers_per_frame
+    buffers_received = receiver_statistics['buffers_received']
+    packets_per_buffer = stream.nof_packets / buffers_per_frame
+
+    result = {'parameters': parameters,
+              'generator': generator_statistics,
+              'receiver': receiver_statistics,
+              'packets_sent': generator_statistics['packets_sent'],
+              'packets_received': int(buffers_received * packets_per_buffer),
+              'buffers_expected': buffers_expected,
+              'buffers_received': buffers_received,
+              'buffer_loss': 1 - buffers_received / buffers_expected if buffers_expected > 0 else 0,
+              'persistence_loss': 0}
+
+    # With asynchronous persistence buffers can also be dropped when the writer queue is full
+    persistence = receiver_statistics['persistence']
+    if persistence is not None and persistence['queued'] + persistence['dropped'] > 0:
+        result['persistence_loss'] = persistence['dropped'] / (persistence['queued'] + persistence['dropped'])
+
+    if interface_start is not None and interface_end is not None:
+        result['interface'] = {counter: interface_end[counter] - interface_start[counter]
+                               for counter in interface_start}
+
+    return result
+
+
+def max_sustained_tiles(runs, loss_threshold):
+    """ Largest tile count sustained by each configuration, with buffer and persistence loss within the threshold """
+    sustained = {}
+    for run in runs:
+        if 'error' in run:
+            continue
+        parameters = dict(run['parameters'])
+        nof_tiles = parameters.pop('nof_tiles')
+        key = json.dumps(parameters, sort_keys=True)
+        sustained.setdefault(key, dict(parameters, max_tiles=0))
+        if run['buffer_loss'] <= loss_threshold and run['persistence_loss'] <= loss_threshold:
+            sustained[key]['max_tiles'] = max(sustained[key]['max_tiles'], nof_tiles)
+    return list(sustained.values())
+
+
+def to_json(value):
+    """ Convert numpy values for JSON serialisation """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot serialise {}".format(type(value)))
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %daq_throughput [options]")
+    parser.add_option("-m", "--modes", action="store", dest="modes", default="INTEGRATED_CHANNEL_DATA",
+                      help="Comma separated list of DaqModes to benchmark, from {} [default: INTEGRATED_CHANNEL_DATA]"
+                      .format(", ".join(mode.name for mode in CALLBACK_METHODS)))
+    parser.add_option("-t", "--tiles", action="store", dest="tiles", default="1,2,4,8,16",
+                      help="Comma separated list of tile counts [default: 1,2,4,8,16]")
+    parser.add_option("-r", "--rates", action="store", dest="rates", default="0",
+                      help="Comma separated list of generator rates in Gb/s, 0 for no limit [default: 0]")
+    parser.add_option("-b", "--nof_blocks", action="store", dest="nof_blocks", default="256",
+                      help="Comma separated list of receiver_nof_blocks values [default: 256]")
+    parser.add_option("-f", "--frames_per_block", action="store", dest="frames_per_block", default="32",
+                      help="Comma separated list of receiver_frames_per_block values [default: 32]")
+    parser.add_option("-p", "--persistence", action="store", dest="persistence", default="none,sync,async",
+                      help="Comma separated list of persistence settings, from {} [default: none,sync,async]"
+                      .format(", ".join(PERSISTENCE_SETTINGS)))
+    parser.add_option("-d", "--duration", action="store", dest="duration", type="float", default=10,
+                      help="Time in seconds for which traffic is generated per run [default: 10]")
+    parser.add_option("-D", "--directory", action="store", dest="directory", default=".",
+                      help="Directory in which run data is written [default: .]")
+    parser.add_option("-i", "--interface", action="store", dest="interface", default="lo",
+                      help="Receiver interface [default: lo]")
+    parser.add_option("-P", "--port", action="store", dest="port", type="int", default=4660,
+                      help="Receiver port [default: 4660]")
+    parser.add_option("-l", "--loss_threshold", action="store", dest="loss_threshold", type="float", default=0,
+                      help="Buffer loss fraction below which a tile count is sustained [default: 0]")
+    parser.add_option("-o", "--output", action="store", dest="output", default=None,
+                      help="Output JSON file [default: daq_throughput_<time>.json]")
+    parser.add_option("--keep_files", action="store_true", dest="keep_files", default=False,
+                      help="Keep data files written during runs [default: False]")
+    (conf, args) = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+
+    modes = [DaqModes[mode.strip()] for mode in conf.modes.split(',')]
+    persistence_settings = [setting.strip() for setting in conf.persistence.split(',')]
+    for setting in persistence_settings:
+        if setting not in PERSISTENCE_SETTINGS:
+            raise Exception("Unknown persistence setting {}".format(setting))
+
+    sweep = list(itertools.product(modes,
+                                   [float(x) for x in conf.rates.split(',')],
+                                   [int(x) for x in conf.nof_blocks.split(',')],
+                                   [int(x) for x in conf.frames_per_block.split(',')],
+                                   persistence_settings,
+                                   sorted(int(x) for x in conf.tiles.split(','))))
+
+    runs = []
+    print("{:>24} {:>6} {:>6} {:>6} {:>6} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "Mode", "Tiles", "Gb/s", "Blocks", "Frames", "Persistence", "Sent Gb/s", "Loss (%)", "p99 (ms)", "MB/s"))
+    for mode, rate, nof_blocks, frames_per_block, persistence, nof_tiles in sweep:
+        run = run_benchmark(mode, nof_tiles, rate, nof_blocks, frames_per_block, persistence, conf.directory,
+                            conf.duration, port=conf.port, interface=conf.interface, keep_files=conf.keep_files)
+        runs.append(run)
+
+        if 'error' in run:
+            print("{:>24} {:>6} {}".format(mode.name, nof_tiles, run['error']))
+            continue
+        print("{:>24} {:>6} {:>6.1f} {:>6} {:>6} {:>12} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+            mode.name, nof_tiles, rate, nof_blocks, frames_per_block, persistence,
+            run['generator']['data_rate_gbps'], (run['buffer_loss'] + run['persistence_loss']) * 100,
+            run['receiver']['callback_latency'].get('p99_ms', 0), run['receiver']['write_bandwidth_mbps']))
+
+    output = conf.output
+    if output is None:
+        output = "daq_throughput_{}.json".format(time.strftime("%Y%m%d_%H%M%S"))
+
+    with open(output, 'w') as f:
+        json.dump({'host': socket.gethostname(),
+                   'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   'cpu_count': os.cpu_count(),
+                   'duration': conf.duration,
+                   'loss_threshold': conf.loss_threshold,
+                   'max_sustained_tiles': max_sustained_tiles(runs, conf.loss_threshold),
+                   'runs': runs}, f, indent=2, default=to_json)
+
+    print("Results written to {}".format(output))
@@ -0,0 +1,61 @@
+from __future__ import print_function
+from __future__ import division
+
+from optparse import OptionParser
+
+import numpy as np
+
+from pydaq.correlation import correlate
+
+from benchmark_utils import time_function
+
+# Custom numpy type for creating complex signed 8-bit data
+complex_8t = np.dtype([('real', np.int8), ('imag', np.int8)])
+
+
+def loop_correlate(data, nof_antennas, nof_pols):
+    """ Correlation as originally implemented in the offline correlators, including the conversion to complex64 """
+    data = (data['real'] + 1j * data['imag']).astype(np.complex64)
+    output = np.zeros((nof_pols * nof_pols, nof_antennas * (nof_antennas + 1) // 2), dtype=np.complex64)
+
+    baseline = 0
+    for antenna1 in range(nof_antennas):
+        for antenna2 in range(antenna1, nof_antennas):
+            for pol1 in range(nof_pols):
+                for pol2 in range(nof_pols):
+                    output[pol1 * nof_pols + pol2, baseline] = np.correlate(data[antenna1, pol1, :],
+                                                                            data[antenna2, pol2, :])[0]
+            baseline += 1
+
+    return output
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %offline_correlation [options]")
+    parser.add_option("-a", "--antennas", action="store", dest="antennas", default="16,64,256",
+                      help="Comma separated list of antenna counts to benchmark [default: 16,64,256]")
+    parser.add_option("-p", "--nof_pols", action="store", dest="nof_pols", type="int", default=2,
+                      help="Number of polarisations [default: 2]")
+    parser.add_option("-s", "--samples", action="store", dest="nof_samples", type="int", default=8192,
+                      help="Number of samples per correlation [default: 8192]")
+    parser.add_option("-r", "--repetitions", action="store", dest="repetitions", type="int", default=1,
+                      help="Number of repetitions per measurement [default: 1]")
+    (conf, args) = parser.parse_args()
+
+    print("{:>10} {:>12} {:>14} {:>14} {:>10}".format("Antennas", "Loop (s)", "complex64 (s)", "complex128 (s)",
+                                                      "Speedup"))
+    for nof_antennas in [int(x) for x in conf.antennas.split(',')]:
+        data = np.zeros((nof_antennas, conf.nof_pols, conf.nof_samples), dtype=complex_8t)
+        data['real'] = np.random.randint(-128, 128, data.shape)
+        data['imag'] = np.random.randint(-128, 128, data.shape)
+
+        # Check that both implementations generate the same output
+        if not np.allclose(loop_correlate(data, nof_antennas, conf.nof_pols), correlate(data), rtol=1e-4):
+            raise Exception("Correlation output mismatch for {} antennas".format(nof_antennas))
+
+        loop_time = time_function(lambda: loop_correlate(data, nof_antennas, conf.nof_pols), conf.repetitions)
+        single_time = time_function(lambda: correlate(data), conf.repetitions)
+        double_time = time_function(lambda: correlate(data, precision=np.complex128), conf.repetitions)
+
+        print("{:>10} {:>12.3f} {:>14.4f} {:>14.4f} {:>10.1f}".format(nof_antennas, loop_time, single_time,
+                                                                      double_time, loop_time / single_time))
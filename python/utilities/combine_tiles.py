@@ -10,13 +10,18 @@ import os
 complex_8t = np.dtype([('real', np.int8), ('imag', np.int8)])
 
 
-def combine_tiles(data_directory, nof_tiles):
+def combine_tiles(data_directory, nof_tiles, finalise=False):
     """ Combine continuous channel data from multiple tiles """
     block_size = 65536
 
     # Get channel file handler
     channel_file_mgr = ChannelFormatFileManager(root_path=data_directory, daq_mode=FileDAQModes.Continuous)
 
+    # Rewrite data files with a contiguous layout such that they can be memory-mapped
+    if finalise:
+        for t in range(nof_tiles):
+            channel_file_mgr.finalise_file(tile_id=t)
+
     # Read one sample to get metadata and calculate number of samples in file
     sample, timestamp = channel_file_mgr.read_data(n_samples=1)
     if channel_file_mgr.file_partitions(tile_id=0) == 0:
@@ -48,7 +53,8 @@ def combine_tiles(data_directory, nof_tiles):
             # Read data from current tile
             current_samples, current_timestamps = channel_file_mgr.read_data(n_samples=block_size,
                                                                              sample_offset=i,
-                                                                             tile_id=t)
+                                                                             tile_id=t,
+                                                                             memory_map=finalise)
 
             # Reshape and transpose data
             current_samples = np.transpose(np.squeeze(current_samples.reshape(32, block_size)), (1, 0))
@@ -70,6 +76,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Combine continuous tiles from multiple elements into one file')
     parser.add_argument('-d', '--directory', action="store", default='.', help="Data directory (default: '.'")
     parser.add_argument('-t', '--tiles', action="store", default=16, type=int, help="Number of tiles (default: 16")
+    parser.add_argument('-f', '--finalise', action="store_true", default=False,
+                        help="Finalise data files and memory-map them when reading (default: False)")
     args = parser.parse_args()
 
     # Check that directory exists
@@ -80,4 +88,4 @@ if __name__ == "__main__":
     # Remove locks
     os.system("rm -fr %s/*.lock".format(args.directory))
 
-    combine_tiles(args.directory, args.tiles)
+    combine_tiles(args.directory, args.tiles, args.finalise)
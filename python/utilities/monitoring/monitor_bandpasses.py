@@ -1,6 +1,8 @@
 from __future__ import division
 
 import datetime
+import io
+import json
 import logging
 import os
 import re
@@ -11,9 +13,10 @@ import tempfile
 import threading
 from builtins import range
 from builtins import str
+from collections import OrderedDict, deque
 from math import floor
 from multiprocessing import Process
-from time import sleep
+from time import sleep, time
 
 import h5py
 import numpy as np
@@ -45,10 +48,18 @@ nof_channels = 512
 bandwidth = 400.0
 nof_pols = 2
 
-# Global store containing files to be processed
+# Number of threads generating bandpass plots for each station
+nof_plotting_workers = 4
+
+# Interval, in seconds, at which monitoring metrics are logged
+metrics_log_interval = 60
+
+# Expression matching integrated channel data files
+filename_expression = re.compile(r"channel_integ_(?P<tile>\d+)_(?P<timestamp>\d+_\d+)_0.hdf5")
+
+# Global store containing antenna locations
 antenna_locations = {}
 stop_bandpass = False
-files_to_plot = {}
 
 
 def _signal_handler(signum, frame):
@@ -190,18 +201,116 @@ def monitor_delays(frequency, reference_antenna, test_antenna, reference_pol, te
         sleep(cadence)
 
 
-def plotting_thread_function(plotting_directory, station_name):
-    """ Plotting thread function"""
-    global files_to_plot
-    global stop_bandpass
+class BandpassQueue(object):
+    """ Queue of integrated data files to plot. Files are queued per tile, and a file received whilst an older
+    file for the same tile is still queued replaces it, so that only the newest data of each tile is plotted
+    when a backlog builds up. A tile is never plotted by more than one worker at a time. The queue also keeps
+    metrics on queue depth and rendering time """
 
-    # Import and setup matplotlib
-    from matplotlib.backends.backend_svg import FigureCanvasSVG as FigureCanvas
-    from matplotlib.figure import Figure
+    def __init__(self, settle_time=0.1):
+        """ Constructor
+        :param settle_time: Time, in seconds, to wait after a file is created before reading it """
+        self._settle_time = settle_time
+        self._pending = OrderedDict()
+        self._busy = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        # Metrics
+        self._received = 0
+        self._coalesced = 0
+        self._rendered = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._render_times = deque(maxlen=100)
+        self._max_render_time = 0
+        self._latencies = deque(maxlen=100)
+
+    def put(self, tile, filepath):
+        """ Queue a file for plotting, replacing any queued file for the same tile
+        :param tile: Tile number
+        :param filepath: Path to integrated data file """
+        with self._condition:
+            replaced = self._pending.pop(tile, None)
+            self._pending[tile] = (filepath, time())
+            self._received += 1
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            if replaced is not None:
+                self._coalesced += 1
+            self._condition.notify()
+
+        # Replaced files will not be plotted, delete them
+        if replaced is not None:
+            logging.info("Skipping {}, newer data received for tile {}".format(replaced[0], tile))
+            _remove_file(replaced[0])
+
+    def get(self):
+        """ Wait for a file to plot. The tile of the returned file is marked as busy until done is called
+        :return: (tile, filepath, arrival time) tuple, or None if the queue was stopped """
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                for tile in self._pending:
+                    if tile not in self._busy:
+                        filepath, arrival_time = self._pending.pop(tile)
+                        self._busy.add(tile)
+                        break
+                else:
+                    self._condition.wait()
+                    continue
+                break
 
-    _directory = plotting_directory
-    _freq_range = np.arange(1, nof_channels) * (old_div(bandwidth, nof_channels))
-    _filename_expression = re.compile(r"channel_integ_(?P<tile>\d+)_(?P<timestamp>\d+_\d+)_0.hdf5")
+        # Give the writer some time to finish writing the file
+        wait_time = arrival_time + self._settle_time - time()
+        if wait_time > 0:
+            sleep(wait_time)
+
+        return tile, filepath, arrival_time
+
+    def done(self, tile, arrival_time, render_time, success=True):
+        """ Mark the plotting of a tile as done
+        :param tile: Tile number
+        :param arrival_time: Time at which the plotted file was queued
+        :param render_time: Time, in seconds, taken to plot the file
+        :param success: False if plotting failed """
+        with self._condition:
+            self._busy.discard(tile)
+            if success:
+                self._rendered += 1
+                self._render_times.append(render_time)
+                self._max_render_time = max(self._max_render_time, render_time)
+                self._latencies.append(time() - arrival_time)
+            else:
+                self._errors += 1
+            self._condition.notify()
+
+    def stop(self):
+        """ Stop the queue, waking up all waiting workers """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def metrics(self):
+        """ Return queue depth and rendering metrics. Render time and latency (from file creation to plot
+        update) are in seconds, averaged over the last 100 plotted files """
+        with self._condition:
+            return {'queue_depth': len(self._pending),
+                    'max_queue_depth': self._max_queue_depth,
+                    'busy_tiles': len(self._busy),
+                    'received': self._received,
+                    'coalesced': self._coalesced,
+                    'rendered': self._rendered,
+                    'errors': self._errors,
+                    'mean_render_time': np.mean(self._render_times) if self._render_times else 0,
+                    'max_render_time': self._max_render_time,
+                    'mean_latency': np.mean(self._latencies) if self._latencies else 0}
+
+
+class BandpassPlotter(object):
+    """ Generates bandpass SVG plots from pre-built figure templates. A template is rendered with matplotlib
+    once for each polarisation, with placeholders for the tile number, antenna base identifiers and date text.
+    Plots are then generated by only filling in these fields and the path data of the antenna lines """
 
     # Define fibre - antenna mapping
     _fibre_preadu_mapping = {0: 1, 1: 2, 2: 3, 3: 4,
@@ -216,89 +325,188 @@ def plotting_thread_function(plotting_directory, station_name):
                      13: 'y', 14: 'm', 15: 'deeppink', 16: 'c'}
     _pol_map = ['X', 'Y']
 
-    # Set up figure and initialise with dummy data
-    plot_lines = []
-    fig = Figure(figsize=(8, 4))
-    canvas = FigureCanvas(fig)
-    ax = fig.add_subplot(111)
+    # Plot limits
+    _x_limits = (0, bandwidth)
+    _y_limits = (0, 40)
 
-    for antenna in range(nof_antennas_per_tile):
-        tpm_input = _fibre_preadu_mapping[antenna]
-        plot_lines.append(ax.plot(_freq_range,
-                          list(range(511)),
-                          label="Antenna {} (RX {})".format(antenna, tpm_input),
-                          color=_ribbon_color[tpm_input],
-                          linewidth=0.6)[0])
+    # Template fields. Placeholders have the same width as the values which replace them, so that the layout
+    # of the template matches that of the plot
+    _field_expression = re.compile(r'(?P<line><g id="bandpass_line_(?P<antenna>\d+)">\s*<path d=")[^"]*"|'
+                                   r'@(?P<text>T|D|\d\d)')
 
-    # Extarct antenna locations
-    antenna_base, _, _ = antenna_locations[station_name]
-
-    # Make nice
-    ax.set_xlim((0, bandwidth))
-    ax.set_ylim((0, 40))
-    ax.set_title("Tile {} - Pol {}".format(0, _pol_map[0]), fontdict={'fontweight':'bold'})
-    ax.set_xlabel("Frequency (MHz)")
-    ax.set_ylabel("Power (dB)")
-    date_text = ax.text(300, 38, "Dummy date", weight='bold', size='10')
-    legend = ax.legend(loc="lower center", ncol=4, prop={'size': 4})
-    ax.minorticks_on()
-    ax.grid(b=True, which='major', color='0.3', linestyle='-', linewidth=0.5)
-    ax.grid(b=True, which='minor', color='0.8', linestyle='--', linewidth=0.1)
-
-    # Loop until asked to stop
-    while not stop_bandpass:
-        # Wait for files to be queued
-        while len(files_to_plot[station_name]) == 0 and not stop_bandpass:
-            sleep(0.1)
-        
-        if stop_bandpass:
+    def __init__(self, directory, antenna_base):
+        """ Constructor
+        :param directory: Directory where plots are generated
+        :param antenna_base: Base identifier of each antenna in the station """
+        self._directory = directory
+        self._antenna_base = antenna_base
+        self._freq_range = np.arange(1, nof_channels) * (old_div(bandwidth, nof_channels))
+
+        # Templates are split into static parts and fields, and are generated on first use for each pol
+        self._templates = {}
+        self._template_lock = threading.Lock()
+
+        # Mapping from data to SVG coordinates, set when the first template is generated
+        self._x_coordinates = None
+        self._y_scale, self._y_offset = None, None
+
+    def plot(self, tile_number, data, timestamp):
+        """ Generate the plots of both polarisations of a tile
+        :param tile_number: Tile number
+        :param data: Power in dB, in channels/antennas/pols order
+        :param timestamp: Data timestamp """
+
+        # Format datetime
+        date_time = datetime.utcfromtimestamp(timestamp).strftime("%y-%m-%d %H:%M:%S")
+
+        for pol in range(nof_pols):
+            parts, fields = self._template(pol)
+
+            # Generate field values and interleave them with the static template parts
+            svg = [parts[0]]
+            for field, part in zip(fields, parts[1:]):
+                if field == 'T':
+                    svg.append(str(tile_number + 1))
+                elif field == 'D':
+                    svg.append(date_time)
+                elif isinstance(field, tuple):
+                    svg.append(self._path_data(data[1:, field[1], pol]))
+                else:
+                    svg.append("{:0>3d}".format(self._antenna_base[tile_number * 16 + int(field)]))
+                svg.append(part)
+
+            # Write to a temporary file and replace the plot, so that readers never see a partial plot
+            filepath = os.path.join(self._directory, "tile_{}_pol_{}.svg".format(tile_number + 1,
+                                                                                  self._pol_map[pol].lower()))
+            with open(filepath + ".tmp", 'w') as f:
+                f.write(''.join(svg))
+            os.replace(filepath + ".tmp", filepath)
+
+    def _path_data(self, values):
+        """ Generate SVG path data for a bandpass line
+        :param values: Power in dB for each channel (excluding DC) """
+        y = np.nan_to_num(values, nan=0, posinf=0, neginf=0) * self._y_scale + self._y_offset
+        points = ["{:.3f} {:.3f}".format(x, y) for x, y in zip(self._x_coordinates, y)]
+        return "M " + " L ".join(points)
+
+    def _template(self, pol):
+        """ Get the template for a pol, rendering it if required
+        :return: Tuple of static SVG parts and the fields between them. Fields are 'T' for the tile number,
+                 'D' for the date, ('line', antenna) for antenna line path data and antenna index strings
+                 for antenna base identifiers """
+        with self._template_lock:
+            if pol not in self._templates:
+                self._templates[pol] = self._render_template(pol)
+            return self._templates[pol]
+
+    def _render_template(self, pol):
+        """ Render the template for a pol with matplotlib """
+
+        # Import and setup matplotlib
+        import matplotlib
+        from matplotlib.backends.backend_svg import FigureCanvasSVG as FigureCanvas
+        from matplotlib.figure import Figure
+
+        # Set up figure and initialise with dummy data
+        fig = Figure(figsize=(8, 4))
+        canvas = FigureCanvas(fig)
+        ax = fig.add_subplot(111)
+
+        for antenna in range(nof_antennas_per_tile):
+            tpm_input = self._fibre_preadu_mapping[antenna]
+            line = ax.plot(self._freq_range,
+                           np.zeros(nof_channels - 1),
+                           label="{:0>2d} - RX {:0>2d} - Base @{:0>2d}".format(antenna, tpm_input, antenna),
+                           color=self._ribbon_color[tpm_input],
+                           linewidth=0.6)[0]
+            line.set_gid("bandpass_line_{}".format(antenna))
+
+        # Make nice
+        ax.set_xlim(self._x_limits)
+        ax.set_ylim(self._y_limits)
+        ax.set_title("Tile @T - Pol {}".format(self._pol_map[pol]), fontdict={'fontweight': 'bold'})
+        ax.set_xlabel("Frequency (MHz)")
+        ax.set_ylabel("Power (dB)")
+        ax.text(300, 38, "@D", weight='bold', size='10')
+        ax.legend(loc="lower center", ncol=4, prop={'size': 4})
+        ax.minorticks_on()
+        ax.grid(True, which='major', color='0.3', linestyle='-', linewidth=0.5)
+        ax.grid(True, which='minor', color='0.8', linestyle='--', linewidth=0.1)
+
+        # Render figure, with text as SVG text elements so that text fields can be replaced
+        output = io.StringIO()
+        with matplotlib.rc_context({'svg.fonttype': 'none'}):
+            canvas.print_figure(output, format='svg', pad_inches=0)
+        svg = output.getvalue()
+
+        # Compute mapping from data to SVG coordinates (in points, with the y axis pointing down)
+        if self._x_coordinates is None:
+            x0, y0, x1, y1 = ax.get_position().extents
+            width, height = fig.get_size_inches() * 72
+            x_scale = (x1 - x0) * width / (self._x_limits[1] - self._x_limits[0])
+            self._x_coordinates = x0 * width + (self._freq_range - self._x_limits[0]) * x_scale
+            self._y_scale = -(y1 - y0) * height / (self._y_limits[1] - self._y_limits[0])
+            self._y_offset = height - y0 * height - self._y_limits[0] * self._y_scale
+
+        # Split template around fields
+        parts, fields, position = [], [], 0
+        for match in self._field_expression.finditer(svg):
+            if match.group('line') is not None:
+                parts.append(svg[position:match.end('line')])
+                fields.append(('line', int(match.group('antenna'))))
+                position = match.end() - 1
+            else:
+                parts.append(svg[position:match.start()])
+                fields.append(match.group('text'))
+                position = match.end()
+        parts.append(svg[position:])
+
+        return parts, fields
+
+
+def _remove_file(filepath):
+    """ Delete a processed or skipped data file """
+    try:
+        os.unlink(filepath)
+    except OSError:
+        pass
+
+
+def plotting_worker_function(plot_queue, plotter):
+    """ Plotting worker function, plots files from the queue until the queue is stopped
+    :param plot_queue: BandpassQueue instance
+    :param plotter: BandpassPlotter instance """
+
+    while True:
+        item = plot_queue.get()
+        if item is None:
             return
 
-        # Get the first item in the list
-        filepath = files_to_plot[station_name].pop(0)
+        tile_number, filepath, arrival_time = item
         logging.info("Processing {}".format(filepath))
 
-        # Extract Tile number
-        filename = os.path.basename(os.path.abspath(filepath))
-        parts = _filename_expression.match(filename)
-        tile_number = int(parts.groupdict()['tile'])
-
-        # Open newly create HDF5 file
-        with h5py.File(filepath, 'r') as f:
-            # Data is in channels/antennas/pols order
-            data = f['chan_']['data'][:]
-            timestamp = f['sample_timestamps']['data'][0]
-            data = data.reshape((nof_channels, nof_antennas_per_tile, nof_pols))
+        t0 = time()
+        try:
+            # Open newly create HDF5 file
+            with h5py.File(filepath, 'r') as f:
+                # Data is in channels/antennas/pols order
+                data = f['chan_']['data'][:]
+                timestamp = f['sample_timestamps']['data'][0].item()
+                data = data.reshape((nof_channels, nof_antennas_per_tile, nof_pols))
 
             # Convert to power in dB
-            np.seterr(divide='ignore')
-            data = 10 * np.log10(data)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                data = 10 * np.log10(data)
             data[np.isneginf(data)] = 0
-            np.seterr(divide='warn')
-
-        # Format datetime
-        date_time = datetime.utcfromtimestamp(timestamp).strftime("%y-%m-%d %H:%M:%S")
 
-        # Loop over polarisations (separate plots)
-        for pol in range(nof_pols):
+            plotter.plot(tile_number, data, timestamp)
+            plot_queue.done(tile_number, arrival_time, time() - t0)
+        except Exception as e:
+            logging.error("Could not plot {}: {}".format(filepath, e))
+            plot_queue.done(tile_number, arrival_time, time() - t0, success=False)
 
-            # Loop over antennas, change plot data and label text
-            for i, antenna in enumerate(range(nof_antennas_per_tile)):
-                plot_lines[i].set_ydata(data[1:, antenna, pol])
-                legend.get_texts()[i].set_text("{:0>2d} - RX {:0>2d} - Base {:0>3d}".format(i, _fibre_preadu_mapping[antenna],
-                                                                                            antenna_base[tile_number * 16 + i]))
-                
-            # Update title and time
-            ax.set_title("Tile {} - Pol {}".format(tile_number + 1, _pol_map[pol]))
-            date_text.set_text(date_time)
-
-            # Save updated figure
-            canvas.print_figure(os.path.join(_directory, 
-                        "tile_{}_pol_{}.svg".format(tile_number + 1, _pol_map[pol].lower())), 
-                        pad_inches=0, dpi=200, figsize=(8, 4))
-            
         # Ready from file, delete it
-        os.unlink(filepath)
+        _remove_file(filepath)
 
 
 def generate_rms_plots(config, directory):
@@ -394,29 +602,30 @@ def generate_rms_plots(config, directory):
 
 
 class IntegratedDataHandler(FileSystemEventHandler):
-    """ Detects file created in the data directory and generates plots """
+    """ Detects file created in the data directory and queues them for plotting """
 
-    def __init__(self, station_name):
+    def __init__(self, plot_queue):
         """ Constructor
-        :param station_name: Station name """
-        self._station_name = station_name
-        files_to_plot[station_name] = []
+        :param plot_queue: BandpassQueue where files are queued """
+        self._plot_queue = plot_queue
 
     def on_any_event(self, event):
         # We are only interested in newly created files
-        global files_to_plot
-
         if event.event_type == 'created':
 
             # Ignore lock files and other temporary files
             if not ("channel" in event.src_path and not "lock" in event.src_path):
                 return
 
-            # Add to list
-            sleep(0.1)
+            parts = filename_expression.match(os.path.basename(os.path.abspath(event.src_path)))
+            if parts is None:
+                return
+
+            # Add to queue
             logging.info("Detected {}".format(event.src_path))
-            files_to_plot[self._station_name].append(event.src_path)
-            
+            self._plot_queue.put(int(parts.groupdict()['tile']), event.src_path)
+
+
 
 def configure_data_acquisition(interface, port, nof_tiles, directory):
     """ Start the DAQ instance for this station
@@ -513,32 +722,49 @@ def bandpass_monitor(config_path, plot_directory, interface, monitor_rms=False):
     rms.start()
 
     # Start directory monitor
+    plot_queue = BandpassQueue()
     observer = Observer()
-    data_handler = IntegratedDataHandler(station_name)
+    data_handler = IntegratedDataHandler(plot_queue)
     observer.schedule(data_handler, data_directory)
     observer.start()
-    
-    # Start plotting thread
-    plotting_thread = threading.Thread(target=plotting_thread_function,
-                                       args=(os.path.join(opts.plot_directory, station_name), station_name))
-    plotting_thread.start()
-    
-    # Wait for stop, monitoring disk space in the meantime
+
+    # Start plotting workers
+    station_plot_directory = os.path.join(opts.plot_directory, station_name)
+    plotter = BandpassPlotter(station_plot_directory, antenna_locations[station_name][0])
+    plotting_threads = []
+    for _ in range(nof_plotting_workers):
+        plotting_thread = threading.Thread(target=plotting_worker_function, args=(plot_queue, plotter))
+        plotting_thread.start()
+        plotting_threads.append(plotting_thread)
+
+    # Wait for stop, monitoring disk space and publishing metrics in the meantime
+    last_metrics_log = time()
     while not stop_bandpass:
-        dir_size = sum(os.path.getsize(f) for f in os.listdir(data_directory) if os.path.isfile(f))
+        dir_size = sum(os.path.getsize(os.path.join(data_directory, f)) for f in os.listdir(data_directory)
+                       if os.path.isfile(os.path.join(data_directory, f)))
         if dir_size > 200 * 1024 * 1024:
             logging.error("Consuming too much disk space! Exiting")
             stop_bandpass = True
             break
+
+        metrics = plot_queue.metrics()
+        with open(os.path.join(station_plot_directory, "bandpass_monitor_metrics.json"), 'w') as f:
+            json.dump(dict(metrics, timestamp=time()), f)
+        if time() - last_metrics_log > metrics_log_interval:
+            logging.info("Bandpass monitor metrics: {}".format(metrics))
+            last_metrics_log = time()
+
         sleep(5)
-    
+
     # Stop and clean up
     logging.info("Waiting for threads and processes to terminate")
     receiver.stop_daq()
     observer.stop()
-    shutil.rmtree(data_directory, ignore_errors=True)
+    plot_queue.stop()
     observer.join()
-    plotting_thread.join()
+    for plotting_thread in plotting_threads:
+        plotting_thread.join()
+    shutil.rmtree(data_directory, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -1,25 +1,33 @@
-from multiprocessing.pool import ThreadPool
+from multiprocessing import shared_memory
+import multiprocessing
+import queue
 import glob
 import re
 import datetime
 import numpy as np
-import threading
 import time
 import sys
 import os
 
 from pydaq.persisters import FileDAQModes, ChannelFormatFileManager, CorrelationFormatFileManager
+from pydaq.correlation import correlate, nof_baselines
+
+# Environment variables which limit the number of threads used by BLAS libraries in worker processes, such that the
+# throughput of the correlator scales with the number of worker processes rather than oversubscribing the cores
+_SINGLE_THREAD_ENVIRONMENT = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
 
 
 class Correlator:
     # Custom numpy type for creating complex signed 8-bit data
     complex_8t = np.dtype([('real', np.int8), ('imag', np.int8)])
 
-    def __init__(self, nof_samples: int = 1048576, nof_threads=8):
-        """ Class initializer """
+    def __init__(self, nof_samples: int = 1048576, nof_workers=8):
+        """ Class initializer
+        :param nof_samples: Number of samples per correlated block
+        :param nof_workers: Number of correlation worker processes """
 
         self._nof_samples = nof_samples
-        self._nof_threads = nof_threads
+        self._nof_workers = nof_workers
         self._skip = 1
 
         # Processing variables
@@ -32,13 +40,6 @@ class Correlator:
         self._nof_channels = 0
         self._nof_pols = 0
 
-        # Numpy-based ring buffer for communication between consumer and producer
-        self._consumer_lock = threading.Lock()
-        self._ring_buffer = None
-        self._producer = 0
-        self._consumer = 0
-        self._counter = 0
-
         self._filename_re = re.compile(r"channel_(?P<mode>\w+)_(?P<tile>\d+)_(?P<timestamp>\d+_\d+)_\d+.hdf5")
 
     def correlate(self, input_directory):
@@ -69,8 +70,9 @@ class Correlator:
             print("No channel files found. Not correlating.")
             return
 
-        self._sorted_tile_ids = sorted(tiles_to_process)
-        if not (min(self._sorted_tile_ids) == 0 and len(set(self._sorted_tile_ids)) == max(self._sorted_tile_ids) + 1):
+        # A tile has one file per partition, so tile IDs are deduplicated
+        self._sorted_tile_ids = sorted(set(tiles_to_process))
+        if not (min(self._sorted_tile_ids) == 0 and len(self._sorted_tile_ids) == max(self._sorted_tile_ids) + 1):
             print("Missing tiles detected. Not correlating.")
             return
 
@@ -109,45 +111,15 @@ class Correlator:
         self._nof_channels = self._channel_reader.n_chans
         self._nof_blocks = int(total_samples / self._nof_samples)
         self._nof_pols = self._channel_reader.n_pols
-        self._nof_baselines = int(0.5 * self._nof_antennas ** 2 + self._nof_antennas)
+        self._nof_baselines = nof_baselines(self._nof_antennas)
 
-        # Create output buffer
+        # Correlate all blocks and channels in worker processes
         # Input data is in channels / antennas / pols / samples order
         # Output data should be in channels / baselines / blocks order
-        self._correlated_data = np.zeros((self._nof_pols * self._nof_pols, self._nof_channels,
-                                          self._nof_baselines, self._nof_blocks),
-                                         dtype=np.complex64)
-
-        # Reset counters (as correlate can be called multiple times)
-        self._producer = 0
-        self._consumer = 0
-        self._counter = 0
-
-        # Create ring buffer
-        # self._ring_buffer = []
-        # for i in range(self._nof_threads * 2):
-        #     self._ring_buffer.append(
-        #         {'full': False,
-        #          'index': 0,
-        #          'data': np.zeros((self._nof_antennas,
-        #                            self._nof_pols,
-        #                            self._nof_samples),
-        #                           dtype=self.complex_8t)})
-        #
-        # # Initialise producer thread
-        # producer_thread = threading.Thread(target=self._reader)
-        # producer_thread.start()
-        #
-        # # Start up consumer thread pool
-        # start = time.time()
-        # pool = ThreadPool(self._nof_threads)
-        # pool.map(self._process_parallel, range(self._nof_blocks * self._nof_channels))
-        # end = time.time()
-        # print("Took {}s to correlate {} blocks of {} samples each".format(end - start, self._nof_blocks,
-        #                                                                   self._nof_samples))
-        #
-        # # Join producer
-        # producer_thread.join()
+        start = time.time()
+        self._correlated_data = self._correlate_parallel(input_directory, mode)
+        print("Took {:.2f}s to correlate {} blocks of {} samples each".format(time.time() - start, self._nof_blocks,
+                                                                               self._nof_samples))
 
         # Transpose data to match output format
         self._correlated_data = np.transpose(self._correlated_data, (3, 1, 2, 0))
@@ -162,91 +134,151 @@ class Correlator:
             corr_file = CorrelationFormatFileManager(root_path=directory, data_type="complex64")
             corr_file.set_metadata(n_chans=1,
                                    n_pols=self._nof_pols,
-                                   n_samples=self._nof_blocks,
+                                   n_samples=1,
                                    n_antennas=self._nof_antennas,
                                    n_stokes=self._nof_pols * self._nof_pols,
                                    n_baselines=self._nof_baselines)
 
-            corr_file.ingest_data(data_ptr=self._correlated_data[:, channel, :, :],
-                                  timestamp=timestamp,
-                                  sampling_time=0,
-                                  buffer_timestamp=timestamp,
-                                  channel_id=channel)
-
-    def _correlate(self, input_data, output):
-        baseline, stokes = 0, 0
-        for antenna1 in range(self._nof_antennas):
-            for antenna2 in range(antenna1, self._nof_antennas):
-                stokes = 0
-                for pol1 in range(self._nof_pols):
-                    for pol2 in range(self._nof_pols):
-                        ans = np.correlate(input_data[antenna1, pol1, :],
-                                           input_data[antenna2, pol2, :])
-                        output[stokes, baseline] = ans[0]
-                        stokes += 1
-            baseline += 1
-
-    def _process_parallel(self, _):
-
-        # Read next data block (data is in sample/channel/antenna)
+            # Correlation files store one sample per write, so append blocks one at a time
+            for block in range(self._nof_blocks):
+                corr_file.ingest_data(append=True,
+                                      data_ptr=self._correlated_data[block, channel, :, :],
+                                      timestamp=timestamp,
+                                      sampling_time=0,
+                                      buffer_timestamp=timestamp,
+                                      channel_id=channel)
+
+    def _correlate_parallel(self, input_directory, mode):
+        """ Correlate all blocks and channels using a reader process, which fills a shared memory ring buffer with
+        blocks of samples of all channels, and a pool of worker processes, which correlate one channel of a block
+        from the ring buffer into a shared output array. Work items are handed over using blocking queues, and a
+        ring buffer slot is returned to the reader once all of its channels are correlated.
+        :param input_directory: Directory containing the channel files
+        :param mode: DAQ mode of the channel files, 'burst' or 'cont'
+        :return: Correlated data, in pol products / channels / baselines / blocks order """
+
+        # Enough blocks in flight to keep all workers busy while the reader fills the next block
+        nof_ring_slots = max(2, -(-2 * self._nof_workers // self._nof_channels))
+        ring_shape = (nof_ring_slots, self._nof_channels, self._nof_antennas, self._nof_pols, self._nof_samples)
+        output_shape = (self._nof_pols * self._nof_pols, self._nof_channels, self._nof_baselines, self._nof_blocks)
+        nof_items = self._nof_blocks * self._nof_channels
+
+        ring_memory = shared_memory.SharedMemory(create=True, size=int(np.prod(ring_shape)) * self.complex_8t.itemsize)
+        output_memory = shared_memory.SharedMemory(create=True,
+                                                   size=int(np.prod(output_shape)) * np.dtype(np.complex64).itemsize)
+
+        # Use fresh interpreters so that environment variables limiting BLAS threads take effect in the workers
+        context = multiprocessing.get_context("spawn")
+        free_queue, work_queue, done_queue = context.Queue(), context.Queue(), context.Queue()
+        for slot in range(nof_ring_slots):
+            free_queue.put(slot)
+
+        processes = []
         try:
-            # Wait for data to be available in
-            self._consumer_lock.acquire()
-            while not self._ring_buffer[self._consumer]['full']:
-                time.sleep(0.1)
-
-            # We have data, process it
-            data = self._ring_buffer[self._consumer]['data']
-            index = self._ring_buffer[self._consumer]['index']
-            channel = self._ring_buffer[self._consumer]['channel']
-
-            # All done, release lock
-            self._ring_buffer[self._consumer]['full'] = False
-            self._consumer = (self._consumer + 1) % self._nof_threads
-            self._counter += 1
-            self._consumer_lock.release()
-
-            t0 = time.time()
-            data = (data['real'] + 1j * data['imag']).astype(np.complex64)
-
-            total_blocks = self._nof_blocks * self._nof_channels
-            sys.stdout.write(
-                "Processed %d of %d [%.2f%%]     \r" % (self._counter, total_blocks,
-                                                        (self._counter / float(total_blocks)) * 100))
-            sys.stdout.flush()
-
-            # Perform correlation
-            self._correlate(data, self._correlated_data[:, channel, :, index])
-
-        except Exception as e:
-            import traceback
-            print(e, traceback.format_exc())
-
-    def _reader(self):
-
-        for block in range(self._nof_blocks):
-            for channel in range(self._nof_channels):
-
-                # Copy to ring buffer
-                while self._ring_buffer[self._producer]['full']:
-                    time.sleep(0.1)
-
-                # Read data
-                t0 = time.time()
-                data_ptr = self._ring_buffer[self._producer]['data']
-                for tile_id in self._sorted_tile_ids:
-                    data, _ = self._channel_reader.read_data(tile_id=tile_id,
-                                                             n_samples=self._nof_samples,
-                                                             sample_offset=block * self._nof_samples,
-                                                             channels=[channel])
-                    data_ptr[tile_id * 16: (tile_id + 1) * 16, :, :] = data
-
-                self._ring_buffer[self._producer]['index'] = block
-                self._ring_buffer[self._producer]['channel'] = channel
-                self._ring_buffer[self._producer]['full'] = True
-
-                # Update producer pointer
-                self._producer = (self._producer + 1) % self._nof_threads
+            original_environment = {name: os.environ.get(name) for name in _SINGLE_THREAD_ENVIRONMENT}
+            os.environ.update({name: "1" for name in _SINGLE_THREAD_ENVIRONMENT})
+            try:
+                processes.append(context.Process(target=_block_reader,
+                                                 args=(input_directory, mode, self._sorted_tile_ids,
+                                                       self._nof_channels, self._nof_blocks, self._nof_samples,
+                                                       ring_memory.name, ring_shape, free_queue, work_queue)))
+                for _ in range(self._nof_workers):
+                    processes.append(context.Process(target=_correlation_worker,
+                                                     args=(ring_memory.name, ring_shape, output_memory.name,
+                                                           output_shape, work_queue, done_queue)))
+                for process in processes:
+                    process.start()
+            finally:
+                for name, value in original_environment.items():
+                    if value is None:
+                        del os.environ[name]
+                    else:
+                        os.environ[name] = value
+
+            # Wait for all work items to be processed, returning slots to the reader once all channels are done
+            pending_channels = {}
+            for counter in range(1, nof_items + 1):
+                while True:
+                    try:
+                        slot, _, _ = done_queue.get(timeout=10)
+                        break
+                    except queue.Empty:
+                        if not all(process.is_alive() or process.exitcode == 0 for process in processes):
+                            raise RuntimeError("Correlator process terminated unexpectedly")
+
+                pending_channels[slot] = pending_channels.get(slot, self._nof_channels) - 1
+                if pending_channels[slot] == 0:
+                    del pending_channels[slot]
+                    free_queue.put(slot)
+
+                sys.stdout.write("Processed %d of %d [%.2f%%]     \r" % (counter, nof_items,
+                                                                        (counter / float(nof_items)) * 100))
+                sys.stdout.flush()
+
+            # Stop workers
+            for _ in range(self._nof_workers):
+                work_queue.put(None)
+            for process in processes:
+                process.join()
+
+            return np.ndarray(output_shape, dtype=np.complex64, buffer=output_memory.buf).copy()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            ring_memory.close()
+            ring_memory.unlink()
+            output_memory.close()
+            output_memory.unlink()
+
+
+def _block_reader(input_directory, mode, tile_ids, nof_channels, nof_blocks, nof_samples, ring_name, ring_shape,
+                  free_queue, work_queue):
+    """ Reader process. Reads blocks of samples of all channels from all tiles into free slots of the ring buffer
+    and queues each channel for correlation """
+
+    daq_mode = FileDAQModes.Burst if mode == "burst" else FileDAQModes.Continuous
+    channel_reader = ChannelFormatFileManager(root_path=input_directory, daq_mode=daq_mode)
+
+    ring_memory = shared_memory.SharedMemory(name=ring_name)
+    try:
+        ring_buffer = np.ndarray(ring_shape, dtype=Correlator.complex_8t, buffer=ring_memory.buf)
+        for block in range(nof_blocks):
+            slot = free_queue.get()
+            # Read all channels of a tile in a single query
+            for tile_id in tile_ids:
+                data, _ = channel_reader.read_data(tile_id=tile_id,
+                                                   n_samples=nof_samples,
+                                                   sample_offset=block * nof_samples)
+                nof_tile_antennas = data.shape[1]
+                ring_buffer[slot, :, tile_id * nof_tile_antennas: (tile_id + 1) * nof_tile_antennas] = data
+            for channel in range(nof_channels):
+                work_queue.put((slot, block, channel))
+        del ring_buffer
+    finally:
+        ring_memory.close()
+
+
+def _correlation_worker(ring_name, ring_shape, output_name, output_shape, work_queue, done_queue):
+    """ Worker process. Correlates blocks from the ring buffer into the output array until a None item is received """
+
+    ring_memory = shared_memory.SharedMemory(name=ring_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    try:
+        ring_buffer = np.ndarray(ring_shape, dtype=Correlator.complex_8t, buffer=ring_memory.buf)
+        output = np.ndarray(output_shape, dtype=np.complex64, buffer=output_memory.buf)
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+
+            slot, block, channel = item
+            correlate(ring_buffer[slot, channel], output[:, channel, :, block])
+            done_queue.put((slot, block, channel))
+        del ring_buffer, output
+    finally:
+        ring_memory.close()
+        output_memory.close()
 
 
 if __name__ == "__main__":
@@ -261,8 +293,10 @@ if __name__ == "__main__":
                  type='int', help='Number of samples (default: 1048576)')
     p.add_option('-d', '--directory', dest='directory', action='store', default='.',
                  help='If specified, correlate all .dat files in directory (default: None)')
+    p.add_option('-w', '--workers', dest='nof_workers', action='store', default=8,
+                 type='int', help='Number of correlation worker processes (default: 8)')
     opts, args = p.parse_args(sys.argv[1:])
 
     # Create correlator object
-    correlator = Correlator(nof_samples=opts.nof_samples)
+    correlator = Correlator(nof_samples=opts.nof_samples, nof_workers=opts.nof_workers)
     correlator.correlate(opts.directory)
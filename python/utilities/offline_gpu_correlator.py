@@ -15,6 +15,7 @@ import time
 import numpy as np
 
 from pydaq.persisters import FileDAQModes, ChannelFormatFileManager
+from pydaq.correlation import correlate
 
 
 class Complex8t(ctypes.Structure):
@@ -89,14 +90,11 @@ class StandaloneCorrelator(object):
         # Format data as required for xGPU
         gpu_data = np.column_stack((data['real'].flatten(), data['imag'].flatten())).flatten()
 
-        # Format data as required for CPU
-        cpu_data = (data['real'] + 1j * data['imag']).astype(np.complex64)
-
         # Correlate using xGPU
         gpu_result = self.correlate_xgpu(gpu_data)
 
         # Correlate using CPU
-        cpu_result = self.correlate_numpy(cpu_data)
+        cpu_result = self.correlate_numpy(data)
 
         import matplotlib.pyplot as plt
         plt.scatter(list(range(len(cpu_result[:, 0]))), cpu_result[:, 0], marker='x', label='CPU XX')
@@ -147,23 +145,14 @@ class StandaloneCorrelator(object):
     def correlate_numpy(self, data):
         """ Data must be in the following format:
                 [time][channel][antenna][polarization][complexity]
-                Compute in lower triangular form to match xGPU output"""
+                Compute in upper triangular form to match converted xGPU output"""
 
         logging.info("Correlating on CPU")
 
-        nof_baselines = int((self._nof_antennas + 1) * 0.5 * self._nof_antennas)
-        output = np.zeros((nof_baselines, 4), dtype=np.complex64)
-
-        counter = 0
-        for i in range(self._nof_antennas):
-            for j in range(i, self._nof_antennas):
-                output[counter, 0] = np.correlate(data[:, 0, i, 0], data[:, 0, j, 0])[0]
-                output[counter, 1] = np.correlate(data[:, 0, i, 0], data[:, 0, j, 1])[0]
-                output[counter, 2] = np.correlate(data[:, 0, i, 1], data[:, 0, j, 0])[0]
-                output[counter, 3] = np.correlate(data[:, 0, i, 1], data[:, 0, j, 1])[0]
-                counter += 1
+        # Correlate first channel, output is in stokes/baseline order
+        output = correlate(np.transpose(data[:, 0, :, :], (1, 2, 0)))
 
-        return old_div(output, self._nof_samples)
+        return old_div(output.T, self._nof_samples)
 
     def _initialise_library(self, filepath=None):
         """ Wrap AAVS DAQ shared library functionality in ctypes
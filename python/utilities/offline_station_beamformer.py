@@ -5,6 +5,7 @@ from builtins import range
 from past.utils import old_div
 from builtins import object
 from aavs_calibration.common import *
+from aavs_calibration import cache
 
 from datetime import datetime, timedelta
 from astropy.coordinates import Angle
@@ -137,6 +138,7 @@ class ProcessArguments(object):
     coeffs = None
     use_burst = False
     channel = None
+    all_band = False
     pointing_coeffs = None
 
 
@@ -151,6 +153,90 @@ def _signal_handler(signum, frame):
         logging.info("Received interrupt, stopping after current buffer")
 
 
+# Approximate size, in bytes, of the complex sample block buffer for one tile. Sample blocks are
+# beamformed one at a time, so memory per worker is bounded regardless of the number of tiles
+block_buffer_size = 32 * 1024 * 1024
+
+
+class _WorkerState(object):
+    """ Buffers kept for the lifetime of a worker process """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get_buffer(self, name, shape, dtype):
+        """ Get a preallocated buffer, reallocating only if the required shape or type changes """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+
+_worker_state = _WorkerState()
+
+
+def _data_filename(args, timestamp):
+    """ Get the data file name of each tile for a timestamp """
+    d = datetime.fromtimestamp(timestamp)
+    date = d.strftime("%Y%m%d")
+    seconds = '{:0=5d}'.format((d.hour * 60 + d.minute) * 60 + d.second)
+    mode = "burst" if args.use_burst or args.all_band else "cont"
+    return lambda tile: os.path.join(args.directory, r"channel_{}_{}_{}_{}_0.hdf5".format(mode, tile, date, seconds))
+
+
+def _beamform(args, weights, columns, block_shape):
+    """ Beamform the selected tiles of a timestamp, one block of samples at a time. Tile data is read into
+    preallocated buffers, weighted and summed into a beam block, and the beam power is accumulated per block
+    :param args: Process arguments
+    :param weights: Complex weights with shape [antennas] + block_shape[1:-2] + [pols], where block_shape
+                    excludes the samples dimension
+    :param columns: Slice of dataset columns to read
+    :param block_shape: Shape of the data of one sample of one tile, [..., antennas per tile, pols]
+    :return: Beam power summed over samples, with shape block_shape[:-2] + [pols] """
+
+    filename = _data_filename(args, args.timestamp)
+    tiles = [tile for tile in range(args.total_tiles) if tile in args.tiles]
+
+    power = np.zeros(block_shape[:-2] + block_shape[-1:])
+    if len(tiles) == 0:
+        return power
+
+    # Each timestamp is beamformed once, so its files are closed as soon as it is done
+    files = []
+    try:
+        for tile in tiles:
+            files.append(h5py.File(filename(tile), 'r'))
+        datasets = [f['chan_']['data'] for f in files]
+
+        sample_size = int(np.prod(block_shape)) * np.dtype(np.complex64).itemsize
+        block_size = max(1, min(args.nof_samples, block_buffer_size // sample_size))
+        raw = _worker_state.get_buffer('raw', (block_size, columns.stop - columns.start), datasets[0].dtype)
+        data = _worker_state.get_buffer('data', (block_size,) + block_shape, np.complex64)
+        beam = _worker_state.get_buffer('beam', (block_size,) + block_shape[:-2] + block_shape[-1:], np.complex64)
+
+        # Contract the antennas of each tile, keeping samples, any channels and pols
+        subscripts = '...ap,a...p->...p'
+
+        for start in range(0, args.nof_samples, block_size):
+            nof_samples = min(block_size, args.nof_samples - start)
+            beam_block, data_block = beam[:nof_samples], data[:nof_samples]
+            beam_block[:] = 0
+
+            for tile, dataset in zip(tiles, datasets):
+                dataset.read_direct(raw, np.s_[start:start + nof_samples, columns], np.s_[:nof_samples])
+                values = raw[:nof_samples].reshape(data_block.shape)
+                data_block.real, data_block.imag = values['real'], values['imag']
+                beam_block += np.einsum(subscripts, data_block, weights[tile * 16: (tile + 1) * 16])
+
+            power += np.sum(beam_block.real ** 2 + beam_block.imag ** 2, axis=0)
+    finally:
+        for f in files:
+            f.close()
+
+    return power
+
+
 def process_timestamp(args):
     """ Processes tiles in parallel
     @param args: Should be a tuple containing directory, timestamp, tile, nof_samples and coeffs"""
@@ -159,48 +245,27 @@ def process_timestamp(args):
     if np.all(args.pointing_coeffs == 0 + 0j):
         return args.timestamp, 0, 0
 
-    # Load data
-    data = np.zeros(
-        (args.nof_samples, args.total_tiles * 16, 2), dtype=np.complex64)
-    d = datetime.fromtimestamp(args.timestamp)
-    date = d.strftime("%Y%m%d")
-    seconds = '{:0=5d}'.format((d.hour * 60 + d.minute) * 60 + d.second)
-
-    # Grab data from all tiles
-    for tile in range(args.total_tiles):
-        if tile not in args.tiles:
-            continue
-
-        # Use burst channel data 
-        if args.use_burst:
-            filename = r"channel_burst_{}_{}_{}_0.hdf5".format(tile, date, seconds)
-            with h5py.File(os.path.join(args.directory, filename), 'r') as f:
-                read_data = f['chan_']['data'][:args.nof_samples, args.channel * 32: (args.channel + 1) * 32]
-                read_data = read_data.reshape((args.nof_samples, 16, 2))
-                data[:, tile * 16: (tile + 1) * 16, :] = read_data['real'] + read_data['imag'] * 1j
-
-        # Use continuous channel data
-        else:
-            filename = r"channel_cont_{}_{}_{}_0.hdf5".format(tile, date, seconds)
-            with h5py.File(os.path.join(args.directory, filename), 'r') as f:
-                read_data = f['chan_']['data'][:args.nof_samples, :].reshape((args.nof_samples, 16, 2))
-                data[:, tile * 16: (tile + 1) * 16, :] = read_data['real'] + read_data['imag'] * 1j
-
-    # Apply coefficients (if required) and sum current antennas
-    if args.coeffs is None:
-        x = np.sum(np.power(np.abs(np.sum(data[:, :, 0], axis=1)), 2))
-        y = np.sum(np.power(np.abs(np.sum(data[:, :, 1], axis=1)), 2))
-    else:
+    # Generate per antenna and pol weights from coefficients (if required)
+    weights = np.ones((args.total_tiles * 16, 2), dtype=np.complex64)
+    if args.coeffs is not None:
         if len(args.coeffs.shape) == 1:
-            x = np.sum(np.power(np.abs(np.dot(data[:, :, 0], np.multiply(
-                args.coeffs, args.pointing_coeffs[:, 0]))), 2))
-            y = 0
+            weights[:, 0] = np.multiply(args.coeffs, args.pointing_coeffs[:, 0])
+            weights[:, 1] = 0
         else:
-            coeffs_x = np.multiply(args.coeffs[:, 0], args.pointing_coeffs[:, 0])
-            coeffs_y = np.multiply(args.coeffs[:, 1], args.pointing_coeffs[:, 0])
+            weights[:, 0] = np.multiply(args.coeffs[:, 0], args.pointing_coeffs[:, 0])
+            weights[:, 1] = np.multiply(args.coeffs[:, 1], args.pointing_coeffs[:, 0])
 
-            x = np.sum(np.power(np.abs(np.dot(data[:, :, 0], coeffs_x)), 2))
-            y = np.sum(np.power(np.abs(np.dot(data[:, :, 1], coeffs_y)), 2))
+    # Use burst channel data for the selected channel, or continuous channel data
+    if args.use_burst:
+        columns = slice(args.channel * 32, (args.channel + 1) * 32)
+    else:
+        columns = slice(0, 32)
+
+    x, y = _beamform(args, weights, columns, (16, 2))
+
+    # Only X is beamformed if a single pol of coefficients is provided
+    if args.coeffs is not None and len(args.coeffs.shape) == 1:
+        y = 0
 
     return args.timestamp, old_div(x, args.nof_samples), old_div(y, args.nof_samples)
 
@@ -213,35 +278,13 @@ def process_timestamp_multifreq(args):
     if np.all(args.pointing_coeffs == 0 + 0j):
         return args.timestamp, 0, 0
 
-    # Load data
-    data = np.zeros((args.nof_samples, 512, args.total_tiles * 16, 2), dtype=np.complex64)
-    d = datetime.fromtimestamp(args.timestamp)
-    date = d.strftime("%Y%m%d")
-    seconds = '{:0=5d}'.format((d.hour * 60 + d.minute) * 60 + d.second)
-
-    # Grab data from all tiles
-    for tile in range(args.total_tiles):
-        if tile not in args.tiles:
-            continue
+    # Coefficients are in antenna/pol/channel order, apply them as antenna/channel/pol weights
+    weights = np.ascontiguousarray(np.transpose(args.coeffs, (0, 2, 1)), dtype=np.complex64)
 
-        # Use burst channel data 
-        filename = r"channel_burst_{}_{}_{}_0.hdf5".format(tile, date, seconds)
-        with h5py.File(os.path.join(args.directory, filename), 'r') as f:
-            read_data = f['chan_']['data'][:args.nof_samples, :]
-            read_data = read_data.reshape((args.nof_samples, 512, 16, 2))
-            data[:, :, tile * 16: (tile + 1) * 16, :] = read_data['real'] + read_data['imag'] * 1j
+    # Use burst channel data for all channels
+    power = _beamform(args, weights, slice(0, 512 * 32), (512, 16, 2))
 
-    # Loop over all frequency channels
-    x, y = np.zeros(512), np.zeros(512)
-    for i in range(512):
-        # Apply coefficients (if required) and sum current antennas
-        coeffs_x = args.coeffs[:, 0, i]
-        coeffs_y = args.coeffs[:, 1, i]
-
-        x[i] = np.sum(np.power(np.abs(np.dot(data[:, i, :, 0], coeffs_x)), 2))
-        y[i] = np.sum(np.power(np.abs(np.dot(data[:, i, :, 1], coeffs_y)), 2))
-
-    return args.timestamp, old_div(x, args.nof_samples), old_div(y, args.nof_samples)
+    return args.timestamp, old_div(power[:, 0], args.nof_samples), old_div(power[:, 1], args.nof_samples)
 
 
 class OfflineStationBeamformer(object):
@@ -321,7 +364,8 @@ class OfflineStationBeamformer(object):
             else:
                 # Load from database. Amplitudes and phases are in antenna/pol/channel order. Phases are in degrees
                 timestamp = self._times[0][0]
-                amplitude, phase = get_calibration_solution(self._station_id, timestamp - 3600 * 24 * 2)
+                amplitude, phase = cache.get_cache().get_calibration_solution(self._station_id,
+                                                                              timestamp - 3600 * 24 * 2)
 
                 # Select channel and convert to radians
                 if not self._all_band:
@@ -342,7 +386,12 @@ class OfflineStationBeamformer(object):
             plt.ion()
             plt.figure(figsize=(10, 8))
 
-        default_pointing_coeffs = np.ones((self._nof_tiles * 16, 1), dtype=np.complex)
+        default_pointing_coeffs = np.ones((self._nof_tiles * 16, 1), dtype=np.complex64)
+
+        # Worker processes are kept for all time steps, so that they can reuse open files and buffers
+        pool = None
+        if self._nof_processes > 1:
+            pool = Pool(self._nof_processes)
 
         # Go through all time steps
         for i in range(0, len(self._times), self._nof_processes):
@@ -386,10 +435,8 @@ class OfflineStationBeamformer(object):
                 p = process_timestamp_multifreq
 
             # Processes tiles in parallel
-            if self._nof_processes > 1:
-                pool = Pool(self._nof_processes)
+            if pool is not None:
                 result = sorted(pool.map(p, arguments))
-                pool.close()
             else:
                 result = [p(arguments[0])]
 
@@ -425,12 +472,16 @@ class OfflineStationBeamformer(object):
             logging.info("Processed {} of {}, in {:.2f}s".format(
                 i + 1, len(self._times), time.time() - t0))
 
-        # All done, return station beam
+        # All done, stop worker processes and return station beam
+        if pool is not None:
+            pool.close()
+            pool.join()
+
         return station_beam
 
     def _check_station(self):
         """ Check that we have data files for the correct number of tiles """
-        station_info = get_station_information(self._station_id)
+        station_info = cache.get_cache().get_station_information(self._station_id)
 
         if station_info.nof_antennas != self._nof_tiles * 16:
             logging.error(
@@ -551,7 +602,7 @@ if __name__ == "__main__":
                 station_beams.append(station_beam)
 
         # Save station beam and numpy files and exit
-        np.save(opts.output, np.array(station_beams, dtype=np.float))
+        np.save(opts.output, np.array(station_beams, dtype=float))
         exit()
 
     # Pointing options
@@ -584,7 +635,7 @@ if __name__ == "__main__":
     station_beam = beamformer.process()
 
     # Save station beam and numpy files and CSV files
-    np.save(opts.output, np.array(station_beam, dtype=np.float))
+    np.save(opts.output, np.array(station_beam, dtype=float))
 
     if opts.plot:
         _ = input("Processing finished. Press Enter to exit")
@@ -0,0 +1,668 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+import time
+
+import numpy as np
+
+# SPEAD header fields: magic, version, item pointer width and heap address width
+SPEAD_HEADER = 0x53 << 56 | 0x04 << 48 | 0x02 << 40 | 0x06 << 32
+
+# SPEAD item fields
+SPEAD_IMMEDIATE = 1 << 63
+SPEAD_ADDRESS_MASK = (1 << 48) - 1
+
+# Timestamp units used by the DAQ consumers, in seconds
+TIMESTAMP_SCALE = 1.08e-6
+
+# Sampling period of ADC samples, in seconds. Channelised samples are in TIMESTAMP_SCALE units
+ADC_SAMPLE_PERIOD = 1.25e-9
+
+# Bandwidth of a coarse channel, in Hz
+CHANNEL_BANDWIDTH = 400e6 / 512
+
+# Position of the items patched for every frame, in 64-bit words from the start of the packet
+HEAP_COUNTER_WORD = 1
+TIMESTAMP_WORD = 4
+
+# Maximum number of messages sent in a single sendmmsg call (UIO_MAXIOV)
+MAX_BATCH_SIZE = 1024
+
+
+def spead_item(item_id, value, immediate=True):
+    """ Encode a SPEAD item
+    :param item_id: Item identifier
+    :param value: Item value, an immediate value or a payload offset
+    :param immediate: Whether the item is an immediate value
+    :return: 64-bit item """
+    return (SPEAD_IMMEDIATE if immediate else 0) | item_id << 48 | (value & SPEAD_ADDRESS_MASK)
+
+
+class SpeadStream(object):
+    """ Pre-built packet templates for one frame of a SPEAD stream.
+
+    A frame is the set of packets which the TPMs send for one DAQ buffer of a data mode. Packet headers are
+    stored as big-endian 64-bit words, one row per packet, and only the heap counter and timestamp items are
+    patched when generating successive frames. Payloads are shared between packets, so that the memory used
+    by a stream does not grow with the number of tiles. """
+
+    def __init__(self, name, headers, payloads, payload_index, counter_base, counter_step, counter_mask,
+                 timestamp_base, timestamp_step):
+        """ Class constructor
+        :param name: Stream name
+        :param headers: Packet headers, array of uint64 words [packet, word] including the SPEAD header
+        :param payloads: Packet payloads, array of uint8 [payload, byte]
+        :param payload_index: Index of the payload sent with each packet
+        :param counter_base: Heap counter of each packet in the first frame
+        :param counter_step: Heap counter increment between frames
+        :param counter_mask: Mask of heap counter bits in the heap counter item
+        :param timestamp_base: Timestamp of each packet in the first frame, in TIMESTAMP_SCALE units
+        :param timestamp_step: Timestamp increment between frames, in TIMESTAMP_SCALE units """
+
+        self.name = name
+        self.headers = np.ascontiguousarray(headers, dtype='>u8')
+        self.payloads = np.ascontiguousarray(payloads, dtype=np.uint8)
+        self.payload_index = np.asarray(payload_index, dtype=np.int64)
+
+        self._heap_counter_static = self.headers[:, HEAP_COUNTER_WORD].astype(np.uint64) & ~np.uint64(counter_mask)
+        self._counter_base = np.asarray(counter_base, dtype=np.uint64)
+        self._counter_step = counter_step
+        self._counter_mask = np.uint64(counter_mask)
+        self._timestamp_static = self.headers[:, TIMESTAMP_WORD].astype(np.uint64) & ~np.uint64(SPEAD_ADDRESS_MASK)
+        self._timestamp_base = np.asarray(timestamp_base, dtype=np.uint64)
+        self._timestamp_step = timestamp_step
+
+        self.frame = None
+        self.set_frame(0)
+
+    @property
+    def nof_packets(self):
+        return self.headers.shape[0]
+
+    @property
+    def header_size(self):
+        return self.headers.shape[1] * 8
+
+    @property
+    def payload_size(self):
+        return self.payloads.shape[1]
+
+    @property
+    def frame_size(self):
+        """ Number of bytes in a frame, excluding UDP and IP headers """
+        return self.nof_packets * (self.header_size + self.payload_size)
+
+    def set_frame(self, frame):
+        """ Patch heap counters and timestamps in the packet headers for a frame
+        :param frame: Frame number """
+        counters = (self._counter_base + np.uint64(frame * self._counter_step)) & self._counter_mask
+        self.headers[:, HEAP_COUNTER_WORD] = self._heap_counter_static | counters
+
+        timestamps = (self._timestamp_base + np.uint64(int(round(frame * self._timestamp_step)))) & \
+                     np.uint64(SPEAD_ADDRESS_MASK)
+        self.headers[:, TIMESTAMP_WORD] = self._timestamp_static | timestamps
+        self.frame = frame
+
+    def packet(self, index):
+        """ Get a packet of the current frame as bytes
+        :param index: Packet index in the frame """
+        return self.headers[index].tobytes() + self.payloads[self.payload_index[index]].tobytes()
+
+
+def _build_stream(name, items, payload_size, counter_base, counter_step, counter_mask, timestamp_base,
+                  timestamp_step, nof_payloads=16, seed=None):
+    """ Create a stream from per-packet item values
+    :param name: Stream name
+    :param items: List of item columns, each a (item_id, values, immediate) tuple with one value per packet.
+                  The first item must be the heap counter and the fourth the timestamp
+    :param payload_size: Payload size in bytes
+    :param nof_payloads: Number of distinct random payloads
+    :param seed: Seed for payload generation
+    :return: SpeadStream """
+
+    nof_packets = len(counter_base)
+    headers = np.zeros((nof_packets, len(items) + 1), dtype='>u8')
+    headers[:, 0] = SPEAD_HEADER | len(items)
+    for column, (item_id, values, immediate) in enumerate(items):
+        values = np.broadcast_to(np.asarray(values, dtype=np.uint64), (nof_packets,))
+        headers[:, column + 1] = np.uint64(spead_item(item_id, 0, immediate)) | \
+            (values & np.uint64(SPEAD_ADDRESS_MASK))
+
+    rng = np.random.default_rng(seed)
+    payloads = rng.integers(0, 256, (min(nof_payloads, nof_packets), payload_size), dtype=np.uint8)
+
+    return SpeadStream(name, headers, payloads, np.arange(nof_packets) % payloads.shape[0],
+                       counter_base, counter_step, counter_mask, timestamp_base, timestamp_step)
+
+
+def _common_items(payload_size, sync_time, capture_mode):
+    """ Heap counter, payload length, sync time and timestamp items, followed by the capture mode.
+    Consumers stop scanning items for the capture mode before the last item, so it is never placed last """
+    return [(0x0001, 0, True),
+            (0x0004, payload_size, True),
+            (0x1027, sync_time, True),
+            (0x1600, 0, True),
+            (0x2004, capture_mode, True)]
+
+
+def raw_stream(nof_tiles=1, nof_samples=32768, nof_antennas=16, antennas_per_packet=8, payload_size=8192,
+               station_id=0, sync_time=None, capture_mode=0x0, seed=None):
+    """ Raw ADC data stream. A frame contains nof_samples samples for all antennas of all tiles
+    :param nof_tiles: Number of tiles
+    :param nof_samples: Number of samples per antenna in a frame
+    :param nof_antennas: Number of antennas per tile
+    :param antennas_per_packet: Number of antennas in each packet
+    :param payload_size: Payload size in bytes
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param capture_mode: Capture mode, 0x0 for raw data and 0x1 for synchronised raw data
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    samples_per_packet = payload_size // (antennas_per_packet * 2)
+    nof_blocks = nof_samples // samples_per_packet
+
+    block, tile, group = [a.ravel() for a in np.meshgrid(np.arange(nof_blocks), np.arange(nof_tiles),
+                                                         np.arange(nof_antennas // antennas_per_packet),
+                                                         indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, capture_mode) + \
+        [(0x2000, (group * antennas_per_packet) << 8 | antennas_per_packet, True),
+         (0x2001, tile << 32 | station_id << 16, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("raw", items, payload_size, block, nof_blocks, 0xFFFFFF,
+                         np.round(block * samples_per_packet * ADC_SAMPLE_PERIOD / TIMESTAMP_SCALE),
+                         nof_samples * ADC_SAMPLE_PERIOD / TIMESTAMP_SCALE, seed=seed)
+
+
+def burst_channel_stream(nof_tiles=1, nof_channels=512, nof_samples=1024, nof_antennas=16, channels_per_packet=1,
+                         antennas_per_packet=8, payload_size=8192, station_id=0, sync_time=None, seed=None):
+    """ Burst channelised data stream. A frame contains nof_samples samples for all channels and antennas
+    :param nof_tiles: Number of tiles
+    :param nof_channels: Number of channels
+    :param nof_samples: Number of samples per channel in a frame
+    :param nof_antennas: Number of antennas per tile
+    :param channels_per_packet: Number of channels in each packet
+    :param antennas_per_packet: Number of antennas in each packet
+    :param payload_size: Payload size in bytes
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    samples_per_packet = payload_size // (antennas_per_packet * channels_per_packet * 2 * 2)
+    nof_blocks = nof_samples // samples_per_packet
+
+    block, channel, tile, group = [a.ravel() for a in np.meshgrid(np.arange(nof_blocks),
+                                                                  np.arange(nof_channels // channels_per_packet),
+                                                                  np.arange(nof_tiles),
+                                                                  np.arange(nof_antennas // antennas_per_packet),
+                                                                  indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, 0x4) + \
+        [(0x2002, (channel * channels_per_packet) << 24 | channels_per_packet << 16 |
+          (group * antennas_per_packet) << 8 | antennas_per_packet, True),
+         (0x2001, tile << 32 | station_id << 16, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("burst_channel", items, payload_size, block, nof_blocks, 0xFFFFFF,
+                         block * samples_per_packet, nof_samples, seed=seed)
+
+
+def continuous_channel_stream(nof_tiles=1, channel=204, nof_samples=1024, nof_antennas=16, antennas_per_packet=8,
+                              payload_size=8192, station_id=0, sync_time=None, capture_mode=0x5, seed=None):
+    """ Continuous channelised data stream for a single channel. A frame contains nof_samples samples
+    :param nof_tiles: Number of tiles
+    :param channel: Transmitted channel
+    :param nof_samples: Number of samples in a frame, a multiple of the number of samples per packet
+    :param nof_antennas: Number of antennas per tile
+    :param antennas_per_packet: Number of antennas in each packet
+    :param payload_size: Payload size in bytes
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param capture_mode: Capture mode, 0x5 or 0x7
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    samples_per_packet = payload_size // (antennas_per_packet * 2 * 2)
+    nof_blocks = max(1, nof_samples // samples_per_packet)
+
+    block, tile, group = [a.ravel() for a in np.meshgrid(np.arange(nof_blocks), np.arange(nof_tiles),
+                                                         np.arange(nof_antennas // antennas_per_packet),
+                                                         indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, capture_mode) + \
+        [(0x2002, channel << 24 | 1 << 16 | (group * antennas_per_packet) << 8 | antennas_per_packet, True),
+         (0x2001, tile << 32 | station_id << 16, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("continuous_channel", items, payload_size, block, nof_blocks, 0xFFFFFF,
+                         block * samples_per_packet, nof_blocks * samples_per_packet, seed=seed)
+
+
+def integrated_channel_stream(nof_tiles=1, nof_channels=512, nof_antennas=16, channels_per_packet=256,
+                              integration_time=1.0, station_id=0, sync_time=None, seed=None):
+    """ Integrated channel data stream. A frame contains one integrated spectrum for all antennas
+    :param nof_tiles: Number of tiles
+    :param nof_channels: Number of channels
+    :param nof_antennas: Number of antennas per tile
+    :param channels_per_packet: Number of channels in each packet
+    :param integration_time: Integration time in seconds
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    payload_size = channels_per_packet * 2 * 2
+
+    tile, antenna, channel = [a.ravel() for a in np.meshgrid(np.arange(nof_tiles), np.arange(nof_antennas),
+                                                             np.arange(nof_channels // channels_per_packet),
+                                                             indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, 0x6) + \
+        [(0x2002, (channel * channels_per_packet) << 24 | antenna << 8 | 1, True),
+         (0x2001, tile << 32 | station_id << 16, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("integrated_channel", items, payload_size, np.zeros(len(tile)), 1, 0xFFFFFF,
+                         np.zeros(len(tile)), integration_time / TIMESTAMP_SCALE, seed=seed)
+
+
+def tile_beam_stream(nof_tiles=1, nof_channels=384, nof_samples=42, beam_id=0, nof_antennas=16, station_id=0,
+                     sync_time=None, seed=None):
+    """ Tile beam data stream. Each packet contains one sample for all channels of a tile,
+    a frame contains nof_samples packets per tile
+    :param nof_tiles: Number of tiles
+    :param nof_channels: Number of beamformed channels
+    :param nof_samples: Number of samples in a frame
+    :param beam_id: Beam identifier
+    :param nof_antennas: Number of antennas contributing to the beam
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    payload_size = nof_channels * 2 * 2
+
+    sample, tile = [a.ravel() for a in np.meshgrid(np.arange(nof_samples), np.arange(nof_tiles), indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, 0x8) + \
+        [(0x2005, beam_id << 32 | nof_channels, True),
+         (0x2003, tile << 32 | station_id << 16 | nof_antennas, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("tile_beam", items, payload_size, sample, nof_samples, 0xFFFFFF,
+                         sample, nof_samples, seed=seed)
+
+
+def integrated_beam_stream(nof_tiles=1, nof_channels=384, beam_id=0, nof_antennas=16, integration_time=1.0,
+                           station_id=0, sync_time=None, seed=None):
+    """ Integrated tile beam data stream. A frame contains one integrated spectrum per tile, sent as two
+    packets each containing every other channel
+    :param nof_tiles: Number of tiles
+    :param nof_channels: Number of beamformed channels
+    :param beam_id: Beam identifier
+    :param nof_antennas: Number of antennas contributing to the beam
+    :param integration_time: Integration time in seconds
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    channels_per_packet = nof_channels // 2
+    payload_size = channels_per_packet * 2 * 4
+
+    tile, fpga = [a.ravel() for a in np.meshgrid(np.arange(nof_tiles), np.arange(2), indexing='ij')]
+
+    items = _common_items(payload_size, sync_time, 0x9) + \
+        [(0x2005, beam_id << 32 | fpga << 16 | channels_per_packet, True),
+         (0x2003, tile << 32 | station_id << 16 | nof_antennas, True),
+         (0x3300, 0, False)]
+
+    return _build_stream("integrated_beam", items, payload_size, np.zeros(len(tile)), 1, 0xFFFFFF,
+                         np.zeros(len(tile)), integration_time / TIMESTAMP_SCALE, seed=seed)
+
+
+def station_beam_stream(nof_channels=8, start_channel=204, nof_samples=262144, payload_size=8192, beam_id=0,
+                        nof_antennas=256, station_id=0, sync_time=None, seed=None):
+    """ Station beam data stream. A frame contains nof_samples samples for all logical channels
+    :param nof_channels: Number of logical channels
+    :param start_channel: Frequency channel of the first logical channel
+    :param nof_samples: Number of samples in a frame
+    :param payload_size: Payload size in bytes
+    :param beam_id: Beam identifier
+    :param nof_antennas: Number of antennas contributing to the beam
+    :param station_id: Station identifier
+    :param sync_time: Sync time, defaults to now
+    :param seed: Seed for payload generation """
+
+    sync_time = int(time.time()) if sync_time is None else sync_time
+    samples_per_packet = payload_size // (2 * 2)
+    nof_blocks = nof_samples // samples_per_packet
+
+    block, channel = [a.ravel() for a in np.meshgrid(np.arange(nof_blocks), np.arange(nof_channels),
+                                                     indexing='ij')]
+    frequency_id = start_channel + channel
+
+    items = [(0x0001, channel << 32, True),
+             (0x0004, payload_size, True),
+             (0x1027, sync_time, True),
+             (0x1600, 0, True),
+             (0x1011, np.round(frequency_id * CHANNEL_BANDWIDTH).astype(np.uint64), True),
+             (0x3000, beam_id << 16 | frequency_id, True),
+             (0x3001, station_id << 16 | nof_antennas, True),
+             (0x3300, 0, False)]
+
+    return _build_stream("station_beam", items, payload_size, block, nof_blocks, 0xFFFFFFFF,
+                         block * samples_per_packet, nof_samples, seed=seed)
+
+
+# Stream builders for each data mode, taking the number of tiles as their first argument
+STREAM_BUILDERS = {'raw': raw_stream,
+                   'burst_channel': burst_channel_stream,
+                   'continuous_channel': continuous_channel_stream,
+                   'integrated_channel': integrated_channel_stream,
+                   'tile_beam': tile_beam_stream,
+                   'integrated_beam': integrated_beam_stream,
+                   'station_beam': lambda nof_tiles=1, **kwargs: station_beam_stream(**kwargs)}
+
+
+def create_streams(modes, nof_tiles=1, **kwargs):
+    """ Create streams for a list of data modes with default parameters
+    :param modes: List of data modes, keys of STREAM_BUILDERS
+    :param nof_tiles: Number of tiles
+    :param kwargs: Additional arguments passed to all builders """
+    streams = []
+    for mode in modes:
+        if mode not in STREAM_BUILDERS:
+            raise ValueError("Unknown data mode {}, expected one of {}".format(mode, ", ".join(STREAM_BUILDERS)))
+        streams.append(STREAM_BUILDERS[mode](nof_tiles, **kwargs))
+    return streams
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+# numpy layouts of struct iovec and struct mmsghdr, so that message arrays can be built and reordered in bulk
+_IOVEC_DTYPE = np.dtype({'names': ['base', 'len'], 'formats': [np.uintp, np.uintp],
+                         'offsets': [_IoVec.iov_base.offset, _IoVec.iov_len.offset],
+                         'itemsize': ctypes.sizeof(_IoVec)})
+_MMSGHDR_DTYPE = np.dtype({'names': ['iov', 'iovlen'], 'formats': [np.uintp, np.uintp],
+                           'offsets': [_MsgHdr.msg_iov.offset, _MsgHdr.msg_iovlen.offset],
+                           'itemsize': ctypes.sizeof(_MMsgHdr)})
+
+
+def _load_sendmmsg():
+    """ Get the libc sendmmsg function, or None if not available """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+class _StreamMessages(object):
+    """ sendmmsg message array for a stream, each message gathering a packet header and its payload """
+
+    def __init__(self, stream):
+        self.stream = stream
+        nof_packets = stream.nof_packets
+
+        self.iovecs = np.zeros((nof_packets, 2), dtype=_IOVEC_DTYPE)
+        self.iovecs['base'][:, 0] = stream.headers.ctypes.data + np.arange(nof_packets) * stream.header_size
+        self.iovecs['len'][:, 0] = stream.header_size
+        self.iovecs['base'][:, 1] = stream.payloads.ctypes.data + stream.payload_index * stream.payload_size
+        self.iovecs['len'][:, 1] = stream.payload_size
+
+        # Messages are stored as raw bytes, so that reordering copies the whole structures including padding
+        self.messages = np.zeros((nof_packets, _MMSGHDR_DTYPE.itemsize), dtype=np.uint8)
+        fields = self.messages.view(_MMSGHDR_DTYPE)[:, 0]
+        fields['iov'] = self.iovecs.ctypes.data + np.arange(nof_packets) * 2 * _IOVEC_DTYPE.itemsize
+        fields['iovlen'] = 2
+
+        # Messages in transmission order, when packets are dropped or reordered
+        self.scratch = np.zeros_like(self.messages)
+
+
+class SpeadTrafficGenerator(object):
+    """ Sends frames of one or more SPEAD streams to a DAQ receiver.
+
+    Packets are sent in batches with sendmmsg where available, falling back to one send per packet otherwise.
+    Transmission can be rate limited, and packet loss and reordering can be injected to exercise the
+    consumers' handling of imperfect networks. """
+
+    def __init__(self, ip, port, streams, rate=None, loss=0.0, reorder=0.0, reorder_window=16, batch_size=256,
+                 send_buffer_size=16 * 1024 * 1024, seed=None):
+        """ Class constructor
+        :param ip: Destination IP
+        :param port: Destination port
+        :param streams: List of SpeadStream, a frame of each is sent in turn
+        :param rate: Transmission rate in Gb/s, counting SPEAD headers and payloads. None for no limit
+        :param loss: Fraction of packets which are dropped
+        :param reorder: Fraction of packets which are swapped with a later packet
+        :param reorder_window: Maximum distance, in packets, between swapped packets
+        :param batch_size: Maximum number of packets sent in one system call
+        :param send_buffer_size: Socket send buffer size in bytes
+        :param seed: Seed for loss and reorder injection """
+
+        self._streams = streams
+        self._rate = rate
+        self._loss = loss
+        self._reorder = reorder
+        self._reorder_window = reorder_window
+        self._batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self._rng = np.random.default_rng(seed)
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer_size)
+        except OSError as e:
+            logging.warning("Could not set socket send buffer size ({})".format(e))
+        self._socket.connect((ip, port))
+
+        self._sendmmsg = _load_sendmmsg()
+        if self._sendmmsg is None:
+            logging.warning("sendmmsg not available, sending one packet per system call")
+        self._messages = [_StreamMessages(stream) for stream in streams]
+
+        self._frame = 0
+        self._start_time = None
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_dropped = 0
+        self.packets_reordered = 0
+        self.send_errors = 0
+
+    def send_frame(self):
+        """ Send the next frame of every stream """
+        if self._start_time is None:
+            self._start_time = time.time()
+
+        for messages in self._messages:
+            messages.stream.set_frame(self._frame)
+            order = self._transmission_order(messages.stream.nof_packets)
+            self._send_stream(messages, order)
+
+        self._frame += 1
+
+    def run(self, nof_frames=None, duration=None, period=None):
+        """ Send frames until the number of frames or duration is reached
+        :param nof_frames: Number of frames to send, None for no limit
+        :param duration: Time in seconds after which to stop, None for no limit
+        :param period: Minimum time in seconds between the start of successive frames """
+        start = time.time()
+        sent = 0
+        while (nof_frames is None or sent < nof_frames) and (duration is None or time.time() - start < duration):
+            frame_start = time.time()
+            self.send_frame()
+            sent += 1
+            if period is not None:
+                time.sleep(max(0, period - (time.time() - frame_start)))
+
+    def statistics(self):
+        """ Get transmission statistics """
+        elapsed = 0 if self._start_time is None else time.time() - self._start_time
+        return {'frames_sent': self._frame,
+                'packets_sent': self.packets_sent,
+                'bytes_sent': self.bytes_sent,
+                'packets_dropped': self.packets_dropped,
+                'packets_reordered': self.packets_reordered,
+                'send_errors': self.send_errors,
+                'elapsed': elapsed,
+                'packet_rate': self.packets_sent / elapsed if elapsed > 0 else 0,
+                'data_rate_gbps': self.bytes_sent * 8 / elapsed / 1e9 if elapsed > 0 else 0}
+
+    def close(self):
+        """ Close the socket """
+        self._socket.close()
+
+    def _transmission_order(self, nof_packets):
+        """ Get the order in which the packets of a frame are sent, after loss and reorder injection
+        :param nof_packets: Number of packets in the frame
+        :return: Array of packet indices, or None to send all packets in order """
+        if self._loss <= 0 and self._reorder <= 0:
+            return None
+
+        order = np.arange(nof_packets)
+        if self._reorder > 0 and nof_packets > 1:
+            swapped = np.flatnonzero(self._rng.random(nof_packets - 1) < self._reorder)
+            distance = self._rng.integers(1, self._reorder_window + 1, len(swapped))
+            for index, other in zip(swapped, np.minimum(swapped + distance, nof_packets - 1)):
+                order[index], order[other] = order[other], order[index]
+            self.packets_reordered += len(swapped)
+
+        if self._loss > 0:
+            kept = self._rng.random(nof_packets) >= self._loss
+            self.packets_dropped += nof_packets - int(np.count_nonzero(kept))
+            order = order[kept]
+
+        return order
+
+    def _send_stream(self, messages, order):
+        """ Send the packets of a stream frame
+        :param messages: Stream messages
+        :param order: Packet transmission order, None for all packets in order """
+        stream = messages.stream
+        packet_size = stream.header_size + stream.payload_size
+
+        if self._sendmmsg is None:
+            for index in (range(stream.nof_packets) if order is None else order):
+                self._send_packet(stream, index)
+                self._throttle()
+            return
+
+        if order is None:
+            to_send = messages.messages
+        else:
+            to_send = messages.scratch[:len(order)]
+            np.take(messages.messages, order, axis=0, out=to_send)
+
+        address = to_send.ctypes.data
+        position, total = 0, len(to_send)
+        while position < total:
+            count = min(self._batch_size, total - position)
+            result = self._sendmmsg(self._socket.fileno(), address + position * _MMSGHDR_DTYPE.itemsize, count, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error not in (errno.EAGAIN, errno.ENOBUFS, errno.EINTR, errno.ECONNREFUSED):
+                    raise OSError(error, "sendmmsg failed: {}".format(errno.errorcode.get(error, error)))
+                self.send_errors += 1
+                if error == errno.ENOBUFS:
+                    time.sleep(0.0001)
+                continue
+
+            position += result
+            self.packets_sent += result
+            self.bytes_sent += result * packet_size
+            self._throttle()
+
+    def _send_packet(self, stream, index):
+        """ Send a single packet with a gathering send
+        :param stream: Stream
+        :param index: Packet index in the current frame """
+        try:
+            self._socket.sendmsg([stream.headers[index], stream.payloads[stream.payload_index[index]]])
+        except (BlockingIOError, ConnectionRefusedError, InterruptedError):
+            self.send_errors += 1
+            return
+        self.packets_sent += 1
+        self.bytes_sent += stream.header_size + stream.payload_size
+
+    def _throttle(self):
+        """ Wait until the bytes sent so far are within the configured rate """
+        if self._rate is None or self._rate <= 0:
+            return
+        ahead = self._start_time + self.bytes_sent * 8 / (self._rate * 1e9) - time.time()
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+if __name__ == "__main__":
+
+    # Use OptionParse to get command-line arguments
+    from optparse import OptionParser
+    from sys import argv
+
+    parser = OptionParser(usage="usage: %spead_traffic_generator [options]")
+
+    parser.add_option("-m", "--modes", action="store", dest="modes", default="integrated_channel",
+                      help="Comma-separated data modes to generate, from {} [default: integrated_channel]".format(
+                          ", ".join(STREAM_BUILDERS)))
+    parser.add_option("-t", "--nof_tiles", action="store", dest="nof_tiles",
+                      type="int", default=1, help="Number of tiles to simulate [default: 1]")
+    parser.add_option("--ip", action="store", dest="ip", default="127.0.0.1",
+                      help="IP to send packets to (default: 127.0.0.1)")
+    parser.add_option("-p", "--port", action="store", dest="port", default=4660, type=int,
+                      help="Port to send packets to (default: 4660)")
+    parser.add_option("-r", "--rate", action="store", dest="rate", default=0, type=float,
+                      help="Transmission rate in Gb/s, 0 for no limit (default: 0)")
+    parser.add_option("--loss", action="store", dest="loss", default=0, type=float,
+                      help="Fraction of packets to drop (default: 0)")
+    parser.add_option("--reorder", action="store", dest="reorder", default=0, type=float,
+                      help="Fraction of packets to swap with a later packet (default: 0)")
+    parser.add_option("--reorder_window", action="store", dest="reorder_window", default=16, type=int,
+                      help="Maximum distance between swapped packets (default: 16)")
+    parser.add_option("--batch_size", action="store", dest="batch_size", default=256, type=int,
+                      help="Number of packets sent per system call (default: 256)")
+    parser.add_option("-n", "--nof_frames", action="store", dest="nof_frames", default=None, type=int,
+                      help="Number of frames to send (default: no limit)")
+    parser.add_option("-d", "--duration", action="store", dest="duration", default=None, type=float,
+                      help="Time in seconds for which to send (default: no limit)")
+    parser.add_option("-P", "--period", action="store", dest="period", default=None, type=float,
+                      help="Minimum time in seconds between frames (default: none)")
+
+    (conf, args) = parser.parse_args(argv[1:])
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+
+    generator = SpeadTrafficGenerator(conf.ip, conf.port,
+                                      create_streams(conf.modes.split(','), conf.nof_tiles),
+                                      rate=conf.rate, loss=conf.loss, reorder=conf.reorder,
+                                      reorder_window=conf.reorder_window, batch_size=conf.batch_size)
+
+    try:
+        generator.run(nof_frames=conf.nof_frames, duration=conf.duration, period=conf.period)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for key, value in generator.statistics().items():
+            logging.info("{}: {}".format(key, value))
+        generator.close()
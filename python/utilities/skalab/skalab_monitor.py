@@ -12,6 +12,7 @@ from hardware_client import WebHardwareClient
 from skalab_base import SkalabBase
 from skalab_log import SkalabLog
 from skalab_utils import dt_to_timestamp, ts_to_datestring, parse_profile, COLORI, Led, getTextFromFile, colors
+from skalab_utils import TelemetryArchive
 from threading import Thread, Event, Lock
 from time import sleep
 from future.utils import iteritems
@@ -649,7 +650,7 @@ class Monitor(TileInitialization):
                     if  os.path.exists(str(Path.home()) + fname) != True:
                         os.makedirs(str(Path.home()) + fname)
                 fname += datetime.datetime.strftime(datetime.datetime.utcnow(), "monitor_tlm_%Y-%m-%d_%H%M%S.h5")
-                self.tlm_hdf_monitor = h5py.File(str(Path.home()) + fname, 'a')
+                self.tlm_hdf_monitor = TelemetryArchive(str(Path.home()) + fname, 'a')
                 return self.tlm_hdf_monitor
             else:
                 msgBox = QtWidgets.QMessageBox()
@@ -661,17 +662,11 @@ class Monitor(TileInitialization):
 
     def saveTlm(self,data_tile):
         if self.tlm_hdf_monitor:
-            for attr in self.tile_table_attr:
-                data_tile[attr][:] = [0.0 if type(x) is str else x for x in data_tile[attr]]
-                if attr not in self.tlm_hdf_monitor:
-                    try:
-                        self.tlm_hdf_monitor.create_dataset(attr, data=np.asarray([data_tile[attr]]), chunks = True, maxshape =(None,None))
-                    except:
-                        self.logger.error("WRITE TLM ERROR in ", attr, "\nData: ", data_tile[attr])
-                else:
-                    self.tlm_hdf_monitor[attr].resize((self.tlm_hdf_monitor[attr].shape[0] +
-                                                np.asarray([self.tlm_hdf_monitor[attr]]).shape[0]), axis=0)
-                    self.tlm_hdf_monitor[attr][self.tlm_hdf_monitor[attr].shape[0]-1]=np.asarray([data_tile[attr]])                            
+            try:
+                self.tlm_hdf_monitor.append({attr: data_tile[attr] for attr in self.tile_table_attr
+                                             if attr in data_tile})
+            except Exception as e:
+                self.logger.error("Could not write telemetry to HDF5 file: %s" % e)
 
     def closeEvent(self, event):
         result = QtWidgets.QMessageBox.question(self,
@@ -14,10 +14,10 @@ import configparser
 import numpy as np
 from PyQt5 import QtWidgets, uic, QtCore, QtGui
 from PyQt5.QtCore import Qt
-from skalab_utils import dB2Linear, linear2dB, MiniPlots, read_data, dircheck, findtiles, calc_disk_usage
-from skalab_utils import calcolaspettro, closest, parse_profile, getTextFromFile, moving_average
+from skalab_utils import dB2Linear, linear2dB, MiniPlots, dircheck, findtiles, calc_disk_usage
+from skalab_utils import calcola_spettri, closest, parse_profile, getTextFromFile, moving_average
+from skalab_utils import PlaybackDataset, DEFAULT_PLAYBACK_MEMORY, DEFAULT_PLAYBACK_PREFETCH
 from pyaavs import station
-from pydaq.persisters import FileDAQModes, RawFormatFileManager
 COLORI = ["b", "g"]
 
 default_app_dir = str(Path.home()) + "/.skalab/"
@@ -148,6 +148,15 @@ class Playback(SkalabBase):
         self.raw = {}
         self.rms = {}
 
+        # Linear spectra [files, inputs, pols, channels], RF power and ADU RMS [files, inputs, pols] of the loaded
+        # data, preallocated when loading and filled one file at a time with a single batched FFT per file
+        self.spectra = None
+        self.spectra_rfpower = None
+        self.spectra_rms = None
+        self.spectra_timestamp = None
+        self.spectra_clip = None
+        self.spectra_nsamples = 0
+
         # Show only the first plot view
         self.wg.qplot_spectra.show()
         self.wg.qplot_spectrogram.hide()
@@ -256,35 +265,46 @@ class Playback(SkalabBase):
     def load_data(self):
         if not self.wg.qline_datapath.text() == "":
             if os.path.isdir(self.wg.qline_datapath.text()):
-                lista = sorted(glob.glob(self.wg.qline_datapath.text() + "/raw_burst_%d_*hdf5" % int(
-                    self.data_tiles[self.wg.qcombo_tpm.currentIndex()])))
-                self.nof_files = len(lista)
+                if isinstance(self.data, PlaybackDataset):
+                    self.data.close()
+                self.data = []
+                self.spectra = None
+                gc.collect()
+                # Files are only indexed here, captures are read on demand within the profile memory limit
+                dataset = PlaybackDataset(directory=self.wg.qline_datapath.text(),
+                                          tile=self.data_tiles[self.wg.qcombo_tpm.currentIndex()],
+                                          max_memory=float(self.profile['Playback'].get('memory_limit',
+                                                                                        DEFAULT_PLAYBACK_MEMORY)),
+                                          prefetch=int(self.profile['Playback'].get('prefetch_files',
+                                                                                    DEFAULT_PLAYBACK_PREFETCH)))
+                self.nof_files = len(dataset)
                 if self.nof_files:
                     progress_format = "TILE-%02d   " % (self.data_tiles[self.wg.qcombo_tpm.currentIndex()] + 1) + "%p%"
                     self.wg.qprogress_load.setFormat(progress_format)
 
-                    file_manager = RawFormatFileManager(root_path=self.wg.qline_datapath.text(),
-                                                        daq_mode=FileDAQModes.Burst)
-                    del self.data
-                    gc.collect()
-                    self.data = []
-                    for nn, l in enumerate(lista):
-                        # Call the data Load
-                        t, d = read_data(fmanager=file_manager,
-                                         hdf5_file=l,
-                                         tile=self.data_tiles[self.wg.qcombo_tpm.currentIndex()],
-                                         nof_tiles=self.nof_tiles)
-                        if t:
-                            self.data += [{'timestamp': t, 'data': d}]
-                        self.wg.qprogress_load.setValue(int((nn + 1) * 100 / len(lista)))
+                    self.data = dataset
+                    self.set_resolution()
+                    failed = []
+                    for k in range(self.nof_files):
+                        if not self.process_spectra(k):
+                            failed.append(os.path.basename(self.data.files[k]))
+                        self.wg.qprogress_load.setValue(int((k + 1) * 100 / self.nof_files))
+                    if failed:
+                        msgBox = QtWidgets.QMessageBox()
+                        msgBox.setText("Could not read %d of %d files, they are left blank in the plots:\n%s" %
+                                       (len(failed), self.nof_files, "\n".join(failed)))
+                        msgBox.setWindowTitle("Warning!")
+                        msgBox.setIcon(QtWidgets.QMessageBox.Warning)
+                        msgBox.exec_()
                     self.wg.qline_sample_start.setText("1")
-                    self.wg.qline_sample_stop.setText("%d" % len(lista))
-                    self.wg.qline_avg_sample_stop.setText("%d" % len(lista))
-                    self.wg.qline_power_sample_stop.setText("%d" % len(lista))
-                    self.wg.qline_rms_sample_stop.setText("%d" % len(lista))
+                    self.wg.qline_sample_stop.setText("%d" % self.nof_files)
+                    self.wg.qline_avg_sample_stop.setText("%d" % self.nof_files)
+                    self.wg.qline_power_sample_stop.setText("%d" % self.nof_files)
+                    self.wg.qline_rms_sample_stop.setText("%d" % self.nof_files)
                     self.wg.qlabel_raw_filenum.setText("Select File Number (%d-%d)" % (1, self.nof_files))
                     self.wg.qline_raw_filenum.setText("1")
                 else:
+                    dataset.close()
                     self.wg.qlabel_raw_filenum.setText("Select File Number (#)")
                     self.wg.qline_raw_filenum.setText("0")
             else:
@@ -298,10 +318,7 @@ class Playback(SkalabBase):
             msgBox.setWindowTitle("Error!")
             msgBox.exec_()
 
-    def plot_data(self):
-        if not self.wg.qline_channels.text() == self.channels_line:
-            self.reformat_plots()
-
+    def set_resolution(self):
         self.resolutions = 2 ** np.array(range(16)) * (800000.0 / 2 ** 15)
         if self.wg.qradio_spectrogram.isChecked():
             self.rbw = int(closest(self.resolutions, float(self.wg.qline_spg_rbw.text())))
@@ -314,6 +331,52 @@ class Playback(SkalabBase):
         self.RBW = (self.avg * (400000.0 / 16384.0))
         self.asse_x = np.arange(self.nsamples / 2 + 1) * self.RBW * 0.001
 
+    def process_spectra(self, k):
+        """ Compute spectra, RF power, ADU RMS and ADC clipping of all inputs and pols of a file at the current
+        resolution. Rows of files which could not be read are left as NaN
+        :param k: Index of the file in the loaded data
+        :return: True if the file was read """
+        capture = self.data[k]
+        if capture is None:
+            self.logger.warning("Could not read %s" % self.data.files[k])
+            return False
+        d = capture['data']
+        if self.spectra is None or self.spectra_nsamples != self.nsamples:
+            self.spectra = np.full((self.nof_files, d.shape[0], d.shape[1], self.nsamples // 2 + 1), np.nan,
+                                   dtype=np.float32)
+            self.spectra_rfpower = np.full((self.nof_files, d.shape[0], d.shape[1]), np.nan)
+            self.spectra_rms = np.full((self.nof_files, d.shape[0], d.shape[1]), np.nan)
+            self.spectra_timestamp = np.array(self.data.timestamps)
+            self.spectra_clip = np.zeros((self.nof_files, d.shape[0], d.shape[1]), dtype=bool)
+            self.spectra_nsamples = self.nsamples
+        spettri, rfpower, rms = calcola_spettri(d, self.nsamples, log=False)
+        self.spectra[k] = spettri
+        self.spectra_rfpower[k] = rfpower
+        self.spectra_rms[k] = rms
+        self.spectra_timestamp[k] = capture['timestamp']
+        self.spectra_clip[k] = np.any(d == 127, axis=-1) | np.any(d == -128, axis=-1)
+        return True
+
+    def update_spectra(self):
+        """ Recompute the spectra of the loaded files if the resolution changed since they were loaded """
+        if not len(self.data) or (self.spectra is not None and self.spectra_nsamples == self.nsamples):
+            return
+        self.spectra = None
+        for k in range(len(self.data)):
+            self.process_spectra(k)
+            self.wg.qprogress_plot.setValue(int((k + 1) * 100 / len(self.data)))
+
+    def plot_data(self):
+        if not self.wg.qline_channels.text() == self.channels_line:
+            self.reformat_plots()
+
+        self.set_resolution()
+        self.update_spectra()
+        if self.spectra is None:
+            # None of the loaded files could be read
+            return
+        inputs = np.array(self.input_list) - 1
+
         if self.wg.qradio_spectrogram.isChecked():
             self.wg.qcheck_rms.setEnabled(False)
             xAxisRange = (float(self.wg.qline_spg_band_from.text()),
@@ -325,28 +388,20 @@ class Playback(SkalabBase):
             pol = 0
             if self.wg.qcheck_ypol_spg.isChecked():
                 pol = 1
-            if not self.data == []:
+            if len(self.data):
                 self.miniPlots.plotClear()
-                allspgram = []
-                gc.collect()
                 wclim = (int(self.wg.qline_spg_color_min.text()), int(self.wg.qline_spg_color_max.text()))
-                for n in range(len(self.input_list)):
-                    allspgram += [[]]
-                    allspgram[n] = np.empty((3, xmax - xmin + 1,))
-                    allspgram[n][:] = np.nan
                 t_start = int(self.wg.qline_sample_start.text())
                 t_stop = int(self.wg.qline_sample_stop.text())
-                for k in range(t_start, t_stop):
-                    for num, tpm_input in enumerate(self.input_list):
-                        spettro, rfpow, rms = calcolaspettro(self.data[k]['data'][tpm_input - 1, pol, :], self.nsamples)
-                        allspgram[num] = np.concatenate((allspgram[num], [spettro[xmin:xmax + 1]]), axis=0)
-                    self.wg.qprogress_plot.setValue(int((k - t_start + 1) * 100 / (t_stop - t_start)))
+                # Spectrogram rows are read from the spectra computed while loading, as [files, inputs, channels]
+                with np.errstate(divide='ignore'):
+                    allspgram = linear2dB(self.spectra[t_start:t_stop, inputs, pol, xmin:xmax + 1])
+                self.wg.qprogress_plot.setValue(100)
                 for num, tpm_input in enumerate(self.input_list):
-                    first_empty, allspgram[num] = allspgram[num][:3], allspgram[num][3:]
-                    self.spectrogramPlots.plotSpectrogram(spettrogramma=allspgram[num], ant=num, ytickstep=yticksteps,
-                                                          xmin=t_start, xmax=t_stop, startfreq=xAxisRange[0],
-                                                          stopfreq=xAxisRange[1], title="INPUT-%02d" % int(tpm_input),
-                                                          wclim=wclim)
+                    self.spectrogramPlots.plotSpectrogram(spettrogramma=allspgram[:, num], ant=num,
+                                                          ytickstep=yticksteps, xmin=t_start, xmax=t_stop,
+                                                          startfreq=xAxisRange[0], stopfreq=xAxisRange[1],
+                                                          title="INPUT-%02d" % int(tpm_input), wclim=wclim)
                 self.spectrogramPlots.updatePlot()
                 self.wg.qbutton_save.setEnabled(True)
 
@@ -354,31 +409,22 @@ class Playback(SkalabBase):
             lw = 1
             if self.wg.qcheck_spectra_noline.isChecked():
                 lw = 0
-            if not self.data == []:
+            if len(self.data):
                 #self.miniPlots.plotClear()
-                spettri_x = [np.zeros(len(self.asse_x))] * len(self.input_list)
-                rms_x = [0] * len(self.input_list)
-                spettri_y = [np.zeros(len(self.asse_x))] * len(self.input_list)
-                # rms_y = [[] for _ in range(len(self.input_list))]
-                rms_y = [0] * len(self.input_list)
-                avgnum = int(self.wg.qline_avg_sample_stop.text()) - int(self.wg.qline_avg_sample_start.text())
-                for k in range(int(self.wg.qline_avg_sample_start.text())-1,
-                               int(self.wg.qline_avg_sample_stop.text())-1):
-                    for n, i in enumerate(self.input_list):
-                        # Plot X Pol
-                        spettro, rfpow, rms = calcolaspettro(self.data[k]['data'][i - 1, 0, :], self.nsamples)
-                        spettri_x[n] = np.add(spettri_x[n], dB2Linear(spettro))
-                        rms_x[n] = np.add(rms_x[n], dB2Linear(rfpow))
-
-                        # Plot Y Pol
-                        spettro, rfpow, rms = calcolaspettro(self.data[k]['data'][i - 1, 1, :], self.nsamples)
-                        spettri_y[n] = np.add(spettri_y[n], dB2Linear(spettro))
-                        rms_y[n] = np.add(rms_y[n], dB2Linear(rfpow))
-                    self.wg.qprogress_plot.setValue(int((k + 1) * 100 / avgnum))
+                avg_start = int(self.wg.qline_avg_sample_start.text()) - 1
+                avg_stop = int(self.wg.qline_avg_sample_stop.text()) - 1
+                # Average the linear spectra and RF power of the selected files, as [inputs, pols, ...]. Files which
+                # could not be read are NaN and left out of the average
+                spettri = np.nanmean(self.spectra[avg_start:avg_stop, inputs], axis=0, dtype=np.float64)
+                rfpower = np.nanmean(dB2Linear(self.spectra_rfpower[avg_start:avg_stop, inputs]), axis=0)
+                self.wg.qprogress_plot.setValue(100)
+                with np.errstate(divide='ignore'):
+                    spettri = linear2dB(spettri)
+                    rfpower = linear2dB(rfpower)
                 for n, i in enumerate(self.input_list):
                     # Plot X Pol
-                    spettro = linear2dB(spettri_x[n] / avgnum)
-                    rms = linear2dB(rms_x[n] / avgnum)
+                    spettro = spettri[n, 0]
+                    rms = rfpower[n, 0]
                     self.miniPlots.plotCurve(self.asse_x, spettro, n, xAxisRange=self.xAxisRange,
                                              yAxisRange=self.yAxisRange, title="INPUT-%02d" % i,
                                              xLabel="MHz", yLabel="dB", colore="b", rfpower=rms,
@@ -386,8 +432,8 @@ class Playback(SkalabBase):
                                              show_line=self.wg.qcheck_xpol_sp.isChecked(),
                                              rms_position=float(self.wg.qline_rms_pos.text()))
                     # Plot Y Pol
-                    spettro = linear2dB(spettri_y[n] / avgnum)
-                    rms = linear2dB(rms_y[n] / self.nof_files)
+                    spettro = spettri[n, 1]
+                    rms = rfpower[n, 1]
                     self.miniPlots.plotCurve(self.asse_x, spettro, n, xAxisRange=self.xAxisRange,
                                              yAxisRange=self.yAxisRange, colore="g", rfpower=rms,
                                              annotate_rms=self.show_rms, grid=self.show_spectra_grid, lw=lw,
@@ -412,7 +458,7 @@ class Playback(SkalabBase):
                 lw = 1
                 if self.wg.qcheck_power_noline.isChecked():
                     lw = 0
-                if not self.data == []:
+                if len(self.data):
                     xAxisRange = (float(self.wg.qline_power_sample_start.text()),
                                   float(self.wg.qline_power_sample_stop.text()))
                     yAxisRange = (float(self.wg.qline_power_level_min.text()),
@@ -423,19 +469,16 @@ class Playback(SkalabBase):
                             self.power["Input-%02d_%s" % (i, pol)] = []
                             self.power["Input-%02d_%s_adc-clip" % (i, pol)] = []
                     self.power_x = []
+                    band_from = closest(self.asse_x, float(self.wg.qline_power_band_from.text()))
+                    band_to = closest(self.asse_x, float(self.wg.qline_power_band_to.text()))
                     for k in range(self.nof_files):
-                        self.power_x += [self.data[k]['timestamp']]
+                        self.power_x += [self.spectra_timestamp[k]]
                         for n, i in enumerate(self.input_list):
                             for npol, pol in enumerate(["Pol-X", "Pol-Y"]):
-                                if 127 in self.data[k]['data'][i - 1, npol, :] or \
-                                        -128 in self.data[k]['data'][i - 1, npol, :]:
-                                    self.power["Input-%02d_%s_adc-clip" % (i, pol)] += [self.data[k]['timestamp']]
-                                spettro, rfpow, rms = calcolaspettro(self.data[k]['data'][i - 1, npol, :], self.nsamples, log=False)
-                                bandpower = np.sum(spettro[closest(self.asse_x, float(self.wg.qline_power_band_from.text())): closest(self.asse_x, float(self.wg.qline_power_band_to.text()))])
-                                if not len(self.power["Input-%02d_%s" % (i, pol)]):
-                                    self.power["Input-%02d_%s" % (i, pol)] = [linear2dB(bandpower)]
-                                else:
-                                    self.power["Input-%02d_%s" % (i, pol)] += [linear2dB(bandpower)]
+                                if self.spectra_clip[k, i - 1, npol]:
+                                    self.power["Input-%02d_%s_adc-clip" % (i, pol)] += [self.spectra_timestamp[k]]
+                                bandpower = np.sum(self.spectra[k, i - 1, npol, band_from:band_to], dtype=np.float64)
+                                self.power["Input-%02d_%s" % (i, pol)] += [linear2dB(bandpower)]
                         self.wg.qprogress_plot.setValue(int((k + 1) * 100 / self.nof_files))
 
                     if not self.wg.qcheck_datetime.isChecked():
@@ -482,7 +525,7 @@ class Playback(SkalabBase):
                 if self.wg.qcheck_raw_noline.isChecked():
                     lw = 0
                     msize = 1
-                if not self.data == []:
+                if len(self.data):
                     xAxisRange = (float(self.wg.qline_raw_start.text()),
                                   float(self.wg.qline_raw_stop.text()))
                     yAxisRange = (float(self.wg.qline_raw_min.text()),
@@ -493,12 +536,14 @@ class Playback(SkalabBase):
                             self.raw["Input-%02d_%s" % (i, pol)] = []
                             self.raw["Input-%02d_%s_adc-clip" % (i, pol)] = []
                     for k in [int(self.wg.qline_raw_filenum.text()) - 1]:
+                        capture = self.data[k]
                         for n, i in enumerate(self.input_list):
                             for npol, pol in enumerate(["Pol-X", "Pol-Y"]):
-                                if 127 in self.data[k]['data'][i - 1, npol, :] or \
-                                        -128 in self.data[k]['data'][i - 1, npol, :]:
-                                    self.raw["Input-%02d_%s_adc-clip" % (i, pol)] += [self.data[k]['timestamp']]
-                                self.raw["Input-%02d_%s" % (i, pol)] = self.data[k]['data'][i - 1, npol, :]
+                                if capture is None:
+                                    continue
+                                if self.spectra_clip[k, i - 1, npol]:
+                                    self.raw["Input-%02d_%s_adc-clip" % (i, pol)] += [capture['timestamp']]
+                                self.raw["Input-%02d_%s" % (i, pol)] = capture['data'][i - 1, npol, :]
                     for n, i in enumerate(self.input_list):
                         self.rawPlots.plotCurve(np.arange(len(self.raw["Input-%02d_Pol-X" % i])),
                                                  self.raw["Input-%02d_Pol-X" % i], n, xAxisRange=xAxisRange,
@@ -527,7 +572,7 @@ class Playback(SkalabBase):
             lw = 1
             if self.wg.qcheck_rms_noline.isChecked():
                 lw = 0
-            if not self.data == []:
+            if len(self.data):
                 xAxisRange = (float(self.wg.qline_rms_sample_start.text()),
                               float(self.wg.qline_rms_sample_stop.text()))
                 if self.wg.qcheck_raw_dbm.isChecked():
@@ -540,18 +585,11 @@ class Playback(SkalabBase):
                 self.rmsPlots.plotClear()
                 for n, i in enumerate(self.input_list):
                     for npol, pol in enumerate(["Pol-X", "Pol-Y"]):
-                        self.rms["Input-%02d_%s" % (i, pol)] = []
-                for k in range(self.nof_files):
-                    for n, i in enumerate(self.input_list):
-                        for npol, pol in enumerate(["Pol-X", "Pol-Y"]):
-                            spettro, rfpow, rms = calcolaspettro(self.data[k]['data'][i - 1, npol, :], self.nsamples,
-                                                                 log=False)
-                            #print("FILE:", k, "INPUT:", i-1, "POL:", pol, "RMS:", rms)
-                            if self.wg.qcheck_raw_dbm.isChecked():
-                                self.rms["Input-%02d_%s" % (i, pol)] = np.append(self.rms["Input-%02d_%s" % (i, pol)], rfpow)
-                            else:
-                                self.rms["Input-%02d_%s" % (i, pol)] = np.append(self.rms["Input-%02d_%s" % (i, pol)], rms)
-                    self.wg.qprogress_plot.setValue(int((k + 1) * 100 / self.nof_files))
+                        if self.wg.qcheck_raw_dbm.isChecked():
+                            self.rms["Input-%02d_%s" % (i, pol)] = self.spectra_rfpower[:len(self.data), i - 1, npol]
+                        else:
+                            self.rms["Input-%02d_%s" % (i, pol)] = self.spectra_rms[:len(self.data), i - 1, npol]
+                self.wg.qprogress_plot.setValue(100)
 
                 for n, i in enumerate(self.input_list):
                     # Plot X Pol
@@ -13,7 +13,7 @@ import configparser
 from PyQt5 import QtWidgets, uic, QtCore, QtGui
 from hardware_client import WebHardwareClient
 from skalab_utils import BarPlot, ChartPlots, colors, dt_to_timestamp
-from skalab_utils import ts_to_datestring, parse_profile, COLORI, getTextFromFile
+from skalab_utils import ts_to_datestring, parse_profile, COLORI, getTextFromFile, TelemetryArchive
 from threading import Thread
 from time import sleep
 import datetime
@@ -479,7 +479,7 @@ class Subrack(SkalabBase):
             if not fname[-1] == "/":
                 fname = fname + "/"
             fname += datetime.datetime.strftime(datetime.datetime.utcnow(), "subrack_tlm_%Y-%m-%d_%H%M%S.h5")
-            return h5py.File(fname, 'a')
+            return TelemetryArchive(fname, 'a')
         else:
             msgBox = QtWidgets.QMessageBox()
             msgBox.setText("Please Select a valid path to save the Subrack data and save it into the current profile")
@@ -646,7 +646,7 @@ class Subrack(SkalabBase):
                 if  os.path.exists(str(Path.home()) + fname) != True:
                     os.makedirs(str(Path.home()) + fname)
             fname += datetime.datetime.strftime(datetime.datetime.utcnow(), "subrack_tlm_%Y-%m-%d_%H%M%S.h5")
-            return h5py.File(str(Path.home()) + fname, 'a')
+            return TelemetryArchive(str(Path.home()) + fname, 'a')
         else:
             msgBox = QtWidgets.QMessageBox()
             msgBox.setText("Please Select a valid path to save the Subrack data and save it into the current profile")
@@ -722,25 +722,10 @@ class Subrack(SkalabBase):
 
     def writeTlm(self):
         if self.tlm_hdf is not None:
-            for tlmk in self.telemetry.keys():
-                if tlmk not in self.tlm_hdf:
-                    try:
-                        if type(self.telemetry[tlmk]) is list:
-                            self.tlm_hdf.create_dataset(tlmk, data=[self.telemetry[tlmk]], chunks=True,
-                                                        maxshape=(None, len(self.telemetry[tlmk])))
-                        else:
-                            self.tlm_hdf.create_dataset(tlmk, data=[[self.telemetry[tlmk]]],
-                                                        chunks=True, maxshape=(None, 1))
-                    except:
-                        self.logger.logger.error("HDF5 WRITE TLM ERROR in ", tlmk, "\nData: ", self.telemetry[tlmk])
-                else:
-                    if type(self.telemetry[tlmk]) is list:
-                        self.tlm_hdf[tlmk].resize((self.tlm_hdf[tlmk].shape[0] +
-                                                   np.array([self.tlm_hdf[tlmk]]).shape[0]), axis=0)
-                        self.tlm_hdf[tlmk][-np.array([self.telemetry[tlmk]]).shape[0]:] = np.array([self.telemetry[tlmk]])
-                    else:
-                        self.tlm_hdf[tlmk].resize(self.tlm_hdf[tlmk].shape[0] + 1, axis=0)
-                        self.tlm_hdf[tlmk][-1] = self.telemetry[tlmk]
+            try:
+                self.tlm_hdf.append(self.telemetry)
+            except Exception as e:
+                self.logger.error("Could not write telemetry to HDF5 file: %s" % e)
 
     # def getTiles(self):
     #     try:
@@ -3,6 +3,10 @@ import datetime
 import subprocess
 import calendar
 import time
+import bisect
+import threading
+import logging
+from collections import OrderedDict
 
 import h5py
 import numpy as np
@@ -469,21 +473,41 @@ def calcSpectra(vett):
     return np.real(spettro)
 
 
-def calcolaspettro(dati, nsamples=32768, log=True):
-    n = int(nsamples)  # split and average number, from 128k to 16 of 8k # aavs1 federico
-    sp = [dati[x:x + n] for x in range(0, len(dati), n)]
-    mediato = np.zeros(len(calcSpectra(sp[0])))
-    for k in sp:
-        singolo = calcSpectra(k)
-        mediato[:] += singolo
-    mediato[:] /= (2 ** 15 / nsamples)  # federico
+# Hanning windows used by calcola_spettri, by number of samples
+_windows = {}
+
+
+def hanning_window(nsamples):
+    """ Return a read-only Hanning window of nsamples points, computed once per size
+    :param nsamples: Number of points in the window """
+    window = _windows.get(nsamples)
+    if window is None:
+        window = np.hanning(nsamples)
+        window.setflags(write=False)
+        _windows[nsamples] = window
+    return window
+
+
+def calcola_spettri(dati, nsamples=32768, log=True):
+    """ Compute averaged spectra, RF power and ADU RMS of many inputs at once. The samples on the last axis
+    of dati are reshaped into [segments, nsamples] and a single rfft is run over all inputs, polarisations
+    and segments, with the same normalisation as calcSpectra and calcolaspettro
+    :param dati: Raw ADC samples with shape [..., samples], for example [inputs, pols, samples]
+    :param nsamples: Number of samples per spectrum, trailing samples not filling a segment are ignored
+    :param log: Return spectra in dB if True, in linear power otherwise
+    :return: Spectra with shape [..., nsamples / 2 + 1], RF power in dBm and ADU RMS with shape [...] """
+    n = int(nsamples)
+    dati = np.asarray(dati)
+    nof_segments = dati.shape[-1] // n
+    segmenti = dati[..., :nof_segments * n].reshape(dati.shape[:-1] + (nof_segments, n))
+    spettri = np.abs(np.fft.rfft(segmenti * hanning_window(n), axis=-1))
+    # Amplitude correction factor 2 over the number of channels, summed over segments
+    mediato = np.sum(spettri, axis=-2) * (2. / spettri.shape[-1]) / (2 ** 15 / nsamples)
     with np.errstate(divide='ignore', invalid='ignore'):
-        mediato[:] = 20 * np.log10(mediato / 127.0)
-    d = np.array(dati, dtype=np.int64)
+        mediato = 20 * np.log10(mediato / 127.0)
+    d = dati.astype(np.int64)
     with np.errstate(divide='ignore', invalid='ignore'):
-        adu_rms = np.sqrt(np.mean(np.power(d, 2), 0))
-    if adu_rms == np.nan:
-        adu_rms = 0
+        adu_rms = np.sqrt(np.mean(np.power(d, 2), axis=-1))
     volt_rms = adu_rms * (1.7 / 256.)
     with np.errstate(divide='ignore', invalid='ignore'):
         power_adc = 10 * np.log10(np.power(volt_rms, 2) / 400.) + 30
@@ -493,6 +517,10 @@ def calcolaspettro(dati, nsamples=32768, log=True):
     return mediato, power_rf, adu_rms
 
 
+def calcolaspettro(dati, nsamples=32768, log=True):
+    return calcola_spettri(dati, nsamples, log)
+
+
 def dircheck(directory="", tile=1):
     # Check directory
     lista = sorted(glob.glob(directory + "/raw_burst_%d_*hdf5" % int(tile)))
@@ -535,6 +563,167 @@ def read_data(fmanager=None, hdf5_file="", tile=1, nof_tiles=16):
     return t, d
 
 
+# Default memory ceiling, in MB, of the raw captures cached by PlaybackDataset
+DEFAULT_PLAYBACK_MEMORY = 2048
+
+# Default number of files PlaybackDataset reads ahead of the last accessed one
+DEFAULT_PLAYBACK_PREFETCH = 8
+
+
+class PlaybackDataset(object):
+    """ Lazy, bounded-memory view of the raw burst files of a tile. File timestamps are indexed from the file names
+    when the dataset is created, captures are read on demand into an LRU cache bounded by a memory ceiling, and a
+    background thread reads the files following the last accessed one, so that sequential scans stream through the
+    data. Items are dictionaries with the capture 'timestamp' and 'data' [inputs, pols, samples], as returned by
+    read_data, or None if the file cannot be read """
+
+    def __init__(self, directory="", tile=1, max_memory=DEFAULT_PLAYBACK_MEMORY,
+                 prefetch=DEFAULT_PLAYBACK_PREFETCH):
+        """ Class constructor
+        :param directory: Directory containing the raw burst files
+        :param tile: Tile whose files are indexed
+        :param max_memory: Maximum size, in MB, of the cached captures
+        :param prefetch: Number of files read ahead of the last accessed one, 0 to disable prefetching """
+        self.directory = directory
+        self.tile = int(tile)
+        self.max_memory = int(max_memory * 1024 * 1024)
+        self.prefetch = prefetch
+
+        self.files = sorted(glob.glob(directory + "/raw_burst_%d_*hdf5" % self.tile))
+        self.timestamps = [fname_to_tstamp(f[-21:-7]) for f in self.files]
+
+        # The file manager keeps the state of the last loaded file, so reads are serialised
+        self._file_manager = RawFormatFileManager(root_path=directory, daq_mode=FileDAQModes.Burst)
+        self._read_lock = threading.Lock()
+
+        # Cached captures, in least to most recently used order, and their total size in bytes
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._capture_size = 0
+        self._lock = threading.Lock()
+
+        # Window of files requested to the prefetch thread
+        self._prefetch_window = None
+        self._prefetch_condition = threading.Condition(self._lock)
+        self._stop = False
+        self._prefetch_thread = None
+        if self.prefetch > 0:
+            self._prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self._prefetch_thread.start()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, k):
+        """ Get a capture, reading it if not cached, and schedule the following files for prefetching
+        :param k: Index of the file """
+        if not 0 <= k < len(self.files):
+            raise IndexError("File index %d out of range" % k)
+        self._schedule_prefetch(k + 1)
+        capture = self._get(k)
+        if capture is None:
+            return None
+        return {'timestamp': capture[0], 'data': capture[1]}
+
+    def close(self):
+        """ Stop the prefetch thread and release the cached captures """
+        with self._lock:
+            self._stop = True
+            self._prefetch_condition.notify()
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        with self._lock:
+            self._cache.clear()
+            self._cache_size = 0
+
+    def _get(self, k):
+        """ Get a capture from the cache, or read it from file
+        :param k: Index of the file
+        :return: Tuple of timestamp and data, or None if the file cannot be read """
+        with self._lock:
+            if k in self._cache:
+                self._cache.move_to_end(k)
+                return self._cache[k]
+
+        with self._read_lock:
+            # The capture may have been read by the prefetch thread while waiting
+            with self._lock:
+                if k in self._cache:
+                    self._cache.move_to_end(k)
+                    return self._cache[k]
+            capture = self._read(k)
+
+        if capture is not None:
+            self._insert(k, capture)
+        return capture
+
+    def _read(self, k):
+        """ Read a capture from file, with a single query over all its partitions. Must hold the read lock
+        :param k: Index of the file """
+        try:
+            # The file manager truncates the query to the number of samples in the file
+            d, t = self._file_manager.read_data(timestamp=self.timestamps[k], tile_id=self.tile,
+                                                n_samples=sys.maxsize)
+        except Exception:
+            logging.exception("Could not read %s" % self.files[k])
+            return None
+        if len(d) == 0:
+            return None
+        return int(self._file_manager.timestamp), d[antenna_mapping, :, :]
+
+    def _insert(self, k, capture):
+        """ Add a capture to the cache, evicting the least recently used captures above the memory ceiling
+        :param k: Index of the file
+        :param capture: Tuple of timestamp and data """
+        with self._lock:
+            if k in self._cache:
+                return
+            self._cache[k] = capture
+            self._cache_size += capture[1].nbytes
+            self._capture_size = capture[1].nbytes
+            while self._cache_size > self.max_memory and len(self._cache) > 1:
+                self._cache_size -= self._cache.popitem(last=False)[1][1].nbytes
+
+    def _schedule_prefetch(self, start):
+        """ Request the prefetch thread to read the files following an accessed one
+        :param start: Index of the first file to prefetch """
+        if self._prefetch_thread is None:
+            return
+        with self._lock:
+            # Never prefetch more captures than fit in the cache together with the accessed one
+            nof_files = self.prefetch
+            if self._capture_size > 0:
+                nof_files = min(nof_files, self.max_memory // self._capture_size - 1)
+            stop = min(start + nof_files, len(self.files))
+            if start < stop:
+                self._prefetch_window = (start, stop)
+                self._prefetch_condition.notify()
+
+    def _prefetch_loop(self):
+        """ Read the requested windows of files into the cache until the dataset is closed """
+        while True:
+            with self._lock:
+                while self._prefetch_window is None and not self._stop:
+                    self._prefetch_condition.wait()
+                if self._stop:
+                    return
+                start, stop = self._prefetch_window
+                self._prefetch_window = None
+
+            for k in range(start, stop):
+                with self._lock:
+                    # Move to a newer window as soon as one is requested
+                    if self._stop or self._prefetch_window is not None:
+                        break
+                    cached = k in self._cache
+                    if cached:
+                        # Files ahead of the accessed one must outlive the files already scanned
+                        self._cache.move_to_end(k)
+                if not cached:
+                    self._get(k)
+
+
 def calc_disk_usage(directory=".", pattern="*.hdf5"):
     cmd = "find " + directory + " -type f -name '" + pattern + "' -exec du -ch {} + | grep total"
     try:
@@ -1086,6 +1275,179 @@ class Archive:
         self.open = False
 
 
+class _DatasetColumn:
+    """ Sequence view of the first rows of a 1D dataset, reading single elements on access (used with bisect) """
+    def __init__(self, dataset, nof_rows):
+        self.dataset = dataset
+        self.nof_rows = nof_rows
+
+    def __len__(self):
+        return self.nof_rows
+
+    def __getitem__(self, index):
+        return self.dataset[index]
+
+
+class TelemetryArchive:
+    """
+    Columnar HDF5 telemetry archive.
+    Each call to append adds one row, made of a timestamp and the values of a set of attributes. Timestamps are
+    stored in a single "timestamp" dataset and each attribute in its own dataset of shape [rows, width], aligned row
+    by row with the timestamps. Attribute values missing from a row, or which are not numeric, are stored as NaN.
+    Values whose width differs from the attribute's dataset are also stored as NaN, and a warning is logged the
+    first time this happens for an attribute.
+    Rows are buffered in memory and written in blocks. Datasets are preallocated and their capacity doubled when
+    full, the number of valid rows is stored in the "nof_rows" file attribute and datasets are trimmed when the
+    archive is closed.
+    """
+    TIMESTAMP = "timestamp"
+
+    def __init__(self, hfile, mode='a', block_size=32, flush_interval=10.0):
+        """
+        :param hfile: HDF5 file path
+        :param mode: h5py file mode
+        :param block_size: Number of buffered rows after which the buffer is written to file
+        :param flush_interval: Maximum time, in seconds, rows are kept in the buffer
+        """
+        self.hfile = h5py.File(hfile, mode)
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.open = True
+
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._last_flush = time.time()
+        self._width_mismatches = set()
+        if self.TIMESTAMP in self.hfile:
+            self.nof_rows = int(self.hfile.attrs.get('nof_rows', len(self.hfile[self.TIMESTAMP])))
+        else:
+            self.nof_rows = 0
+
+    def keys(self):
+        with self._lock:
+            return [name for name in self.hfile.keys() if name != self.TIMESTAMP]
+
+    def __len__(self):
+        with self._lock:
+            return self.nof_rows + len(self._buffer)
+
+    def append(self, data, timestamp=None):
+        """ Add a row
+        :param data: Dictionary of attribute values, scalars or lists
+        :param timestamp: Row timestamp, in seconds since epoch. Defaults to current time """
+        timestamp = time.time() if timestamp is None else timestamp
+        row = {name: self._to_array(value) for name, value in data.items()}
+        with self._lock:
+            self._buffer.append((timestamp, row))
+            if len(self._buffer) >= self.block_size or time.time() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """ Write buffered rows to file """
+        with self._lock:
+            self._last_flush = time.time()
+            if len(self._buffer) == 0:
+                return
+
+            nof_new = len(self._buffer)
+            start, end = self.nof_rows, self.nof_rows + nof_new
+
+            # Collect new columns, attributes which are not in the buffered rows are filled with NaN
+            timestamps = np.array([timestamp for timestamp, _ in self._buffer], dtype=np.float64)
+            names = set(self.keys())
+            for _, row in self._buffer:
+                names.update(row.keys())
+
+            self._reserve(self.TIMESTAMP, 1, end)
+            self.hfile[self.TIMESTAMP][start:end] = timestamps
+            for name in names:
+                width = self.hfile[name].shape[1] if name in self.hfile else \
+                    max(row[name].size for _, row in self._buffer if name in row)
+                block = np.full((nof_new, width), np.nan)
+                for i, (_, row) in enumerate(self._buffer):
+                    if name not in row:
+                        continue
+                    if row[name].size == width:
+                        block[i] = row[name]
+                    elif name not in self._width_mismatches:
+                        self._width_mismatches.add(name)
+                        logging.warning("Telemetry attribute %s has %d values, expected %d, storing NaN instead"
+                                        % (name, row[name].size, width))
+                self._reserve(name, width, end)
+                self.hfile[name][start:end] = block
+
+            self.nof_rows = end
+            self.hfile.attrs['nof_rows'] = end
+            self.hfile.flush()
+            self._buffer = []
+
+    def read(self, name, start_time=None, end_time=None):
+        """ Read the rows of an attribute in a time range
+        :param name: Attribute name
+        :param start_time: Start of time range (inclusive), None for first row
+        :param end_time: End of time range (exclusive), None for last row
+        :return: Array of timestamps and array of values with shape [rows, width] """
+        with self._lock:
+            self.flush()
+            start, end = self.time_range(start_time, end_time)
+            timestamps = self.hfile[self.TIMESTAMP][start:end] if self.nof_rows > 0 else np.zeros(0)
+            if name not in self.hfile:
+                return timestamps, np.full((end - start, 1), np.nan)
+            return timestamps, self.hfile[name][start:end]
+
+    def time_range(self, start_time=None, end_time=None):
+        """ Binary search the timestamp column for the rows in a time range
+        :param start_time: Start of time range (inclusive), None for first row
+        :param end_time: End of time range (exclusive), None for last row
+        :return: First and last + 1 row index """
+        with self._lock:
+            if self.nof_rows == 0:
+                return 0, 0
+            column = _DatasetColumn(self.hfile[self.TIMESTAMP], self.nof_rows)
+            start = 0 if start_time is None else bisect.bisect_left(column, start_time)
+            end = self.nof_rows if end_time is None else bisect.bisect_left(column, end_time, lo=start)
+            return start, end
+
+    def close(self):
+        with self._lock:
+            if not self.open:
+                return
+            self.flush()
+            # Trim preallocated rows
+            for name in list(self.hfile.keys()):
+                if self.hfile[name].shape[0] > self.nof_rows:
+                    self.hfile[name].resize(self.nof_rows, axis=0)
+            self.hfile.close()
+            self.open = False
+
+    def _reserve(self, name, width, nof_rows):
+        """ Create or grow a dataset so that it can hold nof_rows rows, doubling its capacity when full """
+        if name not in self.hfile:
+            shape, maxshape = ((nof_rows,), (None,)) if name == self.TIMESTAMP else ((nof_rows, width), (None, width))
+            capacity = max(self.block_size, nof_rows)
+            self.hfile.create_dataset(name, shape=(capacity,) + shape[1:], maxshape=maxshape, dtype=np.float64,
+                                      chunks=(self.block_size,) + shape[1:], fillvalue=np.nan)
+        elif self.hfile[name].shape[0] < nof_rows:
+            self.hfile[name].resize(max(nof_rows, 2 * self.hfile[name].shape[0]), axis=0)
+
+    @staticmethod
+    def _to_array(value):
+        """ Convert an attribute value to a 1D float array, non numeric values are converted to NaN """
+        try:
+            return np.asarray(value, dtype=np.float64).ravel()
+        except (TypeError, ValueError):
+            if isinstance(value, (list, tuple)):
+                return np.array([TelemetryArchive._to_scalar(v) for v in value], dtype=np.float64)
+            return np.array([np.nan])
+
+    @staticmethod
+    def _to_scalar(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+
 class MapCanvas(FigureCanvas):
     def __init__(self, parent=None, dpi=80, size=(9.8, 9.8)):
         self.dpi = dpi
@@ -8,6 +8,7 @@ from matplotlib.figure import Figure
 from past.utils import old_div
 
 import aavs_calibration.common as db
+from aavs_calibration import cache
 
 
 def station_list():
@@ -17,7 +18,7 @@ def station_list():
 def get_nof_tiles(station):
     """ Return number of antennas in station"""
     # TODO: Make better
-    base, _, _ = db.get_antenna_positions(station)
+    base, _, _ = cache.get_cache().get_antenna_positions(station)
     return old_div(len(base), 16)
 
 
@@ -51,11 +52,11 @@ def generate_fibre_delay_plot():
 def generate_antenna_delay_plot(station):
     """ Generate antenna delay plot """
 
-    _, _, _, delays = db.get_latest_calibration_solution(station, True)
+    _, _, _, delays = cache.get_cache().get_latest_calibration_solution(station, True)
     delays = delays * 1e3
 
     # Get antenna locations
-    base, x, y = db.get_antenna_positions(station)
+    base, x, y = cache.get_cache().get_antenna_positions(station)
 
     # Generate plot for X
     fig = Figure(figsize=(18, 8))